@@ -1,7 +1,7 @@
 from flask import Flask
 from config import config_map
 import os
-from app import db
+from app import db, serializer, http_cache
 
 # Import socketio from the new module
 from app.socket_events import socketio 
@@ -11,6 +11,16 @@ def create_app():
 
     env_name = os.environ.get('FLASK_ENV', 'development')
     app.config.from_object(config_map[env_name])
+    # jsonify / tojson encode ObjectIds and datetimes directly (orjson when installed)
+    app.json = serializer.JSONProvider(app)
+    # Large JSON responses are gzip/brotli-compressed for clients that accept it
+    app.after_request(http_cache.compress)
+
+    # A bad ingest format would otherwise only show up as a warning on every upload
+    from app.imaging import INGEST_FORMATS
+    if app.config['CAPTURE_INGEST_ENABLED'] and app.config['CAPTURE_INGEST_FORMAT'] not in INGEST_FORMATS:
+        raise ValueError(f"CAPTURE_INGEST_FORMAT must be one of {', '.join(INGEST_FORMATS)}, "
+                         f"got {app.config['CAPTURE_INGEST_FORMAT']!r}")
 
     db.init_app(app)
 
@@ -18,19 +28,40 @@ def create_app():
     def inject_socket_url():
         # In this Integrated architecture, the Socket URL is the SAME as the Web URL.
         # So we can often just use empty string or window.location in JS.
-        return dict(socket_server_url=app.config['SOCKET_SERVER_URL'])
+        return dict(socket_server_url=app.config['SOCKET_SERVER_URL'],
+                    max_cameras=app.config['MAX_CAMERAS'])
 
     from app.blueprints.home import home_bp
     from app.blueprints.parts import parts_bp
     from app.blueprints.kitting import kitting_bp
+    from app.blueprints.analytics import analytics_bp
 
     app.register_blueprint(home_bp)
     app.register_blueprint(parts_bp)
     app.register_blueprint(kitting_bp)
+    app.register_blueprint(analytics_bp)
 
     # Initialize SocketIO with the App
     # --- FIX IS HERE: Add cors_allowed_origins="*" ---
     # async_mode='eventlet' ensures it uses the right worker
-    socketio.init_app(app, cors_allowed_origins="*", async_mode='eventlet')
+    # (run_asgi.py switches to 'threading': sockets are then served by app/asgi.py)
+    socketio.init_app(app, cors_allowed_origins="*", async_mode=app.config['SOCKETIO_ASYNC_MODE'], json=serializer)
+
+    # Background jobs
+    if app.config['CAPTURE_ARCHIVE_ENABLED'] or app.config['CAPTURE_QUOTA_MB_PER_TABLE'] > 0:
+        from app import archiver
+        archiver.start(app)
+
+    if app.config['COLD_ARCHIVE_ENABLED']:
+        from app import cold_store
+        cold_store.start(app)
+
+    if app.config['DETECTION_WRITE_BEHIND'] and app.config['TABLE_WORKERS'] == 0:
+        from app import detection_buffer
+        detection_buffer.start(app)
+
+    if app.config['TABLE_WORKERS'] > 0:
+        from app import table_workers
+        table_workers.start(app)
 
     return app
\ No newline at end of file
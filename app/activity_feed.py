@@ -0,0 +1,172 @@
+import logging
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo.errors import OperationFailure
+
+from app.config import Config
+from app import serializer
+from app.kitting_core import activity_cameras, cam_state, is_locked, COMPACT_PROJECTION
+
+# Change feed of activity state for dashboards and MES integrations (GET /kitting/api/feed).
+# Each event carries the compact state of one activity and a resume token; a consumer that
+# reconnects with Last-Event-ID gets every change it missed, in order.
+#
+# Two backends, chosen once per process (FEED_BACKEND = auto | change_stream | event_log):
+# - change_stream: MongoDB change streams on db.activities (replica set / sharded cluster).
+#   Tokens are the stream's resume tokens: "cs:<_data>".
+# - event_log: standalone MongoDB. Writers append {activity_id, table_id, kind} to
+#   db.activity_events and the feed polls it in _id order. ObjectIds start with their creation
+#   second, so no shared counter is needed; the feed only reads events older than
+#   FEED_GAP_WAIT_SEC, by which time every writer's insert of that second has landed.
+#   Tokens: "log:<ObjectId>".
+# Both look the activity up when the event is sent, so an event carries the latest state.
+# Recording is best-effort: it runs after the state write it reports, so it never fails it.
+
+CHANGE_STREAM = "change_stream"
+EVENT_LOG = "event_log"
+
+_backend = None
+log = logging.getLogger(__name__)
+
+
+def backend(db):
+    """Backend for this deployment: change streams need a replica set or mongos."""
+    global _backend
+    if _backend is None:
+        if Config.FEED_BACKEND != "auto":
+            _backend = Config.FEED_BACKEND
+        else:
+            hello = db.client.admin.command("hello")
+            _backend = CHANGE_STREAM if hello.get("setName") or hello.get("msg") == "isdbgrid" else EVENT_LOG
+    return _backend
+
+
+def activity_state(activity):
+    """Compact, JSON-ready state of one activity (what dashboards render)."""
+    return {
+        "activity_id": str(activity['_id']),
+        "table_id": activity.get('table_id'),
+        "kit_name": activity.get('kit_name'),
+        "status": activity.get('status'),
+        "version": activity.get('version', 0),
+        "total_kits": activity.get('total_kits_to_pack', 1),
+        "locked": is_locked(activity),
+        "cams": {cam: {"kit_index": cam_state(activity, cam)['kit_index'],
+                       "errors": len(cam_state(activity, cam)['errors'])}
+                 for cam in activity_cameras(activity)},
+        "components": [{
+            "name": p.get('name'),
+            "camera": p.get('camera'),
+            "found_quantity": p.get('found_quantity', 0),
+            "quantity": p.get('quantity', 1),
+            "status": p.get('status')
+        } for p in activity.get('components', [])]
+    }
+
+
+# --- WRITERS (event_log backend only) ---
+def _event(activity_id, table_id, kind):
+    return {"_id": ObjectId(), "activity_id": activity_id, "table_id": str(table_id),
+            "kind": kind, "at": datetime.utcnow()}
+
+def record(db, activity_id, table_id, kind):
+    """Logs a change of an activity. No-op when change streams do the job."""
+    try:
+        if backend(db) == EVENT_LOG:
+            db.activity_events.insert_one(_event(activity_id, table_id, kind))
+    except Exception as e:
+        log.warning(f"Feed event '{kind}' not recorded for activity {activity_id}: {e}")
+
+async def record_async(db, activity_id, table_id, kind):
+    """record() for Motor (asyncio mode). The backend is decided by the Flask side at startup."""
+    if _backend != EVENT_LOG:
+        return
+    try:
+        await db.activity_events.insert_one(_event(activity_id, table_id, kind))
+    except Exception as e:
+        log.warning(f"Feed event '{kind}' not recorded for activity {activity_id}: {e}")
+
+
+# --- READERS ---
+def _sse(token, event, data):
+    return f"id: {token}\nevent: {event}\ndata: {serializer.dumps(data)}\n\n"
+
+def _heartbeat():
+    return ": keep-alive\n\n"
+
+
+def stream_change_stream(db, token, table_id, sleep):
+    """SSE lines from a change stream, resumed after token ('cs:<_data>') if given."""
+    match = {"operationType": {"$in": ["insert", "update", "replace"]}}
+    if table_id:
+        match["fullDocument.table_id"] = table_id
+    pipeline = [{"$match": match},
+                {"$project": {f"fullDocument.{k}": 0 for k in COMPACT_PROJECTION}}]
+    resume_after = {"_data": token[3:]} if token and token.startswith("cs:") else None
+    try:
+        stream = db.activities.watch(pipeline, full_document="updateLookup", resume_after=resume_after,
+                                     max_await_time_ms=Config.FEED_HEARTBEAT_SEC * 1000)
+    except OperationFailure:
+        # Token too old for the oplog: the consumer has to reload everything
+        yield _sse("", "reset", {"reason": "resume token expired"})
+        stream = db.activities.watch(pipeline, full_document="updateLookup",
+                                     max_await_time_ms=Config.FEED_HEARTBEAT_SEC * 1000)
+    with stream:
+        while stream.alive:
+            change = stream.try_next()
+            if change is None:
+                yield _heartbeat()
+                continue
+            if change.get('fullDocument'):
+                yield _sse(f"cs:{change['_id']['_data']}", "activity", activity_state(change['fullDocument']))
+
+
+def _settled_before():
+    """Events with a smaller _id are all inserted: their second ended FEED_GAP_WAIT_SEC ago."""
+    return ObjectId.from_datetime(datetime.utcnow() - timedelta(seconds=Config.FEED_GAP_WAIT_SEC))
+
+def stream_event_log(db, token, table_id, sleep):
+    """SSE lines from db.activity_events, resumed after token ('log:<ObjectId>') if given."""
+    last = None
+    if token and token.startswith("log:"):
+        try:
+            last = ObjectId(token[4:])
+        except InvalidId:
+            pass
+        expired = datetime.utcnow() - timedelta(seconds=Config.FEED_EVENT_TTL_SEC)
+        if last is None or last.generation_time.replace(tzinfo=None) < expired:
+            # Unknown token, or events after it may have expired: the consumer has to reload
+            yield _sse("", "reset", {"reason": "resume token expired"})
+            last = None
+    if last is None:
+        last = _settled_before()   # Start from now
+
+    idle_since = time.monotonic()
+    while True:
+        events = list(db.activity_events.find({"_id": {"$gt": last, "$lt": _settled_before()}})
+                      .sort("_id", 1).limit(Config.FEED_BATCH))
+        for event in events:
+            last = event['_id']
+            if table_id and event['table_id'] != table_id:
+                continue
+            activity = db.activities.find_one({"_id": event['activity_id']}, COMPACT_PROJECTION)
+            if activity:
+                yield _sse(f"log:{last}", "activity", activity_state(activity))
+                idle_since = time.monotonic()
+
+        if time.monotonic() - idle_since >= Config.FEED_HEARTBEAT_SEC:
+            yield _heartbeat()
+            idle_since = time.monotonic()
+        sleep(Config.FEED_POLL_SEC)
+
+
+def stream(db, token=None, table_id=None, sleep=time.sleep):
+    """Generator of SSE text for GET /kitting/api/feed."""
+    yield "retry: 2000\n\n"
+    if backend(db) == CHANGE_STREAM:
+        yield from stream_change_stream(db, token, table_id, sleep)
+    else:
+        yield from stream_event_log(db, token, table_id, sleep)
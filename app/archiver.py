@@ -0,0 +1,339 @@
+import json
+import os
+import struct
+import tempfile
+import threading
+import traceback
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from pymongo import ReplaceOne, ReturnDocument
+
+from app.config import Config
+from app.storage import get_storage, key_from_url
+from app.imaging import DERIVATIVE_SIZES, DERIVED_PREFIX, derivative_key
+
+# Bundle layout (all captures of one activity in a single file):
+#   [member bytes][member bytes]...[JSON index][8-byte index length][MAGIC]
+# The JSON index maps key -> [offset, length] so the file is self-describing;
+# db.capture_index holds the same offsets for O(1) lookups from get_image. It is keyed by the
+# storage key alone (all a capture URL carries), which is unique per upload (storage.new_capture_key).
+BUNDLE_MAGIC = b"KITPACK1"
+BUNDLE_PREFIX = "_bundles/"
+
+
+def bundle_key(activity_id):
+    return f"{BUNDLE_PREFIX}{activity_id}.pack"
+
+
+# --- HELPER: COLLECT EVERY CAPTURE REFERENCED BY AN ACTIVITY ---
+def collect_capture_keys(activity, db, history=None, errors=None):
+    """
+    Returns the storage keys of all images an activity's documents point to.
+    history / errors default to the job's kit_history and error_logs rows (cold jobs pass their own).
+    """
+    urls = []
+
+    def from_components(components):
+        for part in components or []:
+            urls.append(part.get('last_image_url'))
+            captures = part.get('captured_images', [])
+            if isinstance(captures, dict): captures = list(captures.values())
+            for cap in captures:
+                urls.append(cap.get('image_url') if isinstance(cap, dict) else cap)
+
+    def from_errors(errors):
+        for err in errors or []:
+            details = err.get('error_details') or {}
+            urls.append(details.get('imageUrl') or err.get('imageUrl'))
+
+    from_components(activity.get('components'))
+    urls.extend(cap.get('image_url') for cap in activity.get('late_captures') or [])   # app/detection_buffer.py
+    for state in (activity.get('cams') or {}).values():
+        from_errors(state.get('errors'))
+
+    if history is None: history = db.kit_history.find({"activity_id": activity['_id']})
+    if errors is None: errors = db.error_logs.find({"activity_id": activity['_id']})
+
+    for hist in history:
+        from_components(hist.get('components_snapshot'))
+        from_errors(hist.get('errors_snapshot'))
+        urls.append(hist.get('validation_image_url'))
+
+    from_errors(errors)
+
+    keys = []
+    seen = set()
+    for url in urls:
+        key = key_from_url(url)
+        if key and key not in seen and not key.startswith((BUNDLE_PREFIX, DERIVED_PREFIX)):
+            seen.add(key)
+            keys.append(key)
+    return keys
+
+
+# --- HELPER: ONE PROCESS AT A TIME PER ACTIVITY ---
+# The housekeeping loop runs in every web process. Packing or evicting an activity's captures
+# first claims it (captures_claim), so two processes never pack or delete the same files at once.
+# A claim older than CAPTURE_CLAIM_STALE_SEC belonged to a process that died: it is taken over.
+def claim_captures(db, activity_id, query, projection=None):
+    """The activity, claimed, if it still matches query and nobody else holds it; else None."""
+    now = datetime.utcnow()
+    return db.activities.find_one_and_update(
+        {"_id": activity_id, **query, "$or": [
+            {"captures_claim": {"$exists": False}},
+            {"captures_claim.at": {"$lt": now - timedelta(seconds=Config.CAPTURE_CLAIM_STALE_SEC)}}
+        ]},
+        {"$set": {"captures_claim": {"at": now}}},
+        projection=projection, return_document=ReturnDocument.AFTER
+    )
+
+
+def release_captures(db, activity_id):
+    db.activities.update_one({"_id": activity_id}, {"$unset": {"captures_claim": ""}})
+
+
+# --- PACKING ---
+ARCHIVE_PROJECTION = {"components": 1, "cams": 1, "late_captures": 1, "capture_stats": 1}
+
+def archive_activity(activity, db):
+    """
+    Packs an activity's loose captures into one bundle, indexes the members and
+    removes the loose files. Returns the number of members packed.
+    """
+    storage = get_storage()
+    activity_id = str(activity['_id'])
+    key = bundle_key(activity_id)
+
+    originals = collect_capture_keys(activity, db)
+    # Thumbnails / previews built so far go into the same bundle
+    derived = [derivative_key(k, size) for k in originals for size in DERIVATIVE_SIZES]
+    keys = [k for k in originals + derived if storage.exists(k)]
+    index = OrderedDict()
+
+    # Build the bundle in a local temp file, then hand it to the storage backend in one upload
+    fd, tmp_path = tempfile.mkstemp(suffix=".pack")
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            offset = 0
+            for member in keys:
+                data = storage.read(member)
+                out.write(data)
+                index[member] = [offset, len(data)]
+                offset += len(data)
+            raw_index = json.dumps(index).encode('utf-8')
+            out.write(raw_index)
+            out.write(struct.pack(">Q", len(raw_index)))
+            out.write(BUNDLE_MAGIC)
+
+        with open(tmp_path, 'rb') as f:
+            bundle_bytes = storage.save(key, f, "application/octet-stream")
+    finally:
+        os.remove(tmp_path)
+
+    # Index first, delete loose files last: a crash in between only leaves duplicates behind,
+    # and the next run simply re-packs (upserts keep the index consistent).
+    if index:
+        db.capture_index.bulk_write([
+            ReplaceOne({"_id": member}, {
+                "_id": member,
+                "bundle": key,
+                "offset": start,
+                "length": length,
+                "activity_id": activity['_id']
+            }, upsert=True)
+            for member, (start, length) in index.items()
+        ], ordered=False)
+
+    db.activities.update_one({"_id": activity['_id']}, {"$set": {
+        "captures_bundle": {
+            "key": key,
+            "members": len(index),
+            "bytes": bundle_bytes,
+            "archived_at": datetime.utcnow()
+        }
+    }})
+
+    for member in index:
+        storage.delete(member)
+
+    return len(index)
+
+
+def archive_pending(db, logger=None):
+    """Archives finished activities that have no bundle yet (oldest first)."""
+    cutoff = datetime.utcnow() - timedelta(seconds=Config.CAPTURE_ARCHIVE_GRACE_SEC)
+    unpacked = {"captures_bundle": {"$exists": False}, "captures_evicted": {"$exists": False}}
+    pending = db.activities.find({"status": "completed_job", "end_time": {"$lt": cutoff}, **unpacked}, {"_id": 1}) \
+        .sort("end_time", 1).limit(Config.CAPTURE_ARCHIVE_BATCH)
+
+    packed = 0
+    for candidate in list(pending):
+        activity = claim_captures(db, candidate['_id'], unpacked, ARCHIVE_PROJECTION)
+        if activity is None:
+            continue   # Another process packs (or packed) it
+        try:
+            count = archive_activity(activity, db)
+        finally:
+            release_captures(db, activity['_id'])
+        packed += count
+        if logger: logger.info(f"📦 Archived {count} captures for activity {activity['_id']}")
+    return packed
+
+
+# --- DISK BUDGET ---
+def delete_activity_captures(activity, db, history=None, errors=None):
+    """Deletes every capture of a finished activity (loose, derived and bundled). Returns bytes freed."""
+    storage = get_storage()
+    originals = collect_capture_keys(activity, db, history, errors)
+    # Captures stored before keys were unique may carry the same key as another job's capture:
+    # the one indexed for that job is its own, leave it (and its index entry) alone
+    shared = {doc['_id'] for doc in db.capture_index.find(
+        {"_id": {"$in": originals}, "activity_id": {"$ne": activity['_id']}}, {"_id": 1})}
+    originals = [key for key in originals if key not in shared]
+    for key in originals + [derivative_key(k, size) for k in originals for size in DERIVATIVE_SIZES]:
+        storage.delete(key)
+
+    bundle = activity.get('captures_bundle')
+    if bundle:
+        storage.delete(bundle['key'])
+        forget_bundle(bundle['key'])
+    db.capture_index.delete_many({"activity_id": activity['_id']})
+    return (activity.get('capture_stats') or {}).get('bytes_stored', 0)
+
+
+def evict_activity_captures(activity, db):
+    """delete_activity_captures for a hot activity, recorded on the job."""
+    freed = delete_activity_captures(activity, db)
+    db.activities.update_one({"_id": activity['_id']}, {"$set": {
+        "captures_evicted": {"at": datetime.utcnow(), "bytes": freed}
+    }})
+    return freed
+
+
+def enforce_capture_quota(db, logger=None):
+    """
+    Keeps each table's capture usage under CAPTURE_QUOTA_MB_PER_TABLE by evicting the
+    captures of its least recently finished activities first. Live jobs are never touched.
+    Jobs moved to cold storage still count and, being the oldest, go first.
+    """
+    from app import cold_store
+
+    quota = Config.CAPTURE_QUOTA_MB_PER_TABLE * 1024 * 1024
+    if quota <= 0:
+        return 0
+
+    cold_fields = {"table_id": 1, "capture_stats": 1, "captures_evicted": 1}
+    usage = db.activities.aggregate([
+        {"$unionWith": {"coll": cold_store.COLD_COLLECTION, "pipeline": [{"$project": cold_fields}]}},
+        {"$match": {"captures_evicted": {"$exists": False}}},
+        {"$group": {"_id": "$table_id", "bytes": {"$sum": "$capture_stats.bytes_stored"}}},
+        {"$match": {"bytes": {"$gt": quota}}}
+    ])
+
+    freed_total = 0
+    for row in usage:
+        table_id, used = row['_id'], row['bytes']
+        cold = db[cold_store.COLD_COLLECTION].find({
+            "table_id": table_id,
+            "captures_evicted": {"$exists": False}
+        }, {"blob": 0}).sort("end_time", 1)
+
+        for header in cold:
+            if used <= quota:
+                break
+            freed = cold_store.evict_captures(db, header)
+            used -= freed
+            freed_total += freed
+            if logger: logger.info(f"🧹 Quota: evicted {freed} bytes of captures from archived activity {header['_id']} (Table {table_id})")
+
+        finished = db.activities.find({
+            "table_id": table_id,
+            "status": {"$ne": "on-going"},
+            "captures_evicted": {"$exists": False}
+        }, {"_id": 1}).sort("end_time", 1)
+
+        for candidate in finished:
+            if used <= quota:
+                break
+            activity = claim_captures(db, candidate['_id'], {"captures_evicted": {"$exists": False}})
+            if activity is None:
+                continue   # Being packed (or evicted) by another process
+            try:
+                freed = evict_activity_captures(activity, db)
+            finally:
+                release_captures(db, activity['_id'])
+            used -= freed
+            freed_total += freed
+            if logger: logger.info(f"🧹 Quota: evicted {freed} bytes of captures from activity {activity['_id']} (Table {table_id})")
+    return freed_total
+
+
+# --- LOOKUP (used by get_image) ---
+_member_cache = OrderedDict()
+_member_cache_lock = threading.Lock()
+_MEMBER_CACHE_SIZE = 10000
+
+def find_member(db, key):
+    """Returns {'bundle', 'offset', 'length'} for an archived capture, or None."""
+    with _member_cache_lock:
+        member = _member_cache.get(key)
+        if member is not None:
+            _member_cache.move_to_end(key)
+            return member
+
+    member = db.capture_index.find_one({"_id": key}, {"bundle": 1, "offset": 1, "length": 1})
+    if member:
+        # Bundle members never move, so the lookup is safe to keep
+        with _member_cache_lock:
+            _member_cache[key] = member
+            while len(_member_cache) > _MEMBER_CACHE_SIZE:
+                _member_cache.popitem(last=False)
+    return member
+
+
+def forget_bundle(bundle):
+    """Drops a deleted bundle's members from this process's lookup cache."""
+    with _member_cache_lock:
+        for key in [k for k, m in _member_cache.items() if m['bundle'] == bundle]:
+            del _member_cache[key]
+
+
+def read_member(member):
+    """
+    Reads one archived capture straight out of its bundle (ranged read, no unpacking).
+    None if the bundle is gone: its captures were evicted (possibly by another process).
+    """
+    try:
+        return get_storage().read_range(member['bundle'], member['offset'], member['length'])
+    except FileNotFoundError:
+        forget_bundle(member['bundle'])
+        return None
+
+
+# --- BACKGROUND LOOP ---
+_started = False
+
+def start(app):
+    """Starts the capture housekeeping loop (archiving + disk quota) once per process."""
+    global _started
+    if _started:
+        return
+    _started = True
+
+    from app.socket_events import socketio
+    from app.db import get_db
+
+    def run():
+        while True:
+            socketio.sleep(Config.CAPTURE_ARCHIVE_INTERVAL_SEC)
+            try:
+                with app.app_context():
+                    db = get_db()
+                    if Config.CAPTURE_ARCHIVE_ENABLED:
+                        archive_pending(db, app.logger)
+                    enforce_capture_quota(db, app.logger)
+            except Exception as e:
+                app.logger.error(f"Capture housekeeping error: {e}\n{traceback.format_exc()}")
+
+    socketio.start_background_task(run)
@@ -0,0 +1,313 @@
+"""
+Native asyncio serving mode (run_asgi.py).
+
+- Socket.IO is served by python-socketio's AsyncServer with the same event names as
+  app/socket_events.py.
+- The hot AI endpoints (detection, table status) run natively on the event loop with
+  Motor (async MongoDB) and aiofiles, using the shared rules in app/kitting_core.py.
+- Every other route is the unchanged Flask app, mounted through a WSGI adapter that runs
+  it on a thread pool. Its socket emits are forwarded to the AsyncServer.
+
+Optional dependencies: python-socketio, starlette, a2wsgi, motor, aiofiles, uvicorn, python-multipart.
+"""
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import time
+import uuid
+
+import aiofiles
+import aiofiles.os
+import socketio
+from a2wsgi import WSGIMiddleware
+from motor.motor_asyncio import AsyncIOMotorClient
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse as StarletteJSONResponse
+from starlette.routing import Mount, Route
+
+from app import create_app
+from app.config import Config
+from app.db import get_db
+from app.idempotency import claim_detection_async, store_detection_response_async, release_detection_async
+from app.imaging import ingest_capture, schedule_derivatives
+from app.kitting_core import (
+    parse_detection, detection_record, capture_stats_inc, STATUS_PROJECTION, table_status,
+    detection_flow, run_async, retry_headers
+)
+from app.metrics import metrics, payload_size
+from app.socket_events import set_broadcaster, fleet_ping
+from app.fleet import FLEET_ROOM
+from app.storage import CAPTURE_URL_PREFIX, LocalStorage, get_storage, new_capture_key
+from app import table_workers, activity_feed, detection_events, detection_buffer, serializer
+
+class JSONResponse(StarletteJSONResponse):
+    """Same encoder as the Flask routes (app/serializer.py)."""
+    def render(self, content):
+        return serializer.dumps_bytes(content)
+
+
+sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins="*", json=serializer)
+log = logging.getLogger(__name__)   # Propagates to the Flask app's logger ("app")
+
+# Set on startup
+_mongo = None
+_loop = None
+
+def mongo():
+    return _mongo[Config.DB_NAME]
+
+
+# =========================================================================
+# SOCKET.IO EVENTS (same names and payloads as app/socket_events.py)
+# =========================================================================
+@sio.on('connect')
+async def handle_connect(sid, environ):
+    log.info("⚡ Client Connected")
+
+@sio.on('disconnect')
+async def handle_disconnect(sid):
+    log.info("❌ Client Disconnected")
+
+@sio.on('join_table')
+async def on_join(sid, data):
+    room = f"table_{data['table_id']}"
+    await sio.enter_room(sid, room)
+    log.info(f"👥 Client joined room: {room}")
+    await sio.emit('status_update', {'message': f'Joined {room}'}, room=room)
+
+@sio.on('join_fleet')
+async def on_join_fleet(sid, data=None):
+    await sio.enter_room(sid, FLEET_ROOM)
+
+async def emit_table(event, data, room):
+    """sio.emit to a table room, announcing the change to the fleet room like broadcast() does."""
+    await sio.emit(event, data, room=room)
+    ping = fleet_ping(event, data, room)
+    if ping:
+        await sio.emit('fleet_update', ping, room=FLEET_ROOM)
+
+@sio.on('ai_update')
+async def handle_ai_update(sid, data):
+    room = f"table_{data.get('table_id')}"
+    await sio.emit('ui_update', {
+        'type': 'step_completed',
+        'data': data,
+        'time': time.strftime("%H:%M:%S")
+    }, room=room)
+
+@sio.on('ui_command')
+async def handle_ui_command(sid, data):
+    await sio.emit('ai_command', data, room=f"table_{data.get('table_id')}")
+
+@sio.on('create_activity_signal')
+async def handle_creation_signal(sid, data):
+    await sio.emit('create_activity_signal', data, room=f"table_{data.get('tableId')}", skip_sid=sid)
+
+@sio.on('ai_handshake_response')
+async def handle_ai_handshake(sid, data):
+    await sio.emit('ai_handshake_response', data, room=f"table_{data.get('tableId')}")
+
+async def relay_cam_event(event, sid, data, include_self=True):
+    """Async twin of socket_events.relay_cam_event (binary attachments pass through untouched)."""
+    started = time.perf_counter()
+    await sio.emit(event, data, room=f"table_{data.get('tableId')}", skip_sid=None if include_self else sid)
+
+    metrics.incr(f"relay.{event}.count")
+    metrics.observe(f"relay.{event}.bytes", payload_size(data))
+    metrics.observe(f"relay.{event}.emit_ms", (time.perf_counter() - started) * 1000)
+    sent_at = data.get('sentAt')
+    if isinstance(sent_at, (int, float)):
+        metrics.observe(f"relay.{event}.transit_ms", max(time.time() * 1000 - sent_at, 0))
+
+def _register_cam_relays(cam):
+    async def capture(sid, data): await relay_cam_event(f'capture_{cam}_signal', sid, data, include_self=False)
+    async def ack(sid, data): await relay_cam_event(f'sending_{cam}_ack', sid, data)
+    async def result(sid, data): await relay_cam_event(f'{cam}_result', sid, data)
+    sio.on(f'capture_{cam}_signal', capture)
+    sio.on(f'sending_{cam}_ack', ack)
+    sio.on(f'{cam}_result', result)
+
+for _n in range(1, Config.MAX_CAMERAS + 1):
+    _register_cam_relays(f"cam{_n}")
+
+
+# =========================================================================
+# ASYNC CAPTURE STORAGE
+# =========================================================================
+async def store_capture_async(key, data, mimetype):
+    """Async twin of kitting.store_capture: CPU work off-loop, local writes via aiofiles."""
+    key, data, mimetype, saved = await asyncio.to_thread(ingest_capture, key, data, mimetype)
+    storage = get_storage()
+    if isinstance(storage, LocalStorage):
+        dest = storage.path(key)
+        await aiofiles.os.makedirs(os.path.dirname(dest), exist_ok=True)
+        tmp = f"{dest}.{uuid.uuid4().hex}.tmp"
+        async with aiofiles.open(tmp, 'wb') as f:
+            await f.write(data)
+        await aiofiles.os.replace(tmp, dest)
+    else:
+        await asyncio.to_thread(storage.save, key, data, mimetype)
+
+    schedule_derivatives(key, data)
+    if saved:
+        metrics.incr("ingest.bytes_saved", saved)
+    return key, len(data), saved
+
+
+# =========================================================================
+# NATIVE ASYNC ROUTES (same paths and responses as the kitting blueprint)
+# =========================================================================
+WORKER_UNAVAILABLE = ({"message": "Table worker unavailable", "code": "worker_unavailable"}, 503)
+
+async def worker_reply(table_id, op, **payload):
+    """The table owner's reply, or None if it can't be reached."""
+    try:
+        return await asyncio.to_thread(table_workers.call, table_id, op, **payload)
+    except (OSError, EOFError) as e:
+        log.error(f"❌ Table worker unreachable for Table {table_id}: {e}")
+        return None
+
+
+async def worker_response(reply):
+    """Emits the socket events a table worker returned and sends its answer."""
+    if reply is None:
+        return JSONResponse(*WORKER_UNAVAILABLE)
+    for event, data, room in reply['events']:
+        await emit_table(event, data, room)
+    return JSONResponse(reply['body'], reply['status'])
+
+
+async def forward_detection(request, table_id):
+    """See kitting.forward_detection."""
+    form = await request.form()
+    raw_payload = form.get('payload')
+    data = json.loads(raw_payload) if raw_payload else {}
+    det = parse_detection(data)
+    upload = form.get('image')
+    if upload is None or isinstance(upload, str):
+        return JSONResponse({"message": "No image provided"}, 422)
+
+    client_key = request.headers.get('Idempotency-Key') or data.get('idempotencyKey')
+
+    screened = await worker_reply(table_id, "screen", det=det, client_key=client_key)
+    if screened is None or not screened['body'].get('proceed'):
+        return await worker_response(screened)
+
+    key, stored_bytes, saved_bytes = await store_capture_async(
+        new_capture_key(f"table_{table_id}/{det['cam_id']}", upload.filename), await upload.read(),
+        upload.content_type or "image/jpeg"
+    )
+    image_url = f"{CAPTURE_URL_PREFIX}{key}"
+    reply = await worker_reply(table_id, "detection", det=det, image_url=image_url,
+                               record=detection_record(image_url, det),
+                               stats_inc=capture_stats_inc(stored_bytes, saved_bytes), client_key=client_key)
+    if reply is not None and reply.get('discard'):   # A retry or a lock overtook the screening
+        await asyncio.to_thread(get_storage().delete, key)
+    return await worker_response(reply)
+
+
+class AsyncDetectionIO:
+    """Async I/O for kitting_core.detection_flow (Motor, aiofiles); see kitting.DetectionIO."""
+
+    def __init__(self, db):
+        self.db = db
+        self.log = log
+        self.buffered = detection_buffer.enabled()
+
+    def claim(self, key):
+        return claim_detection_async(self.db, key)
+
+    def store(self, key, body, status_code):
+        return store_detection_response_async(self.db, key, body, status_code)
+
+    def release(self, key):
+        return release_detection_async(self.db, key)
+
+    async def capture(self, activity, cam_id, upload):
+        key, stored_bytes, saved_bytes = await store_capture_async(
+            new_capture_key(f"{activity['_id']}/{cam_id}", upload.filename), await upload.read(),
+            upload.content_type or "image/jpeg"
+        )
+        return f"{CAPTURE_URL_PREFIX}{key}", stored_bytes, saved_bytes
+
+    def feed(self, activity_id, table_id, kind):
+        return activity_feed.record_async(self.db, activity_id, table_id, kind)
+
+    def event(self, activity, det, at, matched):
+        return detection_events.record_async(self.db, activity, det, at, matched)
+
+    def emit(self, event, data, room):
+        return emit_table(event, data, room)
+
+    def buffer(self, activity_id, cam_id, kit_index, slot, record):
+        detection_buffer.add(activity_id, cam_id, kit_index, slot, record)
+
+    def writing(self, activity_id):
+        return detection_buffer.writing(activity_id)
+
+
+async def update_detection(request):
+    """POST /kitting/api/{table_id}/detection - see kitting.update_detection."""
+    table_id = request.path_params['table_id']
+    if table_workers.enabled():
+        return await forward_detection(request, table_id)
+
+    form = await request.form()
+    upload = form.get('image')
+    body, status_code = await run_async(detection_flow(
+        AsyncDetectionIO(mongo()), table_id, form.get('payload'), request.headers.get('Idempotency-Key'),
+        None if upload is None or isinstance(upload, str) else upload
+    ))
+    return JSONResponse(body, status_code, headers=retry_headers(status_code))
+
+
+async def check_table_status(request):
+    """GET /kitting/api/{table_id}/status - see kitting.check_table_status."""
+    table_id = request.path_params['table_id']
+    if table_workers.enabled():
+        return await worker_response(await worker_reply(table_id, "status"))
+
+    activity = await mongo().activities.find_one({"table_id": str(table_id), "status": "on-going"}, STATUS_PROJECTION)
+    return JSONResponse(table_status(activity), 200)
+
+
+# =========================================================================
+# APP FACTORY
+# =========================================================================
+def _threadsafe_emit(event, data, to=None):
+    """Broadcaster for Flask code running on the WSGI thread pool."""
+    asyncio.run_coroutine_threadsafe(sio.emit(event, data, room=to), _loop)
+
+
+def create_asgi_app():
+    flask_app = create_app()
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        global _mongo, _loop
+        _loop = asyncio.get_running_loop()
+        # One pooled Motor client per process
+        _mongo = AsyncIOMotorClient(Config.MONGO_URI, serverSelectionTimeoutMS=5000)
+        set_broadcaster(_threadsafe_emit)
+
+        # Create indexes through the Flask path once, before traffic arrives
+        def warm_up():
+            with flask_app.app_context():
+                activity_feed.backend(get_db())
+        await asyncio.to_thread(warm_up)
+
+        yield
+        _mongo.close()
+
+    web = Starlette(
+        routes=[
+            Route('/kitting/api/{table_id}/detection', update_detection, methods=['POST']),
+            Route('/kitting/api/{table_id}/status', check_table_status, methods=['GET']),
+            # Everything else: the regular Flask app
+            Mount('/', app=WSGIMiddleware(flask_app)),
+        ],
+        lifespan=lifespan
+    )
+    return socketio.ASGIApp(sio, other_asgi_app=web, socketio_path='socket.io')
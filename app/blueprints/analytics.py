@@ -0,0 +1,175 @@
+from datetime import datetime, timedelta, timezone
+
+from flask import Blueprint, request, jsonify, current_app
+
+from app.db import get_db
+from app.rollups import sum_stage, with_rates, shift_of, COUNTERS
+
+# Production analytics. Every endpoint reads only the rollup collections (app/rollups.py),
+# so the cost depends on the number of buckets in the range, not on the number of kits.
+analytics_bp = Blueprint('analytics', __name__, url_prefix='/analytics')
+
+
+# --- HELPER: DATE RANGE FROM ?from=&to= (ISO dates, 'to' exclusive, default last 7 days) ---
+def parse_date(value):
+    """ISO date/datetime as naive UTC, like the rollup buckets ('...+02:00' is converted)."""
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        try:
+            parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+        except OverflowError:   # e.g. 0001-01-01T00:00+01:00
+            raise ValueError(f"'{value}' is out of range")
+    return parsed
+
+def date_range():
+    end = request.args.get('to')
+    start = request.args.get('from')
+    end = parse_date(end) if end else datetime.utcnow()
+    start = parse_date(start) if start else end - timedelta(days=7)
+    if start >= end:
+        raise ValueError("'from' must be before 'to'")
+    return start, end
+
+def range_hours(start, end):
+    return (end - start).total_seconds() / 3600
+
+def bad_request(e):
+    return jsonify({"message": f"Invalid date range: {e}"}), 400
+
+
+# --- THROUGHPUT: KITS/HOUR PER TABLE OR PER SHIFT ---
+@analytics_bp.route('/api/throughput')
+def throughput():
+    try:
+        start, end = date_range()
+    except ValueError as e:
+        return bad_request(e)
+    try:
+        db = get_db()
+        match = {"$match": {"hour": {"$gte": start, "$lt": end}}}
+        hours = range_hours(start, end)
+
+        if request.args.get('by') == 'shift':
+            # Sum per hour of day, then fold the hours into the configured shifts
+            shifts = {}
+            for row in db.rollup_table_hourly.aggregate([match, sum_stage({"$hour": "$hour"})]):
+                shift = shifts.setdefault(shift_of(row['_id']), {"kits": 0, "hours_per_day": 0})
+                shift["kits"] += row['kits']
+            for hour in range(24):
+                shifts.setdefault(shift_of(hour), {"kits": 0, "hours_per_day": 0})["hours_per_day"] += 1
+            rows = [{"shift": name, "kits": s["kits"],
+                     "kits_per_hour": round(s["kits"] / (hours * s["hours_per_day"] / 24), 2) if hours else None}
+                    for name, s in sorted(shifts.items())]
+        else:
+            rows = [{"table_id": row['_id'], "kits": row['kits'],
+                     "kits_per_hour": round(row['kits'] / hours, 2) if hours else None}
+                    for row in db.rollup_table_hourly.aggregate([match, sum_stage("$table_id"), {"$sort": {"_id": 1}}])]
+
+        return jsonify({"from": start.isoformat(), "to": end.isoformat(), "rows": rows}), 200
+    except Exception as e:
+        current_app.logger.error(f"Analytics throughput error: {e}")
+        return jsonify({"message": "Internal Error", "error": str(e)}), 500
+
+
+# --- QUALITY: FIRST-PASS YIELD, ERROR RATE, MEAN CYCLE TIME PER TABLE OR KIT ---
+@analytics_bp.route('/api/quality')
+def quality():
+    try:
+        start, end = date_range()
+    except ValueError as e:
+        return bad_request(e)
+    try:
+        db = get_db()
+        if request.args.get('by') == 'kit':
+            collection, bucket, key = db.rollup_kit_daily, "day", "kit_name"
+            start = start.replace(hour=0, minute=0, second=0, microsecond=0)
+        else:
+            collection, bucket, key = db.rollup_table_hourly, "hour", "table_id"
+
+        match = {"$match": {bucket: {"$gte": start, "$lt": end}}}
+        rows = []
+        for row in collection.aggregate([match, sum_stage(f"${key}"), {"$sort": {"_id": 1}}]):
+            row[key] = row.pop('_id')
+            rows.append(with_rates(row))
+
+        overall = with_rates({k: sum(r[k] for r in rows) for k in COUNTERS})
+        return jsonify({"from": start.isoformat(), "to": end.isoformat(), "overall": overall, "rows": rows}), 200
+    except Exception as e:
+        current_app.logger.error(f"Analytics quality error: {e}")
+        return jsonify({"message": "Internal Error", "error": str(e)}), 500
+
+
+# --- ERRORS BY PART (per kit definition, daily buckets) ---
+@analytics_bp.route('/api/part_errors')
+def part_errors():
+    try:
+        start, end = date_range()
+    except ValueError as e:
+        return bad_request(e)
+    try:
+        db = get_db()
+        query = {"day": {"$gte": start.replace(hour=0, minute=0, second=0, microsecond=0), "$lt": end}}
+        if request.args.get('kit_name'):
+            query["kit_name"] = request.args['kit_name']
+
+        kits = sum(r['kits'] for r in db.rollup_kit_daily.aggregate([{"$match": query}, sum_stage(None)]))
+        parts = db.rollup_kit_daily.aggregate([
+            {"$match": query},
+            {"$project": {"parts": {"$objectToArray": {"$ifNull": ["$part_errors", {}]}}}},
+            {"$unwind": "$parts"},
+            {"$group": {"_id": "$parts.k", "errors": {"$sum": "$parts.v"}}},
+            {"$sort": {"errors": -1}}
+        ])
+        rows = [{"part": p['_id'], "errors": p['errors'],
+                 "errors_per_kit": round(p['errors'] / kits, 4) if kits else None} for p in parts]
+        return jsonify({"from": start.isoformat(), "to": end.isoformat(), "kits": kits, "rows": rows}), 200
+    except Exception as e:
+        current_app.logger.error(f"Analytics part errors error: {e}")
+        return jsonify({"message": "Internal Error", "error": str(e)}), 500
+
+
+# --- MODEL DRIFT: CONFIDENCE PER AI CLASS (db.detection_events) ---
+# app/detection_stats.py pulls in NumPy, so it is imported on the first drift query, not at worker start
+def detection_window(start, end):
+    from app import detection_stats
+    return detection_stats.load_window(get_db(), start, end, table_id=request.args.get('table_id'),
+                                       cam_id=request.args.get('cam'), ai_class=request.args.get('class'))
+
+@analytics_bp.route('/api/confidence_histogram')
+def confidence_histogram():
+    """Per-class confidence histograms over a window (?bins=, ?table_id=, ?cam=, ?class=)."""
+    try:
+        start, end = date_range()
+    except ValueError as e:
+        return bad_request(e)
+    try:
+        bins = min(max(request.args.get('bins', 20, type=int), 1), 100)
+        from app import detection_stats
+        result = detection_stats.confidence_histograms(detection_window(start, end), bins)
+        return jsonify({"from": start.isoformat(), "to": end.isoformat(), **result}), 200
+    except Exception as e:
+        current_app.logger.error(f"Analytics histogram error: {e}")
+        return jsonify({"message": "Internal Error", "error": str(e)}), 500
+
+@analytics_bp.route('/api/confidence_trend')
+def confidence_trend():
+    """Per-class confidence percentiles per time bucket (?bucket_hours=24, ?p=5,50,95)."""
+    try:
+        start, end = date_range()
+    except ValueError as e:
+        return bad_request(e)
+    try:
+        percentiles = [float(p) for p in request.args.get('p', '5,50,95').split(',') if p.strip()]
+        if not percentiles or any(p < 0 or p > 100 for p in percentiles):
+            raise ValueError
+    except ValueError:
+        return jsonify({"message": "Percentiles must be numbers within 0-100"}), 400
+    try:
+        bucket_sec = max(request.args.get('bucket_hours', 24, type=float), 1 / 60) * 3600
+        from app import detection_stats
+        trend = detection_stats.percentile_trend(detection_window(start, end), start, bucket_sec, percentiles)
+        return jsonify({"from": start.isoformat(), "to": end.isoformat(),
+                        "bucket_sec": bucket_sec, "classes": trend}), 200
+    except Exception as e:
+        current_app.logger.error(f"Analytics trend error: {e}")
+        return jsonify({"message": "Internal Error", "error": str(e)}), 500
@@ -1,32 +1,45 @@
-from flask import Blueprint, render_template, request, jsonify, url_for, current_app, send_from_directory
+from flask import Blueprint, render_template, request, jsonify, url_for, current_app, abort, Response
 from app.db import get_db
 import re
 from bson.objectid import ObjectId
-from app.socket_events import socketio
+from app.socket_events import broadcast
 from datetime import datetime
 import os
 import json
-from werkzeug.utils import secure_filename
 from app.config import Config
 
 import logging
-import traceback
 
 from bson.errors import InvalidId # Import at top
+from app.metrics import metrics
+from app.storage import get_storage, absolute_image_url, new_capture_key
+from app import archiver
+from app.imaging import DERIVATIVE_SIZES, derivative_key, ensure_derivative, schedule_derivatives, ingest_capture
+from werkzeug.exceptions import HTTPException
+import mimetypes
+from app.kitting_core import (
+    get_safe_cam_id, is_locked, parse_detection, detection_record, capture_stats_inc, version_filter,
+    bump_version, apply_resolution, new_cam_state, cam_field, cam_state, cam_parts, activity_cameras,
+    active_errors, sort_cameras, camera_completion_update, kit_history_id, kit_started_at, new_components,
+    COMPACT_PROJECTION, STATUS_PROJECTION, table_status, detection_flow, run_sync, retry_headers
+)
+from app.idempotency import claim_detection, store_detection_response, release_detection
+from app import table_workers
+from app.kit_catalog import kit_catalog, compiled_kit
+from app import fleet, rollups, detection_events, detection_buffer, cold_store
+from app import activity_feed
+from app.http_cache import activity_etag, not_modified, cacheable
+from app.socket_events import socketio
+from flask import stream_with_context
+import functools
 
-import pandas as pd
-import io
 from flask import send_file
 
 kitting_bp = Blueprint('kitting', __name__, url_prefix='/kitting')
 
-# --- HELPER: NORMALIZE CAM ID ---
-def get_safe_cam_id(input_id):
-    """Ensures inputs like '1', 'Camera 1', 'CAM1' always return 'cam1'."""
-    s = str(input_id).lower().strip()
-    if '1' in s: return 'cam1'
-    if '2' in s: return 'cam2'
-    return 'cam1' # Default fallback
+# Templates loop over a job's cameras instead of hard-coding cam1/cam2
+kitting_bp.add_app_template_global(activity_cameras)
+kitting_bp.add_app_template_global(cam_state)
 
 @kitting_bp.route('/')
 def index():
@@ -34,6 +47,113 @@ def index():
     active_jobs = list(db.activities.find({"status": "on-going"}))
     return render_template('kitting.html', active_jobs=active_jobs)
 
+# --- HELPER: STORE AN UPLOADED CAPTURE ---
+def store_capture(key, file):
+    """
+    Runs the optional ingest compression, saves the capture and queues its derivatives.
+    Returns (key, stored_bytes, saved_bytes); the key changes if the output format does.
+    """
+    data = file.read()
+    key, data, mimetype, saved = ingest_capture(key, data, file.mimetype or "image/jpeg", current_app.logger)
+    get_storage().save(key, data, mimetype)
+    schedule_derivatives(key, data, current_app.logger)
+    if saved:
+        metrics.incr("ingest.bytes_saved", saved)
+    return key, len(data), saved
+
+# --- HELPER: DETECTION FLOW ADAPTER (pymongo, see kitting_core.detection_flow) ---
+class DetectionIO:
+    """Blocking I/O for detection_flow: every call returns its result."""
+
+    def __init__(self, db):
+        self.db = db
+        self.log = current_app.logger
+        self.buffered = detection_buffer.enabled()
+
+    def claim(self, key):
+        return claim_detection(self.db, key)
+
+    def store(self, key, body, status_code):
+        store_detection_response(self.db, key, body, status_code)
+
+    def release(self, key):
+        release_detection(self.db, key)
+
+    def capture(self, activity, cam_id, upload):
+        key, stored_bytes, saved_bytes = store_capture(new_capture_key(f"{activity['_id']}/{cam_id}", upload.filename), upload)
+        return url_for('kitting.get_image', filename=key), stored_bytes, saved_bytes
+
+    def feed(self, activity_id, table_id, kind):
+        activity_feed.record(self.db, activity_id, table_id, kind)
+
+    def event(self, activity, det, at, matched):
+        detection_events.record(self.db, activity, det, at, matched)
+
+    def emit(self, event, data, room):
+        broadcast(event, data, to=room)
+
+    def buffer(self, activity_id, cam_id, kit_index, slot, record):
+        detection_buffer.add(activity_id, cam_id, kit_index, slot, record)
+
+    def writing(self, activity_id):
+        return detection_buffer.writing(activity_id)
+
+# --- HELPER: TABLE WORKER MODE (TABLE_WORKERS > 0, see app/table_workers.py) ---
+def releases_table(view):
+    """
+    Route decorator: the table's worker hands it back to MongoDB while the route runs
+    (and buffered detection records are written first).
+    """
+    @functools.wraps(view)
+    def wrapper(table_id, *args, **kwargs):
+        # Buffered detection records must be in the activity before a kit is snapshot and reset
+        detection_buffer.flush_quietly(current_app.logger)
+        try:
+            with table_workers.released(table_id):
+                return view(table_id, *args, **kwargs)
+        except (OSError, EOFError) as e:
+            current_app.logger.error(f"Table worker unreachable for Table {table_id}: {e}")
+            return jsonify({"message": "Table worker unavailable", "code": "worker_unavailable"}), 503
+    return wrapper
+
+def worker_response(reply):
+    """Emits the socket events a table worker returned and sends its answer."""
+    for event, data, room in reply['events']:
+        broadcast(event, data, to=room)
+    return jsonify(reply['body']), reply['status']
+
+def forward_detection(table_id):
+    """
+    Detection in table worker mode: the table's owner screens it (retry, locked, job done), this
+    process stores the capture only if it passed, then the owner decides.
+    """
+    raw_payload = request.form.get('payload')
+    data = json.loads(raw_payload) if raw_payload else {}
+    det = parse_detection(data)
+    if 'image' not in request.files:
+        return jsonify({"message": "No image provided"}), 422
+    client_key = request.headers.get('Idempotency-Key') or data.get('idempotencyKey')
+
+    try:
+        screened = table_workers.call(table_id, "screen", det=det, client_key=client_key)
+        if not screened['body'].get('proceed'):
+            return worker_response(screened)
+
+        # The owner knows the activity, this process only the table
+        original_filename, stored_bytes, saved_bytes = store_capture(
+            new_capture_key(f"table_{table_id}/{det['cam_id']}", request.files['image'].filename), request.files['image']
+        )
+        image_url = url_for('kitting.get_image', filename=original_filename)
+        reply = table_workers.call(table_id, "detection", det=det, image_url=image_url,
+                                   record=detection_record(image_url, det),
+                                   stats_inc=capture_stats_inc(stored_bytes, saved_bytes), client_key=client_key)
+    except (OSError, EOFError) as e:
+        current_app.logger.error(f"Table worker unreachable for Table {table_id}: {e}")
+        return jsonify({"message": "Table worker unavailable", "code": "worker_unavailable"}), 503
+    if reply.get('discard'):   # A retry or a lock overtook the screening
+        get_storage().delete(original_filename)
+    return worker_response(reply)
+
 # --- NEW ROUTE: HANDLE SETUP IMAGE UPLOADS ---
 @kitting_bp.route('/upload_setup_image', methods=['POST'])
 def upload_setup_image():
@@ -42,28 +162,18 @@ def upload_setup_image():
             return jsonify({'status': 'error', 'message': 'No image file provided'}), 400
             
         file = request.files['image']
-        cam_type = request.form.get('cam_type', 'cam1') # 'cam1' or 'cam2'
+        cam_type = get_safe_cam_id(request.form.get('cam_type', 'cam1')) # 'cam1', 'cam2', ...
         table_id = request.form.get('table_id', 'unknown')
 
         # 1. Determine Sub-folder based on camera
-        subfolder = "cam1_images" if "1" in cam_type else "cam2_images"
-        save_dir = os.path.join(Config.UPLOAD_FOLDER, subfolder)
+        subfolder = f"{cam_type}_images"
 
-        # 2. Create folder if not exists
-        if not os.path.exists(save_dir):
-            os.makedirs(save_dir)
+        # 2. Save File (local disk or S3, depending on config), under a key never used before
+        key, _, _ = store_capture(new_capture_key(subfolder, f"setup_{table_id}_{cam_type}.jpg"), file)
 
-        # 3. Save File
-        timestamp = int(datetime.utcnow().timestamp())
-        filename = secure_filename(f"setup_{table_id}_{cam_type}_{timestamp}.jpg")
-        file_path = os.path.join(save_dir, filename)
-        
-        file.save(file_path)
-
-        # 4. Return the Web URL
-        # We assume your static folder is serving '/static/captures'
-        # The URL structure: /static/captures/cam1_images/filename.jpg
-        web_url = f"/static/captures/{subfolder}/{filename}"
+        # 3. Return the Web URL
+        # The URL structure: /kitting/captures/cam1_images/filename.jpg
+        web_url = url_for('kitting.get_image', filename=key)
         
         return jsonify({'status': 'success', 'imageUrl': web_url})
 
@@ -74,9 +184,7 @@ def upload_setup_image():
 @kitting_bp.route('/history')
 def history_index():
     db = get_db()
-    completed_jobs = list(db.activities.find({
-        "status": {"$ne": "on-going"}
-    }).sort("start_time", -1))
+    completed_jobs = cold_store.history_headers(db, Config.HISTORY_LIST_LIMIT)
     return render_template('kitting_history.html', jobs=completed_jobs)
 
 @kitting_bp.route('/validate_step1', methods=['POST'])
@@ -91,16 +199,14 @@ def validate_step1():
         active = db.activities.find_one({"table_id": table_id, "status": "on-going"})
         if active: return jsonify({'status': 'error', 'message': f"Table {table_id} is busy."})
 
-        kit = db.kits.find_one({"kit_name": kit_name_input})
-        if not kit:
-            regex = re.compile(f"^{re.escape(kit_name_input)}$", re.IGNORECASE)
-            kit = db.kits.find_one({"kit_name": regex})
+        kit = kit_catalog.find(db, kit_name_input)
         if not kit: return jsonify({'status': 'error', 'message': f"Kit '{kit_name_input}' not found."})
 
         if str(kit.get('edp_number', '')).strip() != edp_input:
             return jsonify({'status': 'error', 'message': "EDP Mismatch!"})
 
-        return jsonify({'status': 'success'})
+        # The setup wizard walks through every camera the kit uses
+        return jsonify({'status': 'success', 'cameras': compiled_kit(kit)['compiled']['cameras']})
     except Exception as e: return jsonify({'status': 'error', 'message': str(e)}), 500
 
 @kitting_bp.route('/setup/step2')
@@ -111,22 +217,9 @@ def start_activity():
     try:
         data = request.json
         db = get_db()
-        kit_def = db.kits.find_one({"kit_name": data.get('kit_name', '')})
-        if not kit_def:
-            regex = re.compile(f"^{re.escape(data.get('kit_name', ''))}$", re.IGNORECASE)
-            kit_def = db.kits.find_one({"kit_name": regex})
+        kit_def = kit_catalog.find(db, data.get('kit_name', ''))
         if not kit_def: return jsonify({'status': 'error', 'message': 'Kit not found'}), 404
-
-        raw_parts = kit_def.get('parts', [])
-        sanitized_parts = []
-        for part in raw_parts:
-            alerts = part.get('alerts', []) or []
-            part['alert_missing'] = part.get('alert_missing', 'missing' in alerts)
-            part['alert_undercount'] = part.get('alert_undercount', 'undercount' in alerts)
-            part['alert_overcount'] = part.get('alert_overcount', 'overcount' in alerts)
-            part['found_quantity'] = 0
-            part['status'] = 'pending'
-            sanitized_parts.append(part)
+        kit_def = compiled_kit(kit_def)
 
         new_activity = {
             "start_time": datetime.utcnow(),
@@ -135,65 +228,31 @@ def start_activity():
             "edp_number": data.get('edp_number'),
             "order_number": data.get('order_number'),
             "total_kits_to_pack": int(data.get('units', 1)),
-            "current_kit_index_cam1": 1,
-            "current_kit_index_cam2": 1,
             "status": "on-going",
-            "components": sanitized_parts, 
+            "components": new_components(kit_def),
             "history": [],
-            "current_kit_errors_cam1": [], 
-            "current_kit_errors_cam2": [],
-            "last_detected_index_cam1": -1,
-            "last_detected_index_cam2": -1
+            # One entry per camera the kit uses (kit index, errors, last detected slot)
+            "cams": {cam: new_cam_state() for cam in kit_def['compiled']['cameras']},
+            # Which revision of the kit definition this job packs
+            "kit_id": kit_def.get('_id'),
+            "kit_version": kit_def.get('kit_version', 1),
+            "kit_hash": kit_def['compiled']['hash'],
+            # Optimistic concurrency: every conditional write matches and increments this
+            "version": 0
         }
         
-        result = db.activities.insert_one(new_activity)
+        with table_workers.released(data.get('table_id')):
+            result = db.activities.insert_one(new_activity)
+        activity_feed.record(db, result.inserted_id, data.get('table_id'), "started")
         new_activity['_id'] = str(result.inserted_id) 
         new_activity['activity_id'] = str(result.inserted_id)
         new_activity['start_time'] = new_activity['start_time'].isoformat()
         
-        socketio.emit('new_kitting_started', {"tableId": data.get('table_id'), "kittingDetails": new_activity}, to=f"table_{data.get('table_id')}")
+        broadcast('new_kitting_started', {"tableId": data.get('table_id'), "kittingDetails": new_activity}, to=f"table_{data.get('table_id')}")
 
         return jsonify({'status': 'success', 'redirect_url': url_for('kitting.monitor_activity', activity_id=str(result.inserted_id))})
     except Exception as e: return jsonify({'status': 'error', 'message': str(e)}), 500
     
-# --- NEW: HELPER FOR SANITIZATION ---
-def sanitize_activity_for_json(activity):
-    """
-    Recursively converts ObjectId and datetime to strings so they
-    can be safely rendered into JavaScript variables in the template.
-    """
-    if not activity: return {}
-    
-    # 1. Convert main ID
-    if '_id' in activity:
-        activity['_id'] = str(activity['_id'])
-    
-    # 2. Convert Start Time
-    if 'start_time' in activity and isinstance(activity['start_time'], datetime):
-        activity['start_time'] = activity['start_time'].isoformat()
-
-    # 3. Helper to clean a list of errors
-    def clean_error_list(error_list):
-        if not error_list: return []
-        cleaned = []
-        for err in error_list:
-            # Convert timestamp
-            if 'timestamp' in err and isinstance(err['timestamp'], datetime):
-                err['timestamp'] = err['timestamp'].isoformat()
-            # Convert any nested ObjectIds (just in case)
-            if '_id' in err: err['_id'] = str(err['_id'])
-            cleaned.append(err)
-        return cleaned
-
-    # 4. Clean the specific error lists used by JS
-    if 'current_kit_errors_cam1' in activity:
-        activity['current_kit_errors_cam1'] = clean_error_list(activity['current_kit_errors_cam1'])
-    
-    if 'current_kit_errors_cam2' in activity:
-        activity['current_kit_errors_cam2'] = clean_error_list(activity['current_kit_errors_cam2'])
-
-    return activity
-
 @kitting_bp.route('/monitor/<activity_id>')
 def monitor_activity(activity_id):
     db = get_db()
@@ -206,55 +265,139 @@ def monitor_activity(activity_id):
         current_app.logger.error(f"Invalid Activity ID received: {activity_id}")
         return render_template('error.html', message="Invalid Job ID format"), 400
 
-    # 2. Find Activity
-    activity = db.activities.find_one({"_id": oid})
+    # 2. Find Activity (live state only: galleries, errors and history load on demand)
+    activity = cold_store.find_activity(db, oid, COMPACT_PROJECTION)
     if not activity: 
         return "Activity Not Found", 404
     
-    sanitized_activity = sanitize_activity_for_json(activity)
-    return render_template('monitor.html', activity=sanitized_activity)
+    # The Red Screen on load only needs each locked camera's latest error (tojson encodes the BSON types)
+    latest_errors = {cam: errors[-1] for cam, errors in active_errors(activity).items()}
+    return render_template('monitor.html', activity=activity, latest_errors=latest_errors)
 
 @kitting_bp.route('/complete_manual', methods=['POST'])
 def complete_manual():
     try:
         data = request.json
         db = get_db()
-        db.activities.update_one(
-            {"_id": ObjectId(data.get('activity_id'))},
-            {"$set": { "status": "completed-manually", "end_time": datetime.utcnow() }}
-        )
+        activity = db.activities.find_one({"_id": ObjectId(data.get('activity_id'))}, {"table_id": 1}) or {}
+        if activity:
+            # The job's buffered detection records go in before it is closed
+            try: detection_buffer.settle(activity['_id'])
+            except Exception as e: current_app.logger.error(f"Detection buffer flush failed: {e}")
+        with table_workers.released(activity.get('table_id')):
+            db.activities.update_one(
+                {"_id": ObjectId(data.get('activity_id'))},
+                {"$set": { "status": "completed-manually", "end_time": datetime.utcnow() }, "$inc": {"version": 1}}
+            )
+        if activity:
+            activity_feed.record(db, activity['_id'], activity.get('table_id'), "completed_manually")
         return jsonify({'status': 'success'})
     except Exception as e: return jsonify({'status': 'error', 'message': str(e)}), 500
 
+# --- HELPER: LONG-LIVED CACHE HEADERS FOR IMMUTABLE CAPTURES ---
+def mark_immutable(resp):
+    """Capture keys are never reused (storage.new_capture_key), so browsers may keep them for a year."""
+    if resp.status_code in (200, 206, 304):
+        resp.cache_control.public = True
+        resp.cache_control.max_age = Config.CAPTURE_CACHE_MAX_AGE
+        resp.cache_control.immutable = True
+    return resp
+
+# --- HELPER: SERVE ONE CAPTURE (LOOSE FILE OR BUNDLE MEMBER) ---
+def send_capture(key):
+    """Response for a stored capture, or None if the key doesn't exist anywhere."""
+    storage = get_storage()
+    if storage.exists(key):
+        return mark_immutable(storage.send(key))
+
+    # Finished jobs are packed into bundles: serve the member by offset, without unpacking
+    member = archiver.find_member(get_db(), key)
+    if not member:
+        return None
+
+    # Bundle members never move, so their position is a strong validator
+    etag = f"{member['bundle']}:{member['offset']}:{member['length']}"
+    if request.if_none_match.contains(etag):
+        resp = Response(status=304)
+        resp.set_etag(etag)
+        return mark_immutable(resp)
+
+    data = archiver.read_member(member)
+    if data is None:
+        return None   # Evicted since it was indexed
+    mimetype = mimetypes.guess_type(key)[0] or 'application/octet-stream'
+    resp = Response(data, mimetype=mimetype)
+    resp.set_etag(etag)
+    # Answers Range requests (206) from the in-memory member
+    resp = resp.make_conditional(request, accept_ranges=True, complete_length=member['length'])
+    return mark_immutable(resp)
+
+def read_capture(key):
+    """Raw bytes of a stored capture (loose file or bundle member)."""
+    storage = get_storage()
+    if storage.exists(key):
+        return storage.read(key)
+    member = archiver.find_member(get_db(), key)
+    data = archiver.read_member(member) if member else None
+    if data is None:
+        abort(404)
+    return data
+
 @kitting_bp.route('/captures/<path:filename>')
 def get_image(filename):
-    return send_from_directory(Config.UPLOAD_FOLDER, filename)
+    # ?size=thumb|preview serves a downscaled copy, built on first request if needed
+    size = request.args.get('size')
+    if size in DERIVATIVE_SIZES:
+        resp = send_capture(derivative_key(filename, size))
+        if resp is not None:
+            return resp
+        try:
+            ensure_derivative(filename, size, lambda: read_capture(filename))
+            resp = send_capture(derivative_key(filename, size))
+            if resp is not None:
+                return resp
+        except HTTPException:
+            raise
+        except Exception as e:
+            # Never break the page over a thumbnail: fall back to the original
+            current_app.logger.warning(f"Derivative {size} failed for {filename}: {e}")
+
+    resp = send_capture(filename)
+    if resp is None:
+        abort(404)
+    return resp
 
 # --- HELPER: FINISH KIT (PER CAMERA) ---
-def perform_camera_completion(activity, db, table_id, cam_id, warning_type=None, validation_image=None):
+def perform_camera_completion(activity, db, table_id, cam_id, warning_type=None, validation_image=None, extra_set=None):
     """
     Finalizes a kit cycle for a specific camera.
     - Archives current state to history.
-    - Resets component counts for the next kit.
-    - Advances the kit index.
-    - Checks if the entire job is complete.
+    - Resets component counts, advances the kit index and checks whether the entire job
+      is complete, in a single write whatever the number of cameras.
     - Broadcasts updates to UI (including Punch Machine Image).
+    The write is conditional on the activity's version: returns False (nothing written) if another
+    request changed the activity since it was read, so the caller can re-read and retry.
+    `extra_set` adds fields to the same write (e.g. validation override flags).
     """
     try:
         current_app.logger.info(f"Performing completion for Table {table_id}, {cam_id}")
 
-        index_key = f"current_kit_index_{cam_id}"
-        error_key = f"current_kit_errors_{cam_id}"
-        last_detected_key = f"last_detected_index_{cam_id}"
-        
-        current_index = activity.get(index_key, 1)
-        total_kits = activity.get('total_kits_to_pack', 1)
+        current_index = cam_state(activity, cam_id)['kit_index']
         
         # ---------------------------------------------------------------------
         # [BLOCK 1] ARCHIVE HISTORY
         # ---------------------------------------------------------------------
         # 1. Get current state of components for this camera
-        cam_components = [p for p in activity['components'] if str(p.get('camera')).lower() == cam_id.lower()]
+        # With write-behind on, the kit's buffered detection records are written first and the
+        # parts re-read; if the activity moved on meanwhile, the caller re-decides
+        components = activity['components']
+        if detection_buffer.enabled():
+            detection_buffer.settle(activity['_id'])
+            fresh = db.activities.find_one(version_filter(activity), {"components": 1})
+            if fresh is None:
+                return False
+            components = fresh['components']
+        cam_components = cam_parts(components, cam_id)
         
         # 2. Fetch resolved errors for this kit
         # Note: We use activity['_id'] directly (ObjectId) to match DB format
@@ -268,8 +411,9 @@ def perform_camera_completion(activity, db, table_id, cam_id, warning_type=None,
         for err in logged_errors:
             if '_id' in err: del err['_id']
 
-        # 3. Create History Document
+        # 3. Create History Document (its _id names the kit, so writing it twice leaves one record)
         history_doc = {
+            "_id": kit_history_id(activity['_id'], cam_id, current_index),
             "activity_id": activity['_id'],
             "kit_number": current_index,
             "camera_id": cam_id,
@@ -282,74 +426,32 @@ def perform_camera_completion(activity, db, table_id, cam_id, warning_type=None,
             "validation_image_url": validation_image 
         }
         
-        # Insert into dedicated history collection
-        db.kit_history.insert_one(history_doc)
-        
-        # Also push a copy to the main activity document (for quick access)
-        doc_copy = history_doc.copy()
-        if '_id' in doc_copy: del doc_copy['_id']
-        if 'activity_id' in doc_copy: del doc_copy['activity_id']
-        db.activities.update_one({"_id": activity['_id']}, {"$push": {"history": doc_copy}})
+        # A copy is pushed to the main activity document (for quick access)
+        doc_copy = {k: v for k, v in history_doc.items() if k not in ('_id', 'activity_id')}
 
         # ---------------------------------------------------------------------
-        # [BLOCK 2] RESET & ADVANCE
+        # [BLOCK 2] RESET, ADVANCE & CHECK GLOBAL COMPLETION (ONE CONDITIONAL WRITE)
         # ---------------------------------------------------------------------
-        new_index = current_index + 1
-        
-        # Reset component counts ONLY if there are more kits to pack
-        if new_index <= total_kits:
-            for idx, part in enumerate(activity['components']):
-                if str(part.get('camera')).lower() == cam_id.lower():
-                    field_base = f"components.{idx}"
-                    db.activities.update_one(
-                        {"_id": activity['_id']},
-                        {"$set": {
-                            f"{field_base}.found_quantity": 0,
-                            f"{field_base}.status": "pending"
-                        }, "$unset": {
-                            f"{field_base}.sequence_order": "",
-                            f"{field_base}.last_image_url": "",
-                            f"{field_base}.captured_images": "", 
-                            f"{field_base}.resolution_reason": "",
-                            f"{field_base}.resolution_type": ""
-                        }}
-                    )
-
-        # Update Activity-level indexes
-        db.activities.update_one(
-            {"_id": activity['_id']},
-            {
-                "$set": {
-                    index_key: new_index, 
-                    error_key: [],
-                    last_detected_key: -1 
-                }
-            }
-        )
+        update, job_done = camera_completion_update(activity, cam_id, doc_copy)
+        if extra_set:
+            # Fields this completion resets anyway only matter for the snapshot above
+            update["$set"].update({k: v for k, v in extra_set.items() if k not in update.get("$unset", {})})
+        # History record first: a crash right after the activity write can't lose it anymore
+        db.kit_history.replace_one({"_id": history_doc['_id']}, history_doc, upsert=True)
+        if db.activities.update_one(version_filter(activity), update).matched_count == 0:
+            # Kit not closed after all (another write came first): the retry writes its own record
+            db.kit_history.delete_one({"_id": history_doc['_id'], "completed_at": history_doc['completed_at']})
+            return False
+        rollups.record_kit(db, activity, history_doc['completed_at'], kit_started_at(activity, cam_id),
+                           first_pass=not logged_errors and not warning_type, warning=warning_type)
+        activity_feed.record(db, activity['_id'], table_id, "job_completed" if job_done else "kit_completed")
 
         # ---------------------------------------------------------------------
-        # [BLOCK 3] CHECK GLOBAL COMPLETION & NOTIFY UI
+        # [BLOCK 3] NOTIFY UI
         # ---------------------------------------------------------------------
-        updated_act = db.activities.find_one({"_id": activity['_id']})
-        
-        # Get progress for both cameras
-        idx1 = updated_act.get('current_kit_index_cam1', 1)
-        idx2 = updated_act.get('current_kit_index_cam2', 1)
-        
-        parts1 = [p for p in updated_act['components'] if str(p.get('camera')).lower() == 'cam1']
-        parts2 = [p for p in updated_act['components'] if str(p.get('camera')).lower() == 'cam2']
-        
-        # A camera is "done" if index exceeds total OR it has no parts assigned
-        cam1_done = (idx1 > total_kits) or (len(parts1) == 0)
-        cam2_done = (idx2 > total_kits) or (len(parts2) == 0)
-
-        if cam1_done and cam2_done:
+        if job_done:
             # Entire Job Complete
-            db.activities.update_one(
-                {"_id": activity['_id']}, 
-                {"$set": {"status": "completed_job", "end_time": datetime.utcnow()}}
-            )
-            socketio.emit('ui_update', {"type": "job_completed"}, to=f"table_{table_id}")
+            broadcast('ui_update', {"type": "job_completed"}, to=f"table_{table_id}")
         else:
             # Single Kit Complete -> Show Green/Yellow Popup
             overcount_names = []
@@ -357,7 +459,7 @@ def perform_camera_completion(activity, db, table_id, cam_id, warning_type=None,
                 # Calculate which items were overcounted for display
                 overcount_names = [p['name'] for p in cam_components if p.get('found_quantity',0) > p.get('quantity',0)]
 
-            socketio.emit('ui_update', {
+            broadcast('ui_update', {
                 "type": "kit_completed" if not warning_type else "kit_completed_with_warning",
                 "camId": cam_id,
                 "completed_count": current_index,
@@ -367,6 +469,8 @@ def perform_camera_completion(activity, db, table_id, cam_id, warning_type=None,
                 "imageUrl": validation_image 
             }, to=f"table_{table_id}")
 
+        return True
+
     except Exception as e:
         current_app.logger.error(f"Error in perform_camera_completion: {e}")
         # We re-raise to ensure the caller (validate_cycle) knows something went wrong
@@ -375,28 +479,88 @@ def perform_camera_completion(activity, db, table_id, cam_id, warning_type=None,
 # --- SYSTEM STATUS API ---
 @kitting_bp.route('/api/<table_id>/status', methods=['GET'])
 def check_table_status(table_id):
-    db = get_db()
-    activity = db.activities.find_one({"table_id": str(table_id), "status": "on-going"})
-    
-    if not activity:
-        return jsonify({"status": "idle", "message": "No active job"}), 200
-
-    errors_c1 = activity.get('current_kit_errors_cam1', [])
-    errors_c2 = activity.get('current_kit_errors_cam2', [])
-    
-    if errors_c1 or errors_c2:
+    if table_workers.enabled():
+        try:
+            return worker_response(table_workers.call(table_id, "status"))
+        except (OSError, EOFError) as e:
+            current_app.logger.error(f"Table worker unreachable for Table {table_id}: {e}")
+            return jsonify({"message": "Table worker unavailable", "code": "worker_unavailable"}), 503
+
+    activity = get_db().activities.find_one({"table_id": str(table_id), "status": "on-going"}, STATUS_PROJECTION)
+    return jsonify(table_status(activity)), 200
+
+# --- STORAGE DASHBOARD API ---
+@kitting_bp.route('/api/storage_stats', methods=['GET'])
+def get_storage_stats():
+    """Capture disk usage per table and the bytes saved by ingest compression."""
+    try:
+        db = get_db()
+        rows = list(db.activities.aggregate([
+            {"$match": {"captures_evicted": {"$exists": False}}},
+            {"$group": {
+                "_id": "$table_id",
+                "files": {"$sum": "$capture_stats.files"},
+                "bytes_stored": {"$sum": "$capture_stats.bytes_stored"},
+                "bytes_saved": {"$sum": "$capture_stats.bytes_saved"}
+            }},
+            {"$sort": {"_id": 1}}
+        ]))
+        tables = [{"table_id": r['_id'], "files": r['files'], "bytes_stored": r['bytes_stored'],
+                   "bytes_saved": r['bytes_saved']} for r in rows]
         return jsonify({
-            "status": "locked", 
-            "message": "Red Screen Active - Waiting for operator resolution",
-            "errors": {"cam1": len(errors_c1), "cam2": len(errors_c2)}
+            "backend": get_storage().name,
+            "quota_bytes_per_table": Config.CAPTURE_QUOTA_MB_PER_TABLE * 1024 * 1024,
+            "bytes_stored": sum(t['bytes_stored'] for t in tables),
+            "bytes_saved": sum(t['bytes_saved'] for t in tables),
+            "tables": tables
         }), 200
-        
-    return jsonify({"status": "active", "message": "System ready"}), 200
+    except Exception as e:
+        current_app.logger.error(f"Storage stats error: {e}")
+        return jsonify({"message": "Internal Error", "error": str(e)}), 500
 
-# --- DETECTION API ---
-import logging
-import traceback
-from flask import current_app
+# --- METRICS API ---
+@kitting_bp.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Per-process counters and timings (socket relays, dedup hits, ...)."""
+    return jsonify({**metrics.snapshot(), "kit_catalog": kit_catalog.stats()}), 200
+
+# --- FLEET OVERVIEW (ALL TABLES) ---
+@kitting_bp.route('/fleet')
+def fleet_overview():
+    # A refetch after a change waits until the fleet cache entry, possibly older than it, has expired
+    return render_template('fleet.html', refresh_ms=max(500, int(Config.FLEET_CACHE_SEC * 1000) + 100))
+
+@kitting_bp.route('/api/fleet', methods=['GET'])
+def get_fleet():
+    """Every table's state (idle/active/locked, per-camera kit progress, last detection age)."""
+    try:
+        return jsonify({"status": "success", "tables": fleet.fleet_state(get_db())}), 200
+    except Exception as e:
+        current_app.logger.error(f"Fleet API Error: {e}")
+        return jsonify({"message": "Internal Error", "error": str(e)}), 500
+
+# --- ACTIVITY CHANGE FEED (SERVER-SENT EVENTS) ---
+@kitting_bp.route('/api/feed', methods=['GET'])
+def get_activity_feed():
+    """
+    Stream of activity state changes across all tables (or ?table_id=...), for dashboards.
+    Reconnecting with Last-Event-ID (or ?since=<token>) resumes right after that event.
+    """
+    db = get_db()
+    token = request.headers.get('Last-Event-ID') or request.args.get('since')
+    events = activity_feed.stream(db, token, request.args.get('table_id'), sleep=socketio.sleep)
+    resp = Response(stream_with_context(events), mimetype='text/event-stream')
+    resp.headers['Cache-Control'] = 'no-cache'
+    resp.headers['X-Accel-Buffering'] = 'no'   # nginx: don't buffer the stream
+    return resp
+
+# --- TABLE WORKERS API ---
+@kitting_bp.route('/api/table_workers', methods=['GET'])
+def get_table_workers():
+    """Tables held, write-ahead log backlog and timings of each table worker."""
+    if not table_workers.enabled():
+        return jsonify({"enabled": False, "workers": []}), 200
+    return jsonify({"enabled": True, "workers": table_workers.worker_stats()}), 200
 
 # --- DETECTION API ---
 @kitting_bp.route('/api/<table_id>/detection', methods=['POST'])
@@ -406,249 +570,25 @@ def update_detection(table_id):
     - Processes the image and metadata.
     - Updates kit progress if the part is valid.
     - Locks the system if the part is wrong.
-    - Returns 200 (OK), 409 (Wrong Part), 423 (Locked), or 500 (Server Error).
+    - Returns 200 (OK), 409 (Wrong Part), 423 (Locked), 503 (Write Conflicts or duplicate in progress,
+      retry after Retry-After) or 500 (Server Error).
+    - Retries of the same detection replay the first response without side effects.
+    The flow lives in app/kitting_core.py (detection_flow), shared with the asyncio mode (app/asgi.py).
     """
-    try:
-        db = get_db()
-        
-        # ---------------------------------------------------------------------
-        # [BLOCK 1] VALIDATION & STATE CHECKS
-        # ---------------------------------------------------------------------
-        # 1. Fetch Active Activity
-        # We look for a job on this specific table that is currently 'on-going'.
-        activity = db.activities.find_one({"table_id": str(table_id), "status": "on-going"})
-        
-        if not activity:
-            current_app.logger.warning(f"Detection received for inactive Table {table_id}")
-            return jsonify({"message": "No active job"}), 404
-
-        # 2. Global Lock Check
-        # If any camera currently has an unresolved error (Red Screen), reject new detections.
-        # This prevents the operator from continuing without resolving the issue first.
-        if activity.get('current_kit_errors_cam1') or activity.get('current_kit_errors_cam2'):
-            return jsonify({"message": "System Locked", "code": "system_locked"}), 423
-
-        # 3. Input Validation
-        # Ensure an image file was actually sent in the request.
-        if 'image' not in request.files:
-            return jsonify({"message": "No image provided"}), 422
-        
-        file = request.files['image']
-
-        # ---------------------------------------------------------------------
-        # [BLOCK 2] DATA PARSING & METADATA EXTRACTION
-        # ---------------------------------------------------------------------
-        # 4. Parse Rich Payload
-        # The AI sends metadata as a JSON string inside the 'payload' form-field.
-        raw_payload = request.form.get('payload')
-        data = json.loads(raw_payload) if raw_payload else {}
-        
-        # Extract Metadata safely with defaults
-        cam_id = get_safe_cam_id(data.get('camId', ''))
-        detected_part = data.get('detectedPart', '')           # Logical name (mapped)
-        ai_raw_name = data.get('AiDetectedPartName', '')       # Raw class name from model
-        confidence = data.get('avgThreshold', 0.0)             # Confidence score (0.0 - 1.0)
-        tracking_id = data.get('Tracking_id', None)            # Unique ID from object tracker
-        
-        # Check Job Limits
-        current_kit_num = activity.get(f'current_kit_index_{cam_id}', 1)
-        total_kits = activity.get('total_kits_to_pack', 1)
-
-        # If the job is already finished for this camera, ignore extra detections.
-        if current_kit_num > total_kits:
-            return jsonify({"message": "camera-job-completed", "code": "done"}), 200
-        
-        # ---------------------------------------------------------------------
-        # [BLOCK 3] FILE HANDLING
-        # ---------------------------------------------------------------------
-        # Generate a unique filename: {ActivityID}_{CamID}_{KitNum}_{Part}_{Timestamp}.jpg
-        original_filename = secure_filename(file.filename)
-        
-        # 2. Use it directly (Saving exactly what was sent)
-        file_path = os.path.join(Config.UPLOAD_FOLDER, original_filename)
-        file.save(file_path)
-        
-        # 3. Generate URL
-        image_url = url_for('kitting.get_image', filename=original_filename)
+    # Table worker mode: the table's owner process holds its state and decides
+    if table_workers.enabled():
+        return forward_detection(table_id)
 
-        # Create a Rich Detection Record Object
-        # This object contains all metadata to be stored in the DB (for history/debugging)
-        detection_record = {
-            "image_url": image_url,
-            "timestamp": datetime.utcnow(),
-            "ai_class_name": ai_raw_name,
-            "confidence": confidence,
-            "tracking_id": tracking_id,
-            "cam_id": cam_id
-        }
-
-        # ---------------------------------------------------------------------
-        # [BLOCK 4] PART MATCHING LOGIC
-        # ---------------------------------------------------------------------
-        current_components = activity.get('components', [])
-        target_index = -1
-        target_part = None
-
-        # Logic A: "Hungry Slot"
-        # Look for a part that MATCHES the detected name AND still NEEDS items (found < quantity).
-        for idx, part in enumerate(current_components):
-            if get_safe_cam_id(part.get('camera')) == cam_id:
-                if str(part.get('name')) == str(detected_part):
-                    if part.get('found_quantity', 0) < part.get('quantity', 1):
-                        target_part = part
-                        target_index = idx
-                        break
-        
-        # Logic B: "Overcount Slot" (Fallback)
-        # If all slots are full, but the part name matches, assign it to the first matching slot.
-        # This allows the system to register an "Overcount" later.
-        if not target_part:
-            for idx, part in enumerate(current_components):
-                if get_safe_cam_id(part.get('camera')) == cam_id:
-                    if str(part.get('name')) == str(detected_part):
-                        target_part = part
-                        target_index = idx
-                        break
-
-        # ---------------------------------------------------------------------
-        # [BLOCK 5] WRONG PART DETECTED (ERROR FLOW)
-        # ---------------------------------------------------------------------
-        # If target_part is still None, it means this detected object is not in the Kit Bill of Materials.
-        if not target_part:
-            error_data = {
-                "error_type": "detection",
-                "reason_selected": None, # Will be filled by operator resolution
-                "timestamp": datetime.utcnow(),
-                "error_details": {
-                    "message": "wrong_part_detected",
-                    "imageUrl": image_url,
-                    "detectedPart": detected_part,
-                    "AiDetectedPartName": ai_raw_name, # Stored for debug
-                    "avgThreshold": confidence,        # Stored for debug
-                    "Tracking_id": tracking_id,        # Stored for debug
-                    "error_code": "wrong-part",
-                    "camId": cam_id 
-                }
-            }
-            
-            # DB Action: Push error to 'current_kit_errors' array.
-            # This immediately locks the system (see Block 1, Step 2).
-            error_key = f"current_kit_errors_{cam_id}"
-            db.activities.update_one(
-                {"_id": activity['_id']}, 
-                {"$push": {error_key: error_data}}
-            )
-
-            # Socket Action: Trigger Red Screen on UI
-            socketio.emit('ui_update', {
-                "type": "error_alert",
-                "message": "wrong_part_detected",
-                "imageUrl": image_url,
-                "detectedPart": detected_part,
-                "camId": cam_id 
-            }, to=f"table_{table_id}")
-            
-            current_app.logger.info(f"Wrong Part Detected on Table {table_id}: {detected_part}")
-                # --- UPDATED RESPONSE WITH RICH DATA ---
-            return jsonify({
-                "code": "wrong-part",
-                "message": "wrong_part",
-                "part_name": detected_part,
-                "cam_id": cam_id,
-                "tracking_id": tracking_id,
-                "avg_threshold": confidence,
-                "image_url": image_url
-            }), 409
-
-        # ---------------------------------------------------------------------
-        # [BLOCK 6] CORRECT PART DETECTED (SUCCESS FLOW) - ATOMIC FIX
-        # ---------------------------------------------------------------------
-        
-        # 1. Define the keys
-        update_field = f"components.{target_index}"
-        last_detected_key = f"last_detected_index_{cam_id}"
-        
-        # 2. ATOMIC UPDATE: Increment Count AND Push Image in one go.
-        # We use find_one_and_update to lock, update, and return the NEW document.
-        updated_activity = db.activities.find_one_and_update(
-            {"_id": activity['_id']},
-            {
-                "$inc": {f"{update_field}.found_quantity": 1}, # Atomic Math
-                "$push": {f"{update_field}.captured_images": detection_record},
-                "$set": {
-                    f"{update_field}.last_image_url": image_url,
-                    "last_updated": datetime.utcnow(),
-                    last_detected_key: target_index
-                }
-            },
-            return_document=True # Important: Returns the document AFTER the update
-        )
-
-        # 3. Get the NEW values from the updated document
-        updated_component = updated_activity['components'][target_index]
-        new_found = updated_component.get('found_quantity', 0)
-        required_qty = updated_component.get('quantity', 1)
-
-        # 4. Check Completion (Post-Update)
-        # Check if this specific component slot is now full
-        if new_found >= required_qty and updated_component.get('status') != 'completed':
-            
-            # Determine sequence order
-            # We count how many *other* parts are completed in the updated doc
-            c_done = sum(1 for p in updated_activity['components'] 
-                         if get_safe_cam_id(p.get('camera')) == cam_id 
-                         and p.get('status') == 'completed')
-            
-            # Perform a second update to mark this specific part as completed
-            # (This is safe to do separately because the quantity is already secure)
-            db.activities.update_one(
-                {"_id": activity['_id']},
-                {"$set": {
-                    f"{update_field}.status": "completed",
-                    f"{update_field}.sequence_order": c_done + 1
-                }}
-            )
-
-        # Socket Action: Show Green "Detected" Popup on UI
-        socketio.emit('ui_update', {
-            "type": "refresh_needed",
-            "popup_data": {
-                "part_name": target_part.get('name'),
-                "found_qty": new_found,
-                "required_qty": required_qty,
-                "imageUrl": image_url,
-                "camId": cam_id
-            }
-        }, to=f"table_{table_id}")
-
-        return jsonify({
-            "message": "correct-part-detected",
-            "found": new_found,
-            "part_name": detected_part,
-            "cam_id": cam_id,
-            "tracking_id": tracking_id,
-            "avg_threshold": confidence
-        }), 200
-
-    # ---------------------------------------------------------------------
-    # [BLOCK 7] EXCEPTION HANDLING
-    # ---------------------------------------------------------------------
-    except Exception as e:
-        # Log the full traceback so developers can debug the crash
-        error_msg = str(e)
-        tb = traceback.format_exc()
-        current_app.logger.error(f"CRITICAL ERROR in detection API for Table {table_id}: {error_msg}\n{tb}")
-        
-        # Return a 500 error so the AI station knows the server failed
-        return jsonify({
-            "status": "error", 
-            "message": "Internal Server Error processing detection",
-            "debug_error": error_msg 
-        }), 500
+    body, status_code = run_sync(detection_flow(
+        DetectionIO(get_db()), table_id, request.form.get('payload'),
+        request.headers.get('Idempotency-Key'), request.files.get('image')
+    ))
+    return jsonify(body), status_code, retry_headers(status_code)
 
 # --- VALIDATION API (PUNCH MACHINE) ---
 # --- VALIDATION API (PUNCH MACHINE) ---
 @kitting_bp.route('/api/<table_id>/validate_cycle', methods=['POST'])
+@releases_table
 def validate_cycle(table_id):
     """
     Handles the 'Punch Machine' event.
@@ -668,7 +608,7 @@ def validate_cycle(table_id):
         if not activity:
             return jsonify({"message": "No active job"}), 404
         
-        if activity.get('current_kit_errors_cam1') or activity.get('current_kit_errors_cam2'):
+        if is_locked(activity):
             return jsonify({"message": "System Locked: Resolve Red Screen first"}), 423
 
         # ---------------------------------------------------------------------
@@ -683,142 +623,165 @@ def validate_cycle(table_id):
             if 'image' in request.files:
                 file = request.files['image']
                 cam_id_raw = get_safe_cam_id(data.get('camId', ''))
-                kit_idx = activity.get(f'current_kit_index_{cam_id_raw}', 1)
-                filename = secure_filename(f"{activity['_id']}_{cam_id_raw}_punch_kit{kit_idx}_{int(datetime.utcnow().timestamp())}.jpg")
-                file.save(os.path.join(Config.UPLOAD_FOLDER, filename))
+                kit_idx = cam_state(activity, cam_id_raw)['kit_index']
+                filename = new_capture_key(f"{activity['_id']}/{cam_id_raw}", f"punch_kit{kit_idx}.jpg")
+                filename, stored_bytes, saved_bytes = store_capture(filename, file)
+                # Bumps the version (the ETag): continue from the document it returns, not a stale copy
+                activity = db.activities.find_one_and_update(
+                    {"_id": activity['_id']}, bump_version({"$inc": capture_stats_inc(stored_bytes, saved_bytes)}),
+                    return_document=True
+                ) or activity
                 image_url = url_for('kitting.get_image', filename=filename)
         elif request.is_json:
             data = request.json
         
         cam_id = get_safe_cam_id(data.get('camId', ''))
-        current_kit_idx = activity.get(f'current_kit_index_{cam_id}', 1)
 
-        # ---------------------------------------------------------------------
-        # [BLOCK 3] VALIDATION & STATS GENERATION (UNIFIED)
-        # ---------------------------------------------------------------------
-        components = activity.get('components', [])
-        missing = []
-        undercount = []
-        overcount = []
-        component_details = []
-
-        for part in components:
-            if get_safe_cam_id(part.get('camera')) == cam_id:
-                name = part.get('name')
-                req = part.get('quantity', 0)
-                found = part.get('found_quantity', 0)
+        # Blocks 3-5 decide from the activity we read; the completion write is conditional on its
+        # version, so a detection or resolution landing in between makes us re-read and re-validate.
+        for attempt in range(Config.ACTIVITY_WRITE_RETRIES + 1):
+            if attempt:
+                metrics.incr("occ.validate.conflicts")
+                activity = db.activities.find_one({"_id": activity['_id'], "status": "on-going"})
+                if not activity:
+                    return jsonify({"message": "No active job"}), 404
+                if is_locked(activity):
+                    return jsonify({"message": "System Locked: Resolve Red Screen first"}), 423
+            current_kit_idx = cam_state(activity, cam_id)['kit_index']
+
+            # ---------------------------------------------------------------------
+            # [BLOCK 3] VALIDATION & STATS GENERATION (UNIFIED)
+            # ---------------------------------------------------------------------
+            components = activity.get('components', [])
+            missing = []
+            undercount = []
+            overcount = []
+            component_details = []
+
+            for part in components:
+                if part.get('camera') == cam_id:
+                    name = part.get('name')
+                    req = part.get('quantity', 0)
+                    found = part.get('found_quantity', 0)
                 
-                # A. Validation Logic
-                if found == 0 and req > 0 and part.get('alert_missing'):
-                    missing.append(name)
-                elif found > 0 and found < req and part.get('alert_undercount'):
-                    undercount.append(name)
-                elif found > req and part.get('alert_overcount'):
-                    overcount.append(name)
-
-                # B. Stats Calculation (Confidence etc.)
-                captures = part.get('captured_images', [])
-                conf_values = []
-                for item in captures:
-                    if isinstance(item, dict) and 'confidence' in item:
-                        try: conf_values.append(float(item['confidence']))
-                        except (ValueError, TypeError): pass
+                    # A. Validation Logic
+                    if found == 0 and req > 0 and part.get('alert_missing'):
+                        missing.append(name)
+                    elif found > 0 and found < req and part.get('alert_undercount'):
+                        undercount.append(name)
+                    elif found > req and part.get('alert_overcount'):
+                        overcount.append(name)
+
+                    # B. Stats Calculation (Confidence etc.)
+                    captures = part.get('captured_images', [])
+                    conf_values = []
+                    for item in captures:
+                        if isinstance(item, dict) and 'confidence' in item:
+                            try: conf_values.append(float(item['confidence']))
+                            except (ValueError, TypeError): pass
                 
-                avg_conf = 0.0
-                if conf_values: avg_conf = sum(conf_values) / len(conf_values)
-
-                component_details.append({
-                    "part_name": name,
-                    "expected_qty": req,
-                    "detected_qty": found,
-                    "avg_confidence": round(avg_conf, 2),
-                    "capture_count": len(captures)
-                })
+                    avg_conf = 0.0
+                    if conf_values: avg_conf = sum(conf_values) / len(conf_values)
+
+                    component_details.append({
+                        "part_name": name,
+                        "expected_qty": req,
+                        "detected_qty": found,
+                        "avg_confidence": round(avg_conf, 2),
+                        "capture_count": len(captures)
+                    })
 
-        # ---------------------------------------------------------------------
-        # [BLOCK 4] FAILURE FLOW (RICH RESPONSE)
-        # ---------------------------------------------------------------------
-        if missing or undercount:
-            # Emit Socket Event (Visuals)
-            socketio.emit('ui_update', {
-                "type": "validation_error",
-                "missing": missing, 
-                "undercount": undercount, 
-                "overcount": overcount,
-                "camId": cam_id,
-                "imageUrl": image_url
-            }, to=f"table_{table_id}")
+            # ---------------------------------------------------------------------
+            # [BLOCK 4] FAILURE FLOW (RICH RESPONSE)
+            # ---------------------------------------------------------------------
+            if missing or undercount:
+                # Emit Socket Event (Visuals)
+                broadcast('ui_update', {
+                    "type": "validation_error",
+                    "missing": missing, 
+                    "undercount": undercount, 
+                    "overcount": overcount,
+                    "camId": cam_id,
+                    "imageUrl": image_url
+                }, to=f"table_{table_id}")
+            
+                # Return Rich JSON
+                return jsonify({
+                    "message": "part-missing", 
+                    "details": {
+                        "kit_number": current_kit_idx,
+                        "cam_id": cam_id,
+                        "status": "validation_failed",
+                        "validation_image": image_url,
+                        "timestamp": datetime.utcnow().isoformat(),
+                        "missing": missing,
+                        "undercount": undercount,
+                        "overcount": overcount,
+                        "components_summary": component_details # <--- Full stats included here
+                    }
+                }), 200
+
+            # ---------------------------------------------------------------------
+            # [BLOCK 5] SUCCESS FLOW (COMPLETE KIT)
+            # ---------------------------------------------------------------------
+            warning_status = "overcount" if overcount else None
+        
+            # Fetch Resolved Errors for History
+            resolved_errors_cursor = db.error_logs.find({
+                "activity_id": activity['_id'],
+                "kit_number": current_kit_idx,
+                "camera_id": cam_id
+            })
+
+            anomalies_summary = []
+            for err in resolved_errors_cursor:
+                details = err.get('error_details', {})
+                wrong_obj = details.get('detectedPart') or details.get('AiDetectedPartName') or "Unknown"
+                if err.get('error_type') == 'validation': wrong_obj = "Validation Failure"
             
-            # Return Rich JSON
+                anomalies_summary.append({
+                    "type": err.get('error_type'),
+                    "object_detected": wrong_obj,
+                    "resolution_reason": err.get('reason_selected'),
+                    "timestamp": str(err.get('timestamp')),
+                    "ai_confidence": details.get('avgThreshold'),
+                    "tracking_id": details.get('Tracking_id')
+                })
+
+            if not perform_camera_completion(
+                activity, db, table_id, cam_id, 
+                warning_type=warning_status, 
+                validation_image=image_url
+            ):
+                continue
+            metrics.observe("occ.validate.retries", attempt)
+        
+            current_app.logger.info(f"Kit {current_kit_idx} completed on {cam_id}")
+        
             return jsonify({
-                "message": "part-missing", 
+                "message": "kit-completed",
                 "details": {
                     "kit_number": current_kit_idx,
                     "cam_id": cam_id,
-                    "status": "validation_failed",
+                    "status": "completed_with_warning" if warning_status else "completed",
                     "validation_image": image_url,
-                    "timestamp": datetime.utcnow().isoformat(),
-                    "missing": missing,
-                    "undercount": undercount,
-                    "overcount": overcount,
-                    "components_summary": component_details # <--- Full stats included here
+                    "completed_at": datetime.utcnow().isoformat(),
+                    "warnings": overcount if overcount else [],
+                    "components_summary": component_details,
+                    "anomalies_resolved": anomalies_summary
                 }
             }), 200
 
-        # ---------------------------------------------------------------------
-        # [BLOCK 5] SUCCESS FLOW (COMPLETE KIT)
-        # ---------------------------------------------------------------------
-        warning_status = "overcount" if overcount else None
-        
-        # Fetch Resolved Errors for History
-        resolved_errors_cursor = db.error_logs.find({
-            "activity_id": activity['_id'],
-            "kit_number": current_kit_idx,
-            "camera_id": cam_id
-        })
-
-        anomalies_summary = []
-        for err in resolved_errors_cursor:
-            details = err.get('error_details', {})
-            wrong_obj = details.get('detectedPart') or details.get('AiDetectedPartName') or "Unknown"
-            if err.get('error_type') == 'validation': wrong_obj = "Validation Failure"
-            
-            anomalies_summary.append({
-                "type": err.get('error_type'),
-                "object_detected": wrong_obj,
-                "resolution_reason": err.get('reason_selected'),
-                "timestamp": str(err.get('timestamp')),
-                "ai_confidence": details.get('avgThreshold'),
-                "tracking_id": details.get('Tracking_id')
-            })
-
-        perform_camera_completion(
-            activity, db, table_id, cam_id, 
-            warning_type=warning_status, 
-            validation_image=image_url
-        )
-        
-        current_app.logger.info(f"Kit {current_kit_idx} completed on {cam_id}")
-        
-        return jsonify({
-            "message": "kit-completed",
-            "details": {
-                "kit_number": current_kit_idx,
-                "cam_id": cam_id,
-                "status": "completed_with_warning" if warning_status else "completed",
-                "validation_image": image_url,
-                "completed_at": datetime.utcnow().isoformat(),
-                "warnings": overcount if overcount else [],
-                "components_summary": component_details,
-                "anomalies_resolved": anomalies_summary
-            }
-        }), 200
+        # Every attempt lost a race with another write on this table
+        metrics.incr("occ.validate.exhausted")
+        return jsonify({"message": "Table busy, retry", "code": "write_conflict"}), 503
 
     except Exception as e:
         current_app.logger.error(f"Error in validate_cycle: {str(e)}")
         return jsonify({"message": "Internal Server Error", "error": str(e)}), 500
 
 @kitting_bp.route('/api/<table_id>/resolve_error', methods=['POST'])
+@releases_table
 def resolve_error(table_id):
     db = get_db()
     data = request.json
@@ -832,16 +795,12 @@ def resolve_error(table_id):
     if raw_cam: 
         cam_id = get_safe_cam_id(raw_cam)
     else:
-        # Fallback check
-        if activity.get('current_kit_errors_cam1'): cam_id = 'cam1'
-        elif activity.get('current_kit_errors_cam2'): cam_id = 'cam2'
-        else: cam_id = 'cam1'
-
-    error_key = f"current_kit_errors_{cam_id}"
+        # Fallback check: first camera with an open error
+        cam_id = next(iter(active_errors(activity)), 'cam1')
     
     log_doc = {
         "activity_id": activity['_id'],
-        "kit_number": activity.get(f'current_kit_index_{cam_id}', 1),
+        "kit_number": cam_state(activity, cam_id)['kit_index'],
         "camera_id": cam_id,
         "table_id": table_id,
         "timestamp": datetime.utcnow(),
@@ -849,29 +808,40 @@ def resolve_error(table_id):
         "reason_selected": data.get('reason'),
         "error_details": error_details 
     }
-    db.error_logs.insert_one(log_doc)
-
-    db.activities.update_one(
-        {"_id": activity['_id']}, 
-        {"$set": {error_key: []}}
-    )
-
-    if data.get('error_type') == 'validation':
-        components = activity.get('components', [])
-        problems = set((error_details.get('missing') or []) + (error_details.get('undercount') or []))
-        for idx, part in enumerate(components):
-            if get_safe_cam_id(part.get('camera')) == cam_id and part.get('name') in problems:
-                key = f"components.{idx}"
-                db.activities.update_one({"_id": activity['_id']}, {"$set": {
-                    f"{key}.resolution_reason": data.get('reason'),
-                    f"{key}.resolution_type": "validation_override"
-                }})
-        
-        updated_act = db.activities.find_one({"_id": activity['_id']})
-        perform_camera_completion(updated_act, db, table_id, cam_id)
+    log_id = db.error_logs.insert_one(log_doc).inserted_id
+
+    # Clear the camera's errors and, for a validation override, flag the overridden parts and close
+    # the kit, in one write conditional on the version we read (re-read and retry on conflict)
+    problems = set((error_details.get('missing') or []) + (error_details.get('undercount') or []))
+    for attempt in range(Config.ACTIVITY_WRITE_RETRIES + 1):
+        if attempt:
+            metrics.incr("occ.resolve.conflicts")
+            activity = db.activities.find_one({"_id": activity['_id'], "status": "on-going"})
+            if not activity:
+                db.error_logs.delete_one({"_id": log_id})
+                return jsonify({"message": "No active job"}), 404
+
+        if data.get('error_type') == 'validation':
+            resolution = apply_resolution(activity, cam_id, problems, data.get('reason'))
+            written = perform_camera_completion(activity, db, table_id, cam_id, extra_set=resolution)
+        else:
+            update = bump_version({"$set": {cam_field(cam_id, 'errors'): []}})
+            written = db.activities.update_one(version_filter(activity), update).matched_count > 0
+        if written:
+            metrics.observe("occ.resolve.retries", attempt)
+            break
+    else:
+        # Nothing was resolved: drop the log so the operator's retry doesn't record it twice
+        metrics.incr("occ.resolve.exhausted")
+        db.error_logs.delete_one({"_id": log_id})
+        return jsonify({"message": "Table busy, retry", "code": "write_conflict"}), 503
+    if data.get('error_type') != 'validation':
+        activity_feed.record(db, activity['_id'], table_id, "error_resolved")
+    rollups.record_error(db, activity, data.get('error_type'),
+                         list(problems) or [error_details.get('detectedPart')], log_doc['timestamp'])
 
     # --- BROADCAST RESOLUTION ---
-    socketio.emit('ui_update', {
+    broadcast('ui_update', {
         "type": "error_resolved",
         "camId": cam_id
     }, to=f"table_{table_id}")
@@ -883,14 +853,20 @@ def resolve_error(table_id):
 def get_history_summary(activity_id, cam_id):
     db = get_db()
     try:
-        activity = db.activities.find_one({"_id": ObjectId(activity_id)})
+        activity = cold_store.find_activity(db, activity_id, {"total_kits_to_pack": 1, "cams": 1, "version": 1})
         if not activity: return jsonify({"status": "error"}), 404
         total_kits = activity.get('total_kits_to_pack', 1)
-        current_idx = activity.get(f'current_kit_index_{cam_id}', 1)
-        history_cursor = db.kit_history.find({
-            "activity_id": ObjectId(activity_id),
-            "camera_id": cam_id
-        }).sort("kit_number", 1)
+        current_idx = cam_state(activity, cam_id)['kit_index']
+        history_cursor = cold_store.kit_history(db, activity_id, cam_id,
+                                                projection={"kit_number": 1, "errors_snapshot": 1,
+                                                            "components_snapshot.found_quantity": 1,
+                                                            "components_snapshot.quantity": 1})
+        # The grid changes with the activity version and with each kit_history insert (written
+        # just before the version bump, and removed again if the bump loses): pollers that are
+        # up to date get a 304
+        etag = activity_etag(activity, len(history_cursor))
+        cached = not_modified(etag)
+        if cached: return cached
         summary_map = {}
         for record in history_cursor:
             status = 'green'
@@ -913,7 +889,7 @@ def get_history_summary(activity_id, cam_id):
                 item["state"] = "pending"
                 item["color"] = "grey"
             grid_data.append(item)
-        return jsonify({"status": "success", "grid": grid_data})
+        return cacheable(jsonify({"status": "success", "grid": grid_data}), etag)
     except Exception as e: return jsonify({"status": "error", "message": str(e)}), 500
 
 # --- HISTORY DETAILS API (Updated to include Validation Image) ---
@@ -921,44 +897,123 @@ def get_history_summary(activity_id, cam_id):
 def get_kit_history_details(activity_id, cam_id, kit_number):
     db = get_db()
     try:
-        # 1. Fetch the specific history record
-        record = db.kit_history.find_one({
-            "activity_id": ObjectId(activity_id),
-            "camera_id": cam_id,
-            "kit_number": kit_number
-        })
+        # 1. Fetch the specific history record (hot or cold storage)
+        records = cold_store.kit_history(db, activity_id, cam_id, kit_number)
+        record = records[0] if records else None
         
         if not record: 
             return jsonify({"status": "error", "message": "Record not found"}), 404
-        
-        # 2. Sanitize Errors (Convert ObjectIds/Datetimes to strings)
-        cleaned_errors = []
-        for e in record.get('errors_snapshot', []): 
-            if '_id' in e: e['_id'] = str(e['_id'])
-            if 'activity_id' in e: e['activity_id'] = str(e['activity_id'])
-            if 'timestamp' in e and isinstance(e['timestamp'], datetime):
-                e['timestamp'] = e['timestamp'].isoformat()
-            cleaned_errors.append(e)
-        
-        # 3. Sanitize Components
-        for c in record.get('components_snapshot', []):
-             if '_id' in c: c['_id'] = str(c['_id'])
 
-        # 4. Return Data (INCLUDING THE NEW IMAGE FIELD)
-        return jsonify({
+        # A finished kit's record never changes: browsers keep it, and revalidate by its _id and
+        # completion time (the record of a kit is rewritten if its first completion did not stick)
+        completed_at = record.get('completed_at')
+        etag = f"{record['_id']}.{int(completed_at.timestamp() * 1000) if completed_at else 0}"
+        cached = not_modified(etag, Config.HISTORY_CACHE_MAX_AGE)
+        if cached: return cached
+        
+        # 2. Return Data (INCLUDING THE NEW IMAGE FIELD); jsonify encodes ObjectIds / datetimes
+        return cacheable(jsonify({
             "status": "success",
             "components": record.get('components_snapshot', []),
-            "errors": cleaned_errors,
+            "errors": record.get('errors_snapshot', []),
             
             # --- NEW FIELD ADDED HERE ---
             "validation_image_url": record.get('validation_image_url') 
-        })
+        }), etag, Config.HISTORY_CACHE_MAX_AGE)
 
     except Exception as e:
         current_app.logger.error(f"History API Error: {e}")
         return jsonify({"status": "error", "message": str(e)}), 500
     
     
+# --- HELPER: PAGINATION ---
+def page_args():
+    """(page, per_page, skip) from ?page=&per_page=, clamped to API_PAGE_SIZE_MAX."""
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', Config.API_PAGE_SIZE, type=int), 1), Config.API_PAGE_SIZE_MAX)
+    return page, per_page, (page - 1) * per_page
+
+def paged(items, total, page, per_page):
+    return jsonify({
+        "status": "success",
+        "items": items,
+        "page": page,
+        "per_page": per_page,
+        "total": total,
+        "has_more": page * per_page < total
+    })
+
+# --- CAPTURE GALLERY API (one part of the live kit, paginated) ---
+@kitting_bp.route('/api/activity/<activity_id>/captures/<int:part_index>')
+def get_part_captures(activity_id, part_index):
+    """Detection records of components[part_index], oldest first, sliced server-side."""
+    try:
+        db = get_db()
+        page, per_page, skip = page_args()
+        if cold_store.is_archived(db, activity_id):
+            components = cold_store.find_activity(db, activity_id).get('components', [])
+            images = (components[part_index].get('captured_images') or []) if part_index < len(components) else []
+            return paged(images[skip:skip + per_page], len(images), page, per_page)
+
+        images = {"$ifNull": [{"$arrayElemAt": ["$components.captured_images", part_index]}, []]}
+        rows = list(db.activities.aggregate([
+            {"$match": {"_id": ObjectId(activity_id)}},
+            {"$project": {"total": {"$size": images}, "items": {"$slice": [images, skip, per_page]}}}
+        ]))
+        if not rows: return jsonify({"status": "error", "message": "Activity not found"}), 404
+        return paged(rows[0]['items'], rows[0]['total'], page, per_page)
+    except (InvalidId, TypeError): return jsonify({"status": "error", "message": "Invalid Job ID"}), 400
+    except Exception as e:
+        current_app.logger.error(f"Captures API Error: {e}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+# --- ERROR LOG API (resolved errors of a job, newest first) ---
+@kitting_bp.route('/api/activity/<activity_id>/errors')
+def get_activity_errors(activity_id):
+    try:
+        db = get_db()
+        page, per_page, skip = page_args()
+        query = {"activity_id": ObjectId(activity_id)}
+        if request.args.get('cam'):
+            query["camera_id"] = get_safe_cam_id(request.args['cam'])
+        if cold_store.is_archived(db, activity_id):
+            items = [e for e in cold_store.error_logs(db, activity_id)
+                     if 'camera_id' not in query or e.get('camera_id') == query['camera_id']]
+            items.sort(key=lambda e: e.get('timestamp') or datetime.min, reverse=True)
+            return paged(items[skip:skip + per_page], len(items), page, per_page)
+
+        total = db.error_logs.count_documents(query)
+        items = list(db.error_logs.find(query).sort("timestamp", -1).skip(skip).limit(per_page))
+        return paged(items, total, page, per_page)
+    except (InvalidId, TypeError): return jsonify({"status": "error", "message": "Invalid Job ID"}), 400
+    except Exception as e:
+        current_app.logger.error(f"Error log API Error: {e}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+# --- KIT HISTORY API (finished kits of a job, newest first, without detection records) ---
+@kitting_bp.route('/api/activity/<activity_id>/history')
+def get_activity_history(activity_id):
+    try:
+        db = get_db()
+        page, per_page, skip = page_args()
+        query = {"activity_id": ObjectId(activity_id)}
+        if request.args.get('cam'):
+            query["camera_id"] = get_safe_cam_id(request.args['cam'])
+        if cold_store.is_archived(db, activity_id):
+            items = cold_store.kit_history(db, activity_id, query.get('camera_id'),
+                                           projection={"components_snapshot.captured_images": 0})
+            items.sort(key=lambda h: (-(h.get('kit_number') or 0), h.get('camera_id') or ''))
+            return paged(items[skip:skip + per_page], len(items), page, per_page)
+
+        total = db.kit_history.count_documents(query)
+        items = list(db.kit_history.find(query, {"components_snapshot.captured_images": 0})
+                     .sort([("kit_number", -1), ("camera_id", 1)]).skip(skip).limit(per_page))
+        return paged(items, total, page, per_page)
+    except (InvalidId, TypeError): return jsonify({"status": "error", "message": "Invalid Job ID"}), 400
+    except Exception as e:
+        current_app.logger.error(f"History list API Error: {e}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
 # --- GET ACTIVE ERROR DETAILS (LOCK STATUS) ---
 @kitting_bp.route('/api/<table_id>/active_errors', methods=['GET'])
 def get_active_errors(table_id):
@@ -977,28 +1032,17 @@ def get_active_errors(table_id):
                 "message": "No active job running"
             }), 200
 
-        # 2. Check for errors across standard cameras
-        active_errors = {}
-        is_locked = False
-        
-        # List the database keys where errors are stored
-        error_keys = ['current_kit_errors_cam1', 'current_kit_errors_cam2']
-        
-        for key in error_keys:
-            # specific_errors is a list of error objects
-            specific_errors = activity.get(key, [])
-            if specific_errors:
-                is_locked = True
-                # Extract clean camera name (e.g., 'cam1')
-                cam_name = key.replace('current_kit_errors_', '')
-                active_errors[cam_name] = specific_errors
+        # 2. Check for errors across every camera of the job
+        errors = active_errors(activity)
+        cameras = activity_cameras(activity)
 
         # 3. Return the status
         return jsonify({
-            "locked": is_locked,
+            "locked": bool(errors),
             "table_id": table_id,
-            "kit_number": activity.get('current_kit_index_cam1', 1), # Context
-            "errors": active_errors
+            "kit_number": cam_state(activity, cameras[0])['kit_index'] if cameras else 1, # Context
+            "kit_numbers": {cam: cam_state(activity, cam)['kit_index'] for cam in cameras},
+            "errors": errors
         }), 200
 
     except Exception as e:
@@ -1012,8 +1056,6 @@ def get_active_errors(table_id):
 ######## on-demand APIS starts #######################
 
 
-from bson import json_util
-
 # --- GET FULL ON-GOING ACTIVITY DETAILS ---
 @kitting_bp.route('/api/table_status/<table_id>', methods=['GET'])
 def get_ongoing_activity_details(table_id):
@@ -1024,11 +1066,17 @@ def get_ongoing_activity_details(table_id):
     try:
         db = get_db()
         
-        # 1. Fetch the raw document
-        activity = db.activities.find_one({
+        # 1. Check the version first: a poller that has the current state gets a 304
+        #    without the (possibly multi-MB) document being read at all
+        head = db.activities.find_one({
             "table_id": str(table_id), 
             "status": "on-going"
-        })
+        }, {"version": 1, "captures_flushed": 1})
+        cached = not_modified(activity_etag(head))
+        if cached: return cached
+
+        # 2. Fetch the raw document
+        activity = db.activities.find_one({"_id": head['_id']}) if head else None
         
         if not activity:
             return jsonify({
@@ -1036,13 +1084,8 @@ def get_ongoing_activity_details(table_id):
                 "message": "No active job found for this table."
             }), 404
 
-        # 2. Serialize BSON to JSON
-        # MongoDB documents contain ObjectIds and Datetimes which break standard flask.jsonify
-        # We use json_util to convert them to strings/ISO format safely.
-        activity_json = json.loads(json_util.dumps(activity))
-        
-        # 3. Return the whole data
-        return jsonify(activity_json), 200
+        # 3. Return the whole data (app/serializer.py encodes ObjectIds / datetimes in one pass)
+        return cacheable(jsonify(activity), activity_etag(activity)), 200
 
     except Exception as e:
         current_app.logger.error(f"Error fetching activity details: {str(e)}")
@@ -1057,378 +1100,29 @@ def get_ongoing_activity_details(table_id):
 
     
     
-    
-# --- HELPER: Build the "Kit Header + Detection Table + Errors" structure ---
-def build_camera_data(activity_id, camera_key, db):
-    # 1. Fetch History
-    history_cursor = db.kit_history.find({
-        "activity_id": ObjectId(activity_id),
-        "camera_id": camera_key
-    }).sort("kit_number", 1)
-    
-    # 2. Fetch Errors (Look for errors matching this camera)
-    error_cursor = db.error_logs.find({
-        "activity_id": ObjectId(activity_id),
-        "$or": [{"camera_id": camera_key}, {"camId": camera_key}, {"cam_id": camera_key}]
-    })
-
-    # 3. Organize Data
-    history_map = {h.get('kit_number'): h for h in history_cursor}
-    error_map = {}
-    for err in error_cursor:
-        k_num = err.get('kit_number')
-        if k_num:
-            if k_num not in error_map: error_map[k_num] = []
-            error_map[k_num].append(err)
-
-    all_kits = sorted(set(history_map.keys()) | set(error_map.keys()))
-    excel_rows = []
-
-    for k_num in all_kits:
-        hist = history_map.get(k_num, {})
-        errs = error_map.get(k_num, [])
-
-        # ==========================================
-        # SECTION 1: KIT HEADER
-        # ==========================================
-        start_time = hist.get('completed_at') or hist.get('timestamp') or "N/A"
-        if errs:
-            status = "⚠ Issues Found"
-            perf = f"Operator fixed {len(errs)} error(s)"
-        else:
-            status = "✅ Perfect"
-            perf = "First Pass Yield"
-
-        excel_rows.append({
-            "Col_A": f"KIT {k_num}",
-            "Col_B": f"Time: {start_time}",
-            "Col_C": f"Status: {status}",
-            "Col_D": f"Perf: {perf}"
-        })
-
-        # ==========================================
-        # SECTION 2: DETECTED OBJECTS TABLE
-        # ==========================================
-        excel_rows.append({
-            "Col_A": "TRACKING ID",
-            "Col_B": "OBJECT NAME",
-            "Col_C": "CONFIDENCE",
-            "Col_D": "IMAGE URL"
-        })
-
-        components = hist.get('components_snapshot', [])
-        found_any_detection = False
-
-        if components:
-            for part in components:
-                captures = part.get('captured_images', [])
-                if isinstance(captures, dict): captures = list(captures.values())
-
-                for cap in captures:
-                    found_any_detection = True
-                    t_id = cap.get('tracking_id', 'N/A')
-                    name = cap.get('ai_class_name') or part.get('name')
-                    conf = cap.get('confidence', 0)
-                    img = cap.get('image_url', '')
-
-                    excel_rows.append({
-                        "Col_A": str(t_id),
-                        "Col_B": name,
-                        "Col_C": f"{float(conf):.4f}",
-                        "Col_D": img
-                    })
-
-        if not found_any_detection:
-            excel_rows.append({"Col_A": "No Object Data Recorded", "Col_B": "", "Col_C": "", "Col_D": ""})
-
-        # Spacer before errors
-        excel_rows.append({}) 
-
-        # ==========================================
-        # SECTION 3: ERRORS & ANOMALIES (New)
-        # ==========================================
-        if errs:
-            # Header for Errors
-            excel_rows.append({
-                "Col_A": "ERROR TYPE",
-                "Col_B": "DETAILS / MISSING",
-                "Col_C": "RESOLUTION REASON",
-                "Col_D": "EVIDENCE IMAGE"
-            })
-
-            for err in errs:
-                # Extract details
-                e_type = err.get('error_type', 'Unknown')
-                reason = err.get('reason_selected', 'Pending')
-                timestamp = err.get('timestamp', '')
-                
-                # specific details based on error type
-                details_obj = err.get('error_details', {})
-                desc = ""
-                
-                if e_type == 'validation':
-                    missing = details_obj.get('missing', [])
-                    undercount = details_obj.get('undercount', [])
-                    desc_parts = []
-                    if missing: desc_parts.append(f"Missing: {','.join(missing)}")
-                    if undercount: desc_parts.append(f"Undercount: {','.join(undercount)}")
-                    desc = " | ".join(desc_parts) if desc_parts else "Validation Failed"
-                else:
-                    # Anomaly / Wrong Part
-                    detected = details_obj.get('detectedPart') or details_obj.get('AiDetectedPartName')
-                    msg = details_obj.get('message', 'Wrong Part')
-                    desc = f"{msg} (Detected: {detected})"
-
-                # Image (check nested or root)
-                e_img = details_obj.get('imageUrl') or err.get('imageUrl') or ""
-
-                excel_rows.append({
-                    "Col_A": e_type.upper(),
-                    "Col_B": desc,
-                    "Col_C": reason,
-                    "Col_D": e_img
-                })
-
-        # ==========================================
-        # SPACER BETWEEN KITS
-        # ==========================================
-        excel_rows.append({}) 
-        excel_rows.append({}) 
-
-    return excel_rows
-
-# --- MAIN ROUTE ---
+# --- REPORT DOWNLOADS (app/reports.py is imported on first use: pandas / ReportLab are heavy) ---
 @kitting_bp.route('/api/download_report/<activity_id>', methods=['GET'])
 def download_excel_report(activity_id):
     try:
-        db = get_db()
-        
-        # 1. Build Data
-        data_cam1 = build_camera_data(activity_id, "cam1", db)
-        data_cam2 = build_camera_data(activity_id, "cam2", db)
-        
-        # 2. Create Excel
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            
-            # Helper to write sheet and format
-            def write_sheet(data, sheet_name):
-                df = pd.DataFrame(data)
-                if not df.empty:
-                    df.to_excel(writer, index=False, header=False, sheet_name=sheet_name)
-                    ws = writer.sheets[sheet_name]
-                    ws.column_dimensions['A'].width = 20
-                    ws.column_dimensions['B'].width = 40 # Wider for Object Name / Error Details
-                    ws.column_dimensions['C'].width = 25 # Resolution
-                    ws.column_dimensions['D'].width = 60 # Image URL
-                else:
-                    pd.DataFrame(["No Data"]).to_excel(writer, sheet_name=sheet_name)
-
-            write_sheet(data_cam1, 'Camera 1')
-            write_sheet(data_cam2, 'Camera 2')
-
-        output.seek(0)
-        filename = f"Kitting_Report_{activity_id}.xlsx"
-
+        from app import reports
+        output = reports.excel_report(activity_id, get_db())
         return send_file(
             output, 
             mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
             as_attachment=True, 
-            download_name=filename
+            download_name=f"Kitting_Report_{activity_id}.xlsx"
         )
 
     except Exception as e:
         current_app.logger.error(f"Excel Error: {e}")
         return jsonify({"message": "Failed to generate report", "error": str(e)}), 500
-    
-    
-    
-    
-    
-    
 
 
-
-
-
-
-
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import A4
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, PageBreak
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
-from flask import send_file, current_app, jsonify
-from bson import ObjectId
-
-# --- IMPORT CONFIG ---
-from app.config import Config
-
-# 1. GET URL FROM CONFIG (Dynamic)
-VM_BASE_URL = Config.SOCKET_SERVER_URL
-# Fallback if config is missing (optional safety)
-if not VM_BASE_URL:
-    VM_BASE_URL = "http://localhost:5000"
-
-
-# --- HELPER: Build PDF Content for One Camera ---
-def build_camera_pdf_section(activity_id, camera_key, db, styles):
-    elements = []
-    
-    # Header for Camera Section
-    elements.append(Paragraph(f"Report for {camera_key.upper()}", styles['Heading2']))
-    elements.append(Spacer(1, 12))
-
-    # Fetch Data
-    history_cursor = db.kit_history.find({"activity_id": ObjectId(activity_id), "camera_id": camera_key}).sort("kit_number", 1)
-    history_map = {h.get('kit_number'): h for h in history_cursor}
-    
-    error_cursor = db.error_logs.find({"activity_id": ObjectId(activity_id), "$or": [{"camera_id": camera_key}, {"camId": camera_key}, {"cam_id": camera_key}]})
-    error_map = {}
-    for err in error_cursor:
-        k_num = err.get('kit_number')
-        if k_num:
-            if k_num not in error_map: error_map[k_num] = []
-            error_map[k_num].append(err)
-
-    all_kits = sorted(set(history_map.keys()) | set(error_map.keys()))
-
-    if not all_kits:
-        elements.append(Paragraph("No data recorded for this camera.", styles['Normal']))
-        return elements
-
-    # --- LOOP KITS ---
-    for k_num in all_kits:
-        hist = history_map.get(k_num, {})
-        errs = error_map.get(k_num, [])
-
-        # 1. Kit Status Header
-        status = "Completed"
-        color = "green"
-        if errs: 
-            status = f"Issues Found (Fixed {len(errs)})"
-            color = "red"
-        
-        elements.append(Paragraph(f"<b>KIT {k_num}</b> - <font color='{color}'>{status}</font>", styles['Heading3']))
-        
-        timestamp = hist.get('completed_at') or hist.get('timestamp') or "N/A"
-        elements.append(Paragraph(f"Time: {timestamp}", styles['Normal']))
-        elements.append(Spacer(1, 6))
-
-        # 2. Detections Table (NOW WITH IMAGES)
-        # Columns: ID, Name, Conf, Image Link
-        data = [['Tracking ID', 'Object Name', 'Confidence', 'Image']]
-        
-        components = hist.get('components_snapshot', [])
-        found_detections = False
-
-        if components:
-            for part in components:
-                captures = part.get('captured_images', [])
-                if isinstance(captures, dict): captures = list(captures.values())
-                
-                for cap in captures:
-                    found_detections = True
-                    
-                    # Generate Link for Detection
-                    img_path = cap.get('image_url', '')
-                    link_text = "-"
-                    if img_path:
-                        full_url = f"{VM_BASE_URL}{img_path}"
-                        link_text = Paragraph(f'<a href="{full_url}" color="blue"><u>Open</u></a>', styles['Normal'])
-
-                    data.append([
-                        str(cap.get('tracking_id', '-')),
-                        cap.get('ai_class_name') or part.get('name', 'Unknown'),
-                        f"{float(cap.get('confidence', 0)):.2f}",
-                        link_text
-                    ])
-        
-        if found_detections:
-            t = Table(data, colWidths=[1.2*inch, 2.0*inch, 1.2*inch, 1.2*inch])
-            t.setStyle(TableStyle([
-                ('BACKGROUND', (0,0), (-1,0), colors.lightgrey),
-                ('GRID', (0,0), (-1,-1), 1, colors.black),
-                ('ALIGN', (0,0), (-1,-1), 'CENTER'),
-                ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
-                ('FONTSIZE', (0,0), (-1,-1), 10),
-            ]))
-            elements.append(t)
-        else:
-            elements.append(Paragraph("No detections recorded.", styles['Italic']))
-        
-        elements.append(Spacer(1, 6))
-
-        # 3. VALIDATION IMAGE (The Final Proof)
-        val_img = hist.get('validation_image_url')
-        if val_img:
-            val_url = f"{VM_BASE_URL}{val_img}"
-            elements.append(Paragraph(f'<b>Validation Proof:</b> <a href="{val_url}" color="blue"><u>Open Final Image</u></a>', styles['Normal']))
-            elements.append(Spacer(1, 6))
-
-        # 4. ERRORS & LINKS
-        if errs:
-            elements.append(Spacer(1, 4))
-            elements.append(Paragraph("<b>Errors & Anomalies:</b>", styles['Normal']))
-            
-            error_table_data = [['Type', 'Reason', 'Image Link']]
-            
-            for err in errs:
-                details = err.get('error_details', {})
-                img_path = details.get('imageUrl') or err.get('imageUrl') or ""
-                
-                link_text = "No Image"
-                if img_path:
-                    full_url = f"{VM_BASE_URL}{img_path}"
-                    link_text = Paragraph(f'<a href="{full_url}" color="blue"><u>Open Image</u></a>', styles['Normal'])
-                
-                error_table_data.append([
-                    err.get('error_type', 'Error'),
-                    err.get('reason_selected', 'Pending'),
-                    link_text
-                ])
-
-            et = Table(error_table_data, colWidths=[1.5*inch, 2*inch, 2*inch])
-            et.setStyle(TableStyle([
-                ('BACKGROUND', (0,0), (-1,0), colors.mistyrose),
-                ('GRID', (0,0), (-1,-1), 1, colors.red),
-                ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
-            ]))
-            elements.append(et)
-        
-        # Divider Line
-        elements.append(Spacer(1, 10))
-        elements.append(Paragraph("_" * 65, styles['Normal']))
-        elements.append(Spacer(1, 15))
-
-    return elements
-
-# --- MAIN PDF ROUTE ---
 @kitting_bp.route('/api/download_pdf/<activity_id>', methods=['GET'])
 def download_pdf_report(activity_id):
     try:
-        db = get_db()
-        output = io.BytesIO()
-        doc = SimpleDocTemplate(output, pagesize=A4)
-        styles = getSampleStyleSheet()
-        story = []
-
-        # Title
-        story.append(Paragraph(f"Kitting Report: {activity_id}", styles['Title']))
-        story.append(Paragraph(f"Image Source: {VM_BASE_URL}", styles['Normal']))
-        story.append(Spacer(1, 12))
-
-        # Camera 1 Section
-        story.extend(build_camera_pdf_section(activity_id, "cam1", db, styles))
-        story.append(PageBreak()) 
-
-        # Camera 2 Section
-        story.extend(build_camera_pdf_section(activity_id, "cam2", db, styles))
-
-        # Build PDF
-        doc.build(story)
-        output.seek(0)
-        
+        from app import reports
+        output = reports.pdf_report(activity_id, get_db())
         return send_file(
             output,
             mimetype='application/pdf',
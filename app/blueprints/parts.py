@@ -1,20 +1,42 @@
-from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for
+from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for, Response, stream_with_context, current_app
 from app.db import get_db
 from bson.objectid import ObjectId
 from datetime import datetime
+import time
+from app.config import Config
+from app.kit_catalog import kit_catalog, bump_version, versioned_update
+from app.kitting_core import compile_kit
+from app import kit_import
 
 parts_bp = Blueprint('parts', __name__, url_prefix='/parts')
 
 @parts_bp.route('/')
 def list_kits():
-    """Lists all created kits."""
+    """Lists the kits one page at a time, optionally filtered by ?q= (name, EDP or part prefix)."""
+    query = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = Config.KIT_LIST_PAGE_SIZE
     try:
         db = get_db()
-        kits = list(db.kits.find().sort("created_at", -1))
-        return render_template('parts_list.html', kits=kits)
+        kits, total = kit_catalog.search(db, query, (page - 1) * per_page, per_page)
     except Exception as e:
         flash(f"Error loading kits: {str(e)}", "danger")
-        return render_template('parts_list.html', kits=[])
+        kits, total = [], 0
+    pages = max((total + per_page - 1) // per_page, 1)
+    return render_template('parts_list.html', kits=kits, q=query, page=page, pages=pages, total=total)
+
+@parts_bp.route('/api/search', methods=['GET'])
+def search_kits():
+    """Typeahead: kits whose name, EDP or part names start with ?q= (every word of it)."""
+    started = time.perf_counter()
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 100)
+    page = max(request.args.get('page', 1, type=int), 1)
+    try:
+        kits, total = kit_catalog.search(get_db(), request.args.get('q', ''), (page - 1) * limit, limit)
+        return jsonify({'status': 'success', 'items': kits, 'total': total, 'page': page,
+                        'took_ms': round((time.perf_counter() - started) * 1000, 2)})
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
 
 @parts_bp.route('/create', methods=['GET'])
 def create_kit_form():
@@ -47,25 +69,24 @@ def save_kit():
         if not data.get('kit_name') or not data.get('edp_number'):
             return jsonify({'status': 'error', 'message': 'Kit Name and EDP Number are required.'}), 400
 
-        # The 'parts' list now contains objects with:
+        # The 'parts' list contains objects with:
         # { name: "...", quantity: 1, camera: "...", alert_missing: true/false, ... }
-        kit_doc = {
-            "kit_name": data['kit_name'],
-            "edp_number": data['edp_number'],
-            "parts": data.get('parts', []), 
-            "updated_at": datetime.utcnow()
-        }
+        # and is stored compiled (normalized cameras, boolean alerts, per-camera groups, hash)
+        try:
+            parts, compiled = compile_kit(data.get('parts', []))
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
 
+        fields = {"kit_name": data['kit_name'], "edp_number": data['edp_number']}
+        now = datetime.utcnow()
         if data.get('kit_id'):
-            db.kits.update_one(
-                {"_id": ObjectId(data['kit_id'])},
-                {"$set": kit_doc}
-            )
+            db.kits.update_one({"_id": ObjectId(data['kit_id'])}, versioned_update(fields, parts, compiled, now))
             message = "Kit updated successfully!"
         else:
-            kit_doc["created_at"] = datetime.utcnow()
-            db.kits.insert_one(kit_doc)
+            db.kits.insert_one({**fields, "parts": parts, "compiled": compiled, "kit_version": 1,
+                                "updated_at": now, "created_at": now})
             message = "Kit created successfully!"
+        bump_version(db)
 
         return jsonify({'status': 'success', 'message': message, 'redirect': url_for('parts.list_kits')})
 
@@ -78,8 +99,33 @@ def delete_kit(kit_id):
     try:
         db = get_db()
         db.kits.delete_one({"_id": ObjectId(kit_id)})
+        bump_version(db)
         flash("Kit deleted.", "success")
     except Exception as e:
         flash(f"Error deleting kit: {str(e)}", "danger")
     
-    return redirect(url_for('parts.list_kits'))
\ No newline at end of file
+    return redirect(url_for('parts.list_kits'))
+
+@parts_bp.route('/import', methods=['POST'])
+def import_kits():
+    """Bulk import of BOM rows from a CSV / XLSX upload (?dry_run=1 only validates)."""
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        return jsonify({'status': 'error', 'message': 'No file uploaded.'}), 400
+    try:
+        db = get_db()
+        dry_run = request.args.get('dry_run', '').lower() in ('1', 'true', 'yes')
+        report = kit_import.import_rows(db, kit_import.read_rows(upload.stream, upload.filename), dry_run)
+        current_app.logger.info(f"📥 Kit import {upload.filename}: {report.kits} kits, {report.parts} parts, {report.error_count} row errors")
+        return jsonify({'status': 'success', 'dry_run': dry_run, **report.to_dict()})
+    except Exception as e:
+        current_app.logger.error(f"Kit import error: {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@parts_bp.route('/export', methods=['GET'])
+def export_kits():
+    """Streams the whole catalog as CSV (the import format)."""
+    db = get_db()
+    filename = f"kit_catalog_{datetime.utcnow():%Y%m%d}.csv"
+    return Response(stream_with_context(kit_import.export_csv(db)), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
@@ -0,0 +1,261 @@
+import copy
+import heapq
+import threading
+import traceback
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from itertools import islice
+
+import bson
+from bson import Binary
+
+from app.config import Config
+from app.storage import get_storage
+
+# Cold storage for old finished jobs. One document per job in db.activities_cold:
+#   {_id: activity _id, <header fields>, "archived_at", "counts", "blob" | "blob_key"}
+# The blob is the zlib-compressed BSON of {"activity", "kit_history", "error_logs"}; blobs
+# too large for a document are written to the capture storage under COLD_PREFIX instead.
+# The header is enough for the history list, so only reports / detail views inflate the blob.
+COLD_COLLECTION = "activities_cold"
+COLD_PREFIX = "_cold/"
+
+HEADER_FIELDS = ("table_id", "kit_name", "edp_number", "order_number", "status", "start_time",
+                 "end_time", "total_kits_to_pack", "capture_stats", "captures_bundle", "captures_evicted")
+
+
+def header_of(activity):
+    """Fields kept uncompressed: what kitting_history.html and the capture quota read."""
+    header = {k: activity[k] for k in HEADER_FIELDS if k in activity}
+    header['cams'] = {cam: {"kit_index": state.get('kit_index', 1)}
+                      for cam, state in (activity.get('cams') or {}).items()}
+    header['components'] = [{"camera": c.get('camera')} for c in activity.get('components', [])]
+    return header
+
+# Same fields from a hot job: the cams are cut down to their kit_index like header_of() does
+HOT_HEADER_PIPELINE = [{"$project": {
+    **{k: 1 for k in HEADER_FIELDS},
+    "components.camera": 1,
+    "cams": {"$arrayToObject": {"$map": {
+        "input": {"$objectToArray": {"$ifNull": ["$cams", {}]}},
+        "in": {"k": "$$this.k", "v": {"kit_index": "$$this.v.kit_index"}}
+    }}}
+}}]
+COLD_HEADER_PROJECTION = {**{k: 1 for k in HEADER_FIELDS}, "cams": 1, "components": 1}
+
+
+# --- ARCHIVING (hot -> cold) ---
+def archive_activity(activity, db):
+    """Moves one finished job and its kit_history / error_logs to cold storage. Returns blob size."""
+    oid = activity['_id']
+    payload = {
+        "activity": activity,
+        "kit_history": list(db.kit_history.find({"activity_id": oid})),
+        "error_logs": list(db.error_logs.find({"activity_id": oid}))
+    }
+    raw = bson.encode(payload)
+    blob = zlib.compress(raw, Config.COLD_ARCHIVE_COMPRESSION_LEVEL)
+
+    doc = {
+        "_id": oid,
+        **header_of(activity),
+        "archived_at": datetime.utcnow(),
+        "counts": {"kit_history": len(payload['kit_history']), "error_logs": len(payload['error_logs'])},
+        "raw_bytes": len(raw),
+        "blob_bytes": len(blob)
+    }
+    if len(blob) <= Config.COLD_INLINE_MAX_BYTES:
+        doc['blob'] = Binary(blob)
+    else:
+        doc['blob_key'] = f"{COLD_PREFIX}{oid}.bson.z"
+        get_storage().save(doc['blob_key'], blob, "application/octet-stream")
+    db[COLD_COLLECTION].replace_one({"_id": oid}, doc, upsert=True)
+
+    # Cold copy first, hot delete last; the job goes before its children so that a crash in
+    # between leaves orphaned rows at worst, never a cold copy that lost its history.
+    db.activities.delete_one({"_id": oid, "status": {"$ne": "on-going"}})
+    db.kit_history.delete_many({"activity_id": oid})
+    db.error_logs.delete_many({"activity_id": oid})
+    return len(blob)
+
+
+def archive_pending(db, logger=None):
+    """Archives jobs finished more than COLD_ARCHIVE_AFTER_DAYS ago (oldest first)."""
+    query = {
+        "status": {"$ne": "on-going"},
+        "end_time": {"$lt": datetime.utcnow() - timedelta(days=Config.COLD_ARCHIVE_AFTER_DAYS)}
+    }
+    if Config.CAPTURE_ARCHIVE_ENABLED:
+        # Let the capture archiver bundle the job first (it only looks at hot activities)
+        query["$or"] = [{"captures_bundle": {"$exists": True}}, {"captures_evicted": {"$exists": True}}]
+
+    moved = 0
+    for activity in db.activities.find(query).sort("end_time", 1).limit(Config.COLD_ARCHIVE_BATCH):
+        size = archive_activity(activity, db)
+        moved += 1
+        if logger: logger.info(f"🧊 Moved activity {activity['_id']} to cold storage ({size} bytes compressed)")
+    return moved
+
+
+# --- TRANSPARENT READS ---
+_archived_ids = OrderedDict()   # LRU of jobs known to be cold (they never come back, so a hit stays true)
+_loaded = OrderedDict()         # Small LRU of inflated jobs (a report reads one job per camera)
+_loaded_lock = threading.Lock()
+_ARCHIVED_IDS_SIZE = 4096
+_LOADED_CACHE_SIZE = 8
+
+def _remember_archived(oid):
+    with _loaded_lock:
+        _archived_ids[oid] = True
+        _archived_ids.move_to_end(oid)
+        while len(_archived_ids) > _ARCHIVED_IDS_SIZE:
+            _archived_ids.popitem(last=False)
+
+def is_archived(db, activity_id):
+    oid = bson.ObjectId(activity_id)
+    with _loaded_lock:
+        if oid in _archived_ids:
+            _archived_ids.move_to_end(oid)
+            return True
+    if db[COLD_COLLECTION].find_one({"_id": oid}, {"_id": 1}):
+        _remember_archived(oid)
+        return True
+    return False
+
+
+def load(db, activity_id):
+    """{'activity', 'kit_history', 'error_logs'} of an archived job, or None."""
+    oid = bson.ObjectId(activity_id)
+    with _loaded_lock:
+        if oid in _loaded:
+            _loaded.move_to_end(oid)
+            return _loaded[oid]
+
+    doc = db[COLD_COLLECTION].find_one({"_id": oid}, {"blob": 1, "blob_key": 1})
+    if not doc:
+        return None
+    blob = doc['blob'] if 'blob' in doc else get_storage().read(doc['blob_key'])
+    job = bson.decode(zlib.decompress(blob))
+    with _loaded_lock:
+        _loaded[oid] = job
+        while len(_loaded) > _LOADED_CACHE_SIZE:
+            _loaded.popitem(last=False)
+    _remember_archived(oid)
+    return job
+
+
+def _copy(doc, projection):
+    """
+    Private copy of a cached cold document. Exclusion projections ({"a.b": 0}) are applied;
+    inclusion projections return the whole document (callers only read the fields they asked for).
+    """
+    doc = copy.deepcopy(doc)
+    if projection and not any(projection.values()):
+        for path in projection:
+            _drop(doc, path.split('.'))
+    return doc
+
+def _drop(value, parts):
+    if isinstance(value, list):
+        for item in value: _drop(item, parts)
+    elif isinstance(value, dict):
+        if len(parts) == 1: value.pop(parts[0], None)
+        elif parts[0] in value: _drop(value[parts[0]], parts[1:])
+
+
+def find_activity(db, activity_id, projection=None):
+    """The job from the hot collection, else from cold storage."""
+    activity = db.activities.find_one({"_id": bson.ObjectId(activity_id)}, projection)
+    if activity is None:
+        job = load(db, activity_id)
+        activity = _copy(job['activity'], projection) if job else None
+    return activity
+
+
+def _on_camera(doc, camera_id, legacy_fields):
+    return camera_id is None or any(doc.get(f) == camera_id for f in legacy_fields)
+
+
+def kit_history(db, activity_id, camera_id=None, kit_number=None, projection=None):
+    """A job's finished kits (optionally one camera / kit), ordered by kit number."""
+    if is_archived(db, activity_id):
+        rows = [_copy(h, projection) for h in load(db, activity_id)['kit_history']
+                if _on_camera(h, camera_id, ("camera_id",)) and (kit_number is None or h.get('kit_number') == kit_number)]
+        return sorted(rows, key=lambda h: h.get('kit_number') or 0)
+
+    query = {"activity_id": bson.ObjectId(activity_id)}
+    if camera_id is not None: query["camera_id"] = camera_id
+    if kit_number is not None: query["kit_number"] = kit_number
+    return list(db.kit_history.find(query, projection).sort("kit_number", 1))
+
+
+def error_logs(db, activity_id, camera_id=None):
+    """A job's resolved errors (optionally one camera, under any of its legacy field names)."""
+    legacy_fields = ("camera_id", "camId", "cam_id")
+    if is_archived(db, activity_id):
+        return [_copy(e, None) for e in load(db, activity_id)['error_logs'] if _on_camera(e, camera_id, legacy_fields)]
+
+    query = {"activity_id": bson.ObjectId(activity_id)}
+    if camera_id is not None:
+        query["$or"] = [{f: camera_id} for f in legacy_fields]
+    return list(db.error_logs.find(query))
+
+
+def history_cameras(db, activity_id):
+    """Cameras that have finished kits in a job."""
+    if is_archived(db, activity_id):
+        return {h.get('camera_id') for h in load(db, activity_id)['kit_history']}
+    return set(db.kit_history.distinct("camera_id", {"activity_id": bson.ObjectId(activity_id)}))
+
+
+def evict_captures(db, header):
+    """Capture quota for an archived job: deletes its captures and marks the cold header."""
+    from app.archiver import delete_activity_captures
+    job = load(db, header['_id'])
+    freed = delete_activity_captures(job['activity'], db, job['kit_history'], job['error_logs'])
+    db[COLD_COLLECTION].update_one({"_id": header['_id']}, {"$set": {
+        "captures_evicted": {"at": datetime.utcnow(), "bytes": freed}
+    }})
+    return freed
+
+
+def history_headers(db, limit):
+    """
+    Headers of the `limit` newest finished jobs, hot and cold, newest first (the history list).
+    Both collections are read sorted and limited by MongoDB, then merged.
+    """
+    hot = db.activities.aggregate([
+        {"$match": {"status": {"$ne": "on-going"}}},
+        {"$sort": {"start_time": -1}},
+        {"$limit": limit},
+        *HOT_HEADER_PIPELINE
+    ])
+    cold = db[COLD_COLLECTION].find({}, COLD_HEADER_PROJECTION).sort("start_time", -1).limit(limit)
+    newest = heapq.merge(hot, cold, key=lambda job: job.get('start_time') or datetime.min, reverse=True)
+    return list(islice(newest, limit))
+
+
+# --- BACKGROUND LOOP ---
+_started = False
+
+def start(app):
+    """Starts the cold archiving loop once per process."""
+    global _started
+    if _started:
+        return
+    _started = True
+
+    from app.socket_events import socketio
+    from app.db import get_db
+
+    def run():
+        while True:
+            socketio.sleep(Config.COLD_ARCHIVE_INTERVAL_SEC)
+            try:
+                with app.app_context():
+                    archive_pending(get_db(), app.logger)
+            except Exception as e:
+                app.logger.error(f"Cold archiving error: {e}\n{traceback.format_exc()}")
+
+    socketio.start_background_task(run)
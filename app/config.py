@@ -1,4 +1,5 @@
 import os
+from importlib.util import find_spec
 from dotenv import load_dotenv
 
 # Load environment variables from a .env file if it exists
@@ -19,10 +20,142 @@ class Config:
     os.makedirs(UPLOAD_FOLDER,exist_ok=1)
     
     
-    # S3 CONFIG (Placeholder for future)
-    USE_S3 = False
-    S3_BUCKET = "my-kitting-bucket"
-    S3_REGION = "us-east-1"
+    # S3 CONFIG (any S3-compatible store; set S3_ENDPOINT_URL for MinIO / local stand-ins)
+    USE_S3 = os.environ.get('USE_S3', 'false').lower() in ('1', 'true', 'yes')
+    S3_BUCKET = os.environ.get('S3_BUCKET', "my-kitting-bucket")
+    S3_REGION = os.environ.get('S3_REGION', "us-east-1")
+    S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL', '')
+    S3_ACCESS_KEY = os.environ.get('S3_ACCESS_KEY', '')
+    S3_SECRET_KEY = os.environ.get('S3_SECRET_KEY', '')
+    S3_KEY_PREFIX = os.environ.get('S3_KEY_PREFIX', 'captures/')
+    S3_PUBLIC_BASE_URL = os.environ.get('S3_PUBLIC_BASE_URL', '')   # public bucket / CDN, optional
+    S3_SIGNED_URL_TTL_SEC = int(os.environ.get('S3_SIGNED_URL_TTL_SEC', 3600))
+    S3_MULTIPART_THRESHOLD_MB = int(os.environ.get('S3_MULTIPART_THRESHOLD_MB', 8))
+    S3_MULTIPART_CHUNK_MB = int(os.environ.get('S3_MULTIPART_CHUNK_MB', 8))
+    S3_MAX_CONCURRENCY = int(os.environ.get('S3_MAX_CONCURRENCY', 8))
+    S3_MAX_POOL_CONNECTIONS = int(os.environ.get('S3_MAX_POOL_CONNECTIONS', 32))
+
+    # CAPTURE SERVING (captures never change once written)
+    CAPTURE_CACHE_MAX_AGE = int(os.environ.get('CAPTURE_CACHE_MAX_AGE', 31536000))
+    # Front-proxy hand-off: nginx internal location (X-Accel-Redirect) or X-Sendfile
+    CAPTURE_ACCEL_REDIRECT_PREFIX = os.environ.get('CAPTURE_ACCEL_REDIRECT_PREFIX', '')
+    USE_X_SENDFILE = os.environ.get('USE_X_SENDFILE', 'false').lower() in ('1', 'true', 'yes')
+
+    # API RESPONSES: JSON bodies from this size up are gzip/brotli-compressed (0 = off);
+    # finished kit history records never change, so browsers may keep them this long
+    HTTP_COMPRESS_MIN_BYTES = int(os.environ.get('HTTP_COMPRESS_MIN_BYTES', 2048))
+    HTTP_COMPRESS_LEVEL = int(os.environ.get('HTTP_COMPRESS_LEVEL', 6))   # gzip 1-9 / brotli quality 0-11
+    HISTORY_CACHE_MAX_AGE = int(os.environ.get('HISTORY_CACHE_MAX_AGE', 86400))
+
+    # IMAGE DERIVATIVES (?size=thumb|preview on /kitting/captures/...)
+    CAPTURE_THUMB_PX = int(os.environ.get('CAPTURE_THUMB_PX', 200))
+    CAPTURE_PREVIEW_PX = int(os.environ.get('CAPTURE_PREVIEW_PX', 640))
+    CAPTURE_DERIVATIVE_QUALITY = int(os.environ.get('CAPTURE_DERIVATIVE_QUALITY', 80))
+    # Pre-building derivatives needs Pillow (optional): on by default only when it is installed
+    CAPTURE_DERIVATIVES_ON_INGEST = os.environ.get('CAPTURE_DERIVATIVES_ON_INGEST', 'true' if find_spec('PIL') else 'false').lower() in ('1', 'true', 'yes')
+    IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', 4))
+    REPORT_IMAGE_SIZE = os.environ.get('REPORT_IMAGE_SIZE', 'preview')   # '' links reports to originals
+
+    # INGEST COMPRESSION (re-encode uploads before they are stored)
+    CAPTURE_INGEST_ENABLED = os.environ.get('CAPTURE_INGEST_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+    CAPTURE_INGEST_MAX_PX = int(os.environ.get('CAPTURE_INGEST_MAX_PX', 1280))
+    CAPTURE_INGEST_QUALITY = int(os.environ.get('CAPTURE_INGEST_QUALITY', 80))
+    CAPTURE_INGEST_FORMAT = os.environ.get('CAPTURE_INGEST_FORMAT', 'JPEG').upper()   # JPEG or WEBP
+    IMAGE_POOL = os.environ.get('IMAGE_POOL', 'thread')   # 'process' when not running under eventlet
+
+    # DISK BUDGET: per-table capture quota, evicts oldest finished jobs first (0 = unlimited)
+    CAPTURE_QUOTA_MB_PER_TABLE = int(os.environ.get('CAPTURE_QUOTA_MB_PER_TABLE', 0))
+
+    # CAPTURE ARCHIVER (packs finished jobs' captures into one bundle file)
+    CAPTURE_ARCHIVE_ENABLED = os.environ.get('CAPTURE_ARCHIVE_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+    CAPTURE_ARCHIVE_INTERVAL_SEC = int(os.environ.get('CAPTURE_ARCHIVE_INTERVAL_SEC', 300))
+    CAPTURE_ARCHIVE_GRACE_SEC = int(os.environ.get('CAPTURE_ARCHIVE_GRACE_SEC', 600))
+    CAPTURE_ARCHIVE_BATCH = int(os.environ.get('CAPTURE_ARCHIVE_BATCH', 5))
+    CAPTURE_CLAIM_STALE_SEC = int(os.environ.get('CAPTURE_CLAIM_STALE_SEC', 1800))   # packing/eviction claim taken over after
+
+    # COLD STORAGE (moves old finished jobs + their kit_history / error_logs out of the hot collections)
+    COLD_ARCHIVE_ENABLED = os.environ.get('COLD_ARCHIVE_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+    COLD_ARCHIVE_AFTER_DAYS = int(os.environ.get('COLD_ARCHIVE_AFTER_DAYS', 30))
+    COLD_ARCHIVE_INTERVAL_SEC = int(os.environ.get('COLD_ARCHIVE_INTERVAL_SEC', 3600))
+    COLD_ARCHIVE_BATCH = int(os.environ.get('COLD_ARCHIVE_BATCH', 20))
+    COLD_ARCHIVE_COMPRESSION_LEVEL = int(os.environ.get('COLD_ARCHIVE_COMPRESSION_LEVEL', 6))   # zlib 1-9
+    COLD_INLINE_MAX_BYTES = int(os.environ.get('COLD_INLINE_MAX_BYTES', 12 * 1024 * 1024))    # larger blobs go to storage
+    HISTORY_LIST_LIMIT = int(os.environ.get('HISTORY_LIST_LIMIT', 500))   # newest finished jobs on /kitting/history
+
+    # DETECTION DEDUP CONFIG
+    # Retried detections (same Tracking_id or Idempotency-Key) replay the first response
+    DETECTION_DEDUP_CACHE_SIZE = int(os.environ.get('DETECTION_DEDUP_CACHE_SIZE', 4096))
+    DETECTION_RECEIPT_TTL_SEC = int(os.environ.get('DETECTION_RECEIPT_TTL_SEC', 86400))
+    # A claim still pending after this long belongs to a request that died: the next retry takes it over
+    DETECTION_CLAIM_STALE_SEC = int(os.environ.get('DETECTION_CLAIM_STALE_SEC', 30))
+
+    # OPTIMISTIC CONCURRENCY: re-read/re-decide attempts after a conflicting write (then 503)
+    ACTIVITY_WRITE_RETRIES = int(os.environ.get('ACTIVITY_WRITE_RETRIES', 5))
+
+    # PAGINATED JSON APIS (monitor galleries, error and history lists)
+    API_PAGE_SIZE = int(os.environ.get('API_PAGE_SIZE', 24))
+    API_PAGE_SIZE_MAX = int(os.environ.get('API_PAGE_SIZE_MAX', 200))
+
+    # FLEET OVERVIEW (/kitting/fleet): cache of the all-tables query; tables listed here show as idle
+    FLEET_CACHE_SEC = float(os.environ.get('FLEET_CACHE_SEC', 1))
+    FLEET_TABLES = [t.strip() for t in os.environ.get('FLEET_TABLES', '').split(',') if t.strip()]
+
+    # PRODUCTION ANALYTICS (rollups): shifts as name=start-end hours in plant local time
+    ANALYTICS_SHIFTS = [
+        (name.strip(), int(hours.split('-')[0]), int(hours.split('-')[1]))
+        for name, _, hours in (s.partition('=') for s in
+                               os.environ.get('ANALYTICS_SHIFTS', 'A=6-14,B=14-22,C=22-6').split(','))
+    ]
+    ANALYTICS_UTC_OFFSET_HOURS = int(os.environ.get('ANALYTICS_UTC_OFFSET_HOURS', 0))
+
+    # DETECTION EVENTS (time-series copy of every detection, for model-drift analysis)
+    DETECTION_EVENTS_ENABLED = os.environ.get('DETECTION_EVENTS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    DETECTION_EVENTS_TTL_DAYS = int(os.environ.get('DETECTION_EVENTS_TTL_DAYS', 365))   # 0 = keep forever
+
+    # DETECTION WRITE-BEHIND: matched detections update the slot count synchronously, their
+    # captured_images records are journaled and appended in one bulk_write per flush
+    # (off = one write per detection; not used with table workers, which batch on their own)
+    DETECTION_WRITE_BEHIND = os.environ.get('DETECTION_WRITE_BEHIND', 'false').lower() in ('1', 'true', 'yes')
+    DETECTION_FLUSH_MS = int(os.environ.get('DETECTION_FLUSH_MS', 200))
+    DETECTION_FLUSH_RECORDS = int(os.environ.get('DETECTION_FLUSH_RECORDS', 500))
+    DETECTION_JOURNAL_PATH = os.environ.get('DETECTION_JOURNAL_PATH', os.path.join(BASE_DIR, 'wal', 'detection-buffer.wal'))
+
+    # KIT LIST / SEARCH: page size of the parts list; shorter queries only match kit name prefixes
+    KIT_LIST_PAGE_SIZE = int(os.environ.get('KIT_LIST_PAGE_SIZE', 50))
+    KIT_SEARCH_MIN_CHARS = int(os.environ.get('KIT_SEARCH_MIN_CHARS', 2))
+
+    # BULK KIT IMPORT: kits per bulk_write, row errors returned in the report
+    KIT_IMPORT_BATCH = int(os.environ.get('KIT_IMPORT_BATCH', 500))
+    KIT_IMPORT_MAX_ERRORS = int(os.environ.get('KIT_IMPORT_MAX_ERRORS', 200))
+
+    # KIT CATALOG CACHE: seconds between checks of the cross-process catalog version (0 = every lookup)
+    KIT_CATALOG_CHECK_SEC = float(os.environ.get('KIT_CATALOG_CHECK_SEC', 2))
+
+    # ACTIVITY CHANGE FEED (/kitting/api/feed): 'auto' uses change streams on a replica set,
+    # else an internal event log (db.activity_events)
+    FEED_BACKEND = os.environ.get('FEED_BACKEND', 'auto')   # auto | change_stream | event_log
+    FEED_EVENT_TTL_SEC = int(os.environ.get('FEED_EVENT_TTL_SEC', 86400))
+    FEED_POLL_SEC = float(os.environ.get('FEED_POLL_SEC', 0.5))
+    FEED_HEARTBEAT_SEC = int(os.environ.get('FEED_HEARTBEAT_SEC', 15))
+    FEED_GAP_WAIT_SEC = float(os.environ.get('FEED_GAP_WAIT_SEC', 2))   # event_log: age before an event is read
+    FEED_BATCH = int(os.environ.get('FEED_BATCH', 200))
+
+    # TABLE WORKERS: each table is owned by one worker process holding its state in memory,
+    # persisted through a write-ahead log (0 = off, detections go straight to MongoDB)
+    TABLE_WORKERS = int(os.environ.get('TABLE_WORKERS', 0))
+    TABLE_WORKER_BASE_PORT = int(os.environ.get('TABLE_WORKER_BASE_PORT', 6100))
+    TABLE_WORKER_WAL_DIR = os.environ.get('TABLE_WORKER_WAL_DIR', os.path.join(BASE_DIR, 'wal'))
+    TABLE_WORKER_WAL_FSYNC = os.environ.get('TABLE_WORKER_WAL_FSYNC', 'true').lower() in ('1', 'true', 'yes')
+    TABLE_WORKER_LEASE_SEC = int(os.environ.get('TABLE_WORKER_LEASE_SEC', 10))     # hand-back to a route, renewed while it runs
+    TABLE_WORKER_TIMEOUT_SEC = int(os.environ.get('TABLE_WORKER_TIMEOUT_SEC', 30))
+    TABLE_WORKER_RELEASE_TIMEOUT_SEC = float(os.environ.get('TABLE_WORKER_RELEASE_TIMEOUT_SEC', 5))   # then 503
+    TABLE_WORKER_SUPERVISE_SEC = float(os.environ.get('TABLE_WORKER_SUPERVISE_SEC', 5))   # exited workers are respawned
+
+    # SERVER MODE: 'eventlet' (run_web.py) or 'threading' (set by run_asgi.py, asyncio mode)
+    SOCKETIO_ASYNC_MODE = os.environ.get('SOCKETIO_ASYNC_MODE', 'eventlet')
+
+    # CAMERAS: highest camera number a station may use (socket relays cam1..camN, parts form)
+    MAX_CAMERAS = int(os.environ.get('MAX_CAMERAS', 6))
 
     # Socket Server Configuration
     # This URL is passed to the frontend so JS knows where to connect
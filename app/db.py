@@ -1,7 +1,105 @@
+import re
+
 from pymongo import MongoClient
 from pymongo.errors import ConnectionFailure
 from flask import current_app, g
 
+# Indexes are created once per process, on the first connection
+_indexes_ready = False
+
+def ensure_indexes(db):
+    """Creates the indexes the app relies on. Safe to call repeatedly."""
+    # Hot lookup used by every detection / status call
+    db.activities.create_index([("table_id", 1), ("status", 1)])
+
+    # Detection receipts: _id is the dedup key, expire old ones automatically
+    db.detection_receipts.create_index(
+        "created_at", expireAfterSeconds=current_app.config['DETECTION_RECEIPT_TTL_SEC']
+    )
+
+    # Quota eviction walks a table's finished jobs oldest first
+    db.activities.create_index([("table_id", 1), ("end_time", 1)])
+
+    # Fleet overview: every on-going job in one query
+    db.activities.create_index([("status", 1), ("table_id", 1)])
+
+    # Archived captures: _id is the capture key, activity_id for per-job cleanup
+    db.capture_index.create_index("activity_id")
+
+    # Paginated error / history lists of a job (monitor page)
+    db.error_logs.create_index([("activity_id", 1), ("timestamp", -1)])
+    db.kit_history.create_index([("activity_id", 1), ("camera_id", 1), ("kit_number", 1)])
+
+    # Bulk kit import upserts by name (not unique: the editor allows duplicate names)
+    db.kits.create_index("kit_name")
+
+    # History list newest first (hot and cold), capture quota per table oldest first
+    db.activities.create_index([("start_time", -1)])
+    db.activities_cold.create_index([("start_time", -1)])
+    db.activities_cold.create_index([("table_id", 1), ("end_time", 1)])
+
+    # Analytics rollups: one row per bucket, read by date range
+    db.rollup_table_hourly.create_index([("hour", 1), ("table_id", 1)], unique=True)
+    db.rollup_kit_daily.create_index([("day", 1), ("kit_name", 1)], unique=True)
+
+    # Detection events: time-series collection (model-drift analysis)
+    from app.detection_events import ensure_collection
+    ensure_collection(db)
+
+    # Activity change feed (event_log backend): read and resumed in _id order, old events expire
+    if "seq_1" in db.activity_events.index_information():
+        db.activity_events.drop_index("seq_1")   # Events used to be numbered by a db.meta counter
+    db.activity_events.create_index("at", expireAfterSeconds=current_app.config['FEED_EVENT_TTL_SEC'])
+
+def migrate_camera_state(db):
+    """
+    Moves jobs saved with the old flat per-camera fields (current_kit_index_cam1,
+    current_kit_errors_cam1, last_detected_index_cam1, same for cam2) into the keyed
+    'cams' sub-document. One server-side update; a no-op once everything is migrated.
+    """
+    legacy_cams = ("cam1", "cam2")
+    fields = [f"{prefix}_{cam}" for cam in legacy_cams
+              for prefix in ("current_kit_index", "current_kit_errors", "last_detected_index")]
+    db.activities.update_many(
+        {"cams": {"$exists": False}, "$or": [{f: {"$exists": True}} for f in fields]},
+        [
+            {"$set": {"cams": {cam: {
+                "kit_index": {"$ifNull": [f"$current_kit_index_{cam}", 1]},
+                "errors": {"$ifNull": [f"$current_kit_errors_{cam}", []]},
+                "last_detected_index": {"$ifNull": [f"$last_detected_index_{cam}", -1]}
+            } for cam in legacy_cams}}},
+            {"$unset": fields}
+        ]
+    )
+
+def migrate_kit_definitions(db):
+    """
+    Compiles kits saved before kits were compiled at save time (see kitting_core.compile_kit),
+    and normalizes the camera ids of jobs started from uncompiled kits, since detections now
+    compare component cameras as stored. No-op once everything is migrated.
+    """
+    from app.kitting_core import compile_kit, get_safe_cam_id
+    from app.kit_catalog import bump_version
+
+    compiled = 0
+    for kit in db.kits.find({"compiled": {"$exists": False}}, {"parts": 1}):
+        try:
+            parts, summary = compile_kit(kit.get('parts'))
+        except ValueError as e:
+            current_app.logger.warning(f"Kit {kit['_id']} not compiled ({e}): fix it in the kit editor")
+            continue
+        db.kits.update_one({"_id": kit['_id']}, {"$set": {"parts": parts, "compiled": summary, "kit_version": 1}})
+        compiled += 1
+    if compiled:
+        bump_version(db)
+
+    legacy = {"components": {"$elemMatch": {"camera": {"$not": re.compile(r"^cam[0-9]+$")}}}}
+    for activity in db.activities.find(legacy, {"components.camera": 1}):
+        db.activities.update_one({"_id": activity['_id']}, {"$set": {
+            f"components.{i}.camera": get_safe_cam_id(part.get('camera'))
+            for i, part in enumerate(activity.get('components', []))
+        }})
+
 def get_db():
     """
     Opens a new database connection if there is none yet for the
@@ -14,6 +112,13 @@ def get_db():
             # Check connection
             client.admin.command('ping')
             g.db = client[current_app.config['DB_NAME']]
+
+            global _indexes_ready
+            if not _indexes_ready:
+                ensure_indexes(g.db)
+                migrate_camera_state(g.db)
+                migrate_kit_definitions(g.db)
+                _indexes_ready = True
         except ConnectionFailure as e:
             current_app.logger.error(f"MongoDB Connection Failed: {e}")
             raise e
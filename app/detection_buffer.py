@@ -0,0 +1,245 @@
+import contextlib
+import logging
+import threading
+import time
+import traceback
+
+from pymongo import MongoClient, UpdateOne
+
+from app.config import Config
+from app.kitting_core import cam_field
+from app.metrics import metrics
+from app.table_workers import WriteAheadLog
+
+# Write-behind for detection records (DETECTION_WRITE_BEHIND).
+# A matched detection still writes its slot increment, completion and version synchronously:
+# those decide the next detection. Only its captured_images record is deferred. Records are
+# journaled before the detection is answered, coalesced per activity slot and appended with one
+# bulk_write every DETECTION_FLUSH_MS, or sooner once DETECTION_FLUSH_RECORDS are waiting.
+#
+# - Every op only matches the kit its records belong to (cams.<cam>.kit_index), so a record
+#   can never land in the next kit's slot.
+# - Closing a kit calls settle() before taking its snapshot: it waits for the detections between
+#   their state write and add() (writing()), then flushes. Records of a kit that closed anyway
+#   (settle timed out) are kept in the activity's 'late_captures', never dropped.
+# - Records are added with $addToSet: a replayed record that already reached MongoDB is skipped.
+# - After a flush the journal drops the entries it wrote (up to the last sequence number taken),
+#   so it only ever holds the records still waiting, however busy the tables are.
+# - Each flush increments the activity's 'captures_flushed', part of its ETag (app/http_cache.py).
+# The buffer is per process, like the single web process it is meant for.
+
+_pending = {}               # (activity_id, cam_id, kit_index, slot) -> [records]
+_count = 0
+_oldest = None              # perf_counter of the oldest waiting record
+_last_seq = 0               # journal sequence number of the newest waiting record
+_inflight = {}              # activity_id -> detections between their state write and add()
+_lock = threading.Lock()
+_settled = threading.Condition(_lock)
+_flush_lock = threading.Lock()
+_wake = threading.Event()
+_journal = None
+_db = None
+log = logging.getLogger(__name__)   # Propagates to the Flask app's logger ("app")
+
+
+def enabled():
+    return Config.DETECTION_WRITE_BEHIND and Config.TABLE_WORKERS == 0
+
+
+def _database():
+    global _db
+    if _db is None:
+        _db = MongoClient(Config.MONGO_URI, serverSelectionTimeoutMS=5000)[Config.DB_NAME]
+    return _db
+
+
+def _open_journal():
+    global _journal
+    if _journal is None:
+        _journal = WriteAheadLog(Config.DETECTION_JOURNAL_PATH)
+    return _journal
+
+
+# --- BUFFERING ---
+def _enqueue(entry):
+    """Runs under the journal lock, so a flush never truncates a record it has not taken."""
+    global _count, _oldest, _last_seq
+    key = (entry['activity_id'], entry['cam_id'], entry['kit_index'], entry['slot'])
+    with _lock:
+        _pending.setdefault(key, []).append(entry['record'])
+        _count += 1
+        _last_seq = max(_last_seq, entry.get('seq', 0))
+        if _oldest is None:
+            _oldest = time.perf_counter()
+        full = _count >= Config.DETECTION_FLUSH_RECORDS
+    if full:
+        _wake.set()
+
+
+def add(activity_id, cam_id, kit_index, slot, record):
+    """
+    Journals one detection record and queues its append to components.<slot>.captured_images.
+    If the journal can't be written, the record is appended right away instead.
+    """
+    entry = {"activity_id": activity_id, "cam_id": cam_id, "kit_index": kit_index, "slot": slot, "record": record}
+    try:
+        _open_journal().append(entry, then=_enqueue)
+    except OSError:
+        metrics.incr("detection_buffer.journal_errors")
+        _write({(activity_id, cam_id, kit_index, slot): [record]}, 1)
+        return
+    metrics.incr("detection_buffer.records")
+
+
+@contextlib.contextmanager
+def writing(activity_id):
+    """Held by a detection from before its state write until its record is added (see settle())."""
+    if not enabled():
+        yield
+        return
+    with _lock:
+        _inflight[activity_id] = _inflight.get(activity_id, 0) + 1
+    try:
+        yield
+    finally:
+        with _lock:
+            _inflight[activity_id] -= 1
+            if not _inflight[activity_id]:
+                del _inflight[activity_id]
+                _settled.notify_all()
+
+
+def _ops(batch):
+    ops = []
+    for (activity_id, cam_id, kit_index, slot), records in batch.items():
+        field = f"components.{slot}.captured_images"
+        ops.append(UpdateOne(
+            {"_id": activity_id, cam_field(cam_id, 'kit_index'): kit_index},
+            {"$addToSet": {field: {"$each": records}}, "$inc": {"captures_flushed": len(records)}}
+        ))
+    return ops
+
+
+def _keep_late(batch):
+    """
+    Appends the records of kits that closed before they were flushed to the activity's
+    'late_captures' (with their kit and slot). Kits close after settle(), which waits for the
+    flush lock and the writing() gate, so none closes between the bulk write and this check.
+    """
+    db = _database()
+    ids = list({activity_id for activity_id, _, _, _ in batch})
+    cams = {a['_id']: a.get('cams') or {} for a in db.activities.find({"_id": {"$in": ids}}, {"cams": 1})}
+    ops, late = [], 0
+    for (activity_id, cam_id, kit_index, slot), records in batch.items():
+        if activity_id not in cams:
+            log.warning(f"⚠️ Detection buffer: activity {activity_id} is gone, {len(records)} records dropped")
+            metrics.incr("detection_buffer.dropped_records", len(records))
+            continue
+        if (cams[activity_id].get(cam_id) or {}).get('kit_index', 1) == kit_index:
+            continue  # Kit still open: the op matched
+        ops.append(UpdateOne({"_id": activity_id}, {
+            "$addToSet": {"late_captures": {"$each": [{**r, "kit_index": kit_index, "slot": slot} for r in records]}},
+            "$inc": {"captures_flushed": len(records)}
+        }))
+        late += len(records)
+    if ops:
+        db.activities.bulk_write(ops, ordered=False)
+        log.warning(f"⚠️ Detection buffer: {late} records flushed after their kit closed, kept in late_captures")
+        metrics.incr("detection_buffer.late_records", late)
+
+
+def _write(batch, records):
+    result = _database().activities.bulk_write(_ops(batch), ordered=False)
+    if result.matched_count < len(batch):
+        _keep_late(batch)
+    metrics.incr("detection_buffer.flushes")
+    metrics.observe("detection_buffer.flush_records", records)
+
+
+# --- FLUSHING ---
+def flush():
+    """Writes every waiting record now. Returns the number of records written."""
+    global _pending, _count, _oldest
+    with _flush_lock:
+        with _lock:
+            batch, records, oldest, upto = _pending, _count, _oldest, _last_seq
+            _pending, _count, _oldest = {}, 0, None
+        if not batch:
+            return 0
+
+        started = time.perf_counter()
+        try:
+            _write(batch, records)
+        except Exception:
+            # MongoDB unreachable: put the records back (ahead of newer ones), they stay journaled
+            metrics.incr("detection_buffer.flush_errors")
+            with _lock:
+                for key, waiting in _pending.items():
+                    batch.setdefault(key, []).extend(waiting)
+                _pending, _count = batch, _count + records
+                _oldest = oldest if _oldest is None else min(oldest, _oldest)
+            raise
+
+        finished = time.perf_counter()
+        metrics.observe("detection_buffer.flush_ms", (finished - started) * 1000)
+        metrics.observe("detection_buffer.record_delay_ms", (finished - oldest) * 1000)
+        _open_journal().drop_through(upto)
+        return records
+
+
+def flush_quietly(logger=None):
+    """flush() for routes that only want the records written soon: a failure is logged, the loop retries later."""
+    if not enabled():
+        return
+    try:
+        flush()
+    except Exception as e:
+        if logger: logger.error(f"Detection buffer flush failed: {e}")
+
+
+def settle(activity_id, timeout=5):
+    """
+    For routes about to snapshot and close a kit: waits (up to timeout seconds) for the activity's
+    detections between their state write and add(), then flushes. Raises if the flush fails.
+    """
+    if not enabled():
+        return
+    with _settled:
+        if not _settled.wait_for(lambda: activity_id not in _inflight, timeout):
+            metrics.incr("detection_buffer.settle_timeouts")
+    flush()
+
+
+def replay(logger=None):
+    """Queues the records a previous run journaled but did not flush (written by the next flush)."""
+    leftover = _open_journal().pending()
+    for entry in leftover:
+        _enqueue(entry)
+    if leftover and logger:
+        logger.info(f"🔁 Replaying {len(leftover)} journaled detection records")
+
+
+# --- BACKGROUND LOOP ---
+_started = False
+
+def start(app):
+    """Replays the journal (before any request can add to it) and starts the flush loop once per process."""
+    global _started
+    if _started:
+        return
+    _started = True
+    replay(app.logger)
+
+    from app.socket_events import socketio
+
+    def run():
+        while True:
+            _wake.wait(Config.DETECTION_FLUSH_MS / 1000)
+            _wake.clear()
+            try:
+                flush()
+            except Exception as e:
+                app.logger.error(f"Detection buffer flush error: {e}\n{traceback.format_exc()}")
+                socketio.sleep(1)
+
+    socketio.start_background_task(run)
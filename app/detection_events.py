@@ -0,0 +1,69 @@
+import logging
+
+from pymongo.errors import CollectionInvalid, OperationFailure
+
+from app.config import Config
+
+# Compact copy of every detection for model-drift analysis (app/detection_stats.py):
+#   {"ts", "meta": {"table_id", "cam_id", "ai_class"}, "confidence", "tracking_id", "part",
+#    "matched", "activity_id"}
+# Stored in a MongoDB time-series collection (bucketed by meta, columnar on disk), so weeks of
+# detections can be scanned without touching the activities and their captured_images arrays.
+COLLECTION = "detection_events"
+log = logging.getLogger(__name__)
+
+
+def ensure_collection(db):
+    """Creates the time-series collection once; falls back to a plain one on MongoDB < 5.0."""
+    if COLLECTION in db.list_collection_names():
+        return
+    options = {"timeseries": {"timeField": "ts", "metaField": "meta", "granularity": "seconds"}}
+    if Config.DETECTION_EVENTS_TTL_DAYS > 0:
+        options["expireAfterSeconds"] = Config.DETECTION_EVENTS_TTL_DAYS * 86400
+    try:
+        db.create_collection(COLLECTION, **options)
+    except CollectionInvalid:
+        return  # Created by another process in the meantime
+    except OperationFailure:
+        db.create_collection(COLLECTION)
+    db[COLLECTION].create_index([("meta.table_id", 1), ("ts", 1)])
+    db[COLLECTION].create_index([("meta.ai_class", 1), ("ts", 1)])
+
+
+def event_doc(activity, det, at, matched):
+    return {
+        "ts": at,
+        "meta": {
+            "table_id": str(activity.get('table_id')),
+            "cam_id": det['cam_id'],
+            "ai_class": det['ai_raw_name'] or det['detected_part']
+        },
+        "confidence": det['confidence'],    # Already a float (kitting_core.parse_confidence)
+        "tracking_id": det['tracking_id'],
+        "part": det['detected_part'],
+        "matched": matched,
+        "activity_id": activity['_id']
+    }
+
+
+def record(db, activity, det, at, matched):
+    """
+    Stores one detection (matched to a slot or a wrong part). Best-effort: it runs after the
+    detection's state write, so a failure is logged and never fails the detection.
+    """
+    if not Config.DETECTION_EVENTS_ENABLED:
+        return
+    try:
+        db[COLLECTION].insert_one(event_doc(activity, det, at, matched))
+    except Exception as e:
+        log.warning(f"Detection event not recorded for activity {activity.get('_id')}: {e}")
+
+
+async def record_async(db, activity, det, at, matched):
+    """record() for Motor (asyncio mode)."""
+    if not Config.DETECTION_EVENTS_ENABLED:
+        return
+    try:
+        await db[COLLECTION].insert_one(event_doc(activity, det, at, matched))
+    except Exception as e:
+        log.warning(f"Detection event not recorded for activity {activity.get('_id')}: {e}")
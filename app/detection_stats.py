@@ -0,0 +1,84 @@
+from datetime import timedelta
+from typing import NamedTuple
+
+import numpy as np
+
+# Model-drift analysis over db.detection_events (see app/detection_events.py).
+# A time window is loaded once as flat NumPy arrays; histograms and percentile trends are then
+# computed per AI class with vectorized operations instead of Python loops over detections.
+
+
+class DetectionWindow(NamedTuple):
+    ts: np.ndarray          # datetime64[ms]
+    confidence: np.ndarray  # float64, clipped to [0, 1]
+    codes: np.ndarray       # int index into classes, one per detection
+    classes: np.ndarray     # sorted unique AI class names
+
+
+def load_window(db, start, end, table_id=None, cam_id=None, ai_class=None):
+    """Detections in [start, end), optionally for one table / camera / class, as arrays."""
+    query = {"ts": {"$gte": start, "$lt": end}}
+    if table_id: query["meta.table_id"] = str(table_id)
+    if cam_id: query["meta.cam_id"] = cam_id
+    if ai_class: query["meta.ai_class"] = ai_class
+
+    ts, confidence, classes = [], [], []
+    cursor = db.detection_events.find(query, {"_id": 0, "ts": 1, "confidence": 1, "meta.ai_class": 1})
+    for doc in cursor.batch_size(10000):
+        ts.append(doc['ts'])
+        confidence.append(doc.get('confidence') or 0.0)
+        classes.append(doc.get('meta', {}).get('ai_class') or '')
+
+    names, codes = np.unique(np.array(classes, dtype=str), return_inverse=True)
+    return DetectionWindow(
+        ts=np.array(ts, dtype='datetime64[ms]'),
+        confidence=np.clip(np.array(confidence, dtype=np.float64), 0.0, 1.0),
+        codes=codes.reshape(-1),
+        classes=names
+    )
+
+
+def confidence_histograms(window, bins=20):
+    """Per-class confidence histogram (shared edges over [0, 1]), count and mean."""
+    edges = np.linspace(0.0, 1.0, bins + 1)
+    n_classes = len(window.classes)
+    if n_classes == 0:
+        return {"edges": edges.tolist(), "classes": {}}
+
+    # One 2-D histogram: rows are classes, columns confidence bins
+    counts, _, _ = np.histogram2d(window.codes, window.confidence, bins=[np.arange(n_classes + 1), edges])
+    totals = np.bincount(window.codes, minlength=n_classes)
+    means = np.bincount(window.codes, weights=window.confidence, minlength=n_classes) / np.maximum(totals, 1)
+    return {
+        "edges": edges.tolist(),
+        "classes": {
+            str(name): {"count": int(totals[i]), "mean": round(float(means[i]), 4),
+                        "histogram": counts[i].astype(int).tolist()}
+            for i, name in enumerate(window.classes)
+        }
+    }
+
+
+def percentile_trend(window, start, bucket_sec, percentiles=(5, 50, 95)):
+    """Per-class confidence percentiles in consecutive time buckets of bucket_sec from start."""
+    if len(window.ts) == 0:
+        return {}
+    offsets = (window.ts - np.datetime64(start, 'ms')).astype(np.int64)   # milliseconds
+    buckets = offsets // int(bucket_sec * 1000)
+
+    # Sort by (class, bucket) and cut the arrays where either changes
+    order = np.lexsort((buckets, window.codes))
+    codes, buckets, confidence = window.codes[order], buckets[order], window.confidence[order]
+    cuts = np.flatnonzero((np.diff(codes) != 0) | (np.diff(buckets) != 0)) + 1
+    group_starts = np.concatenate(([0], cuts))
+    group_ends = np.concatenate((cuts, [len(confidence)]))
+
+    trend = {}
+    for lo, hi in zip(group_starts, group_ends):
+        values = np.percentile(confidence[lo:hi], percentiles)
+        trend.setdefault(str(window.classes[codes[lo]]), []).append({
+            "bucket_start": (start + timedelta(seconds=int(buckets[lo]) * bucket_sec)).isoformat(),
+            "count": int(hi - lo),
+            **{f"p{p:g}": round(float(v), 4) for p, v in zip(percentiles, values)}
+        })
+    return trend
@@ -0,0 +1,74 @@
+import threading
+import time
+from datetime import datetime
+
+from app.config import Config
+from app.kitting_core import activity_cameras, cam_state, cam_parts
+
+# Fleet overview: the state of every table from one indexed, projected query on the
+# on-going jobs, cached for FLEET_CACHE_SEC so any number of supervisor screens cost one
+# query per interval. Pages follow the 'fleet' socket room, where broadcast() announces
+# every change on a table (app/socket_events.py); the cache only expires on time, so pages
+# refetch a little over FLEET_CACHE_SEC after a change, when it no longer predates it.
+FLEET_ROOM = "fleet"
+
+FLEET_PROJECTION = {
+    "table_id": 1, "kit_name": 1, "order_number": 1, "total_kits_to_pack": 1, "cams": 1,
+    "start_time": 1, "last_updated": 1,
+    "components.camera": 1, "components.quantity": 1, "components.found_quantity": 1
+}
+
+_cache = {"at": 0, "tables": None}
+_cache_lock = threading.Lock()
+
+
+def table_summary(activity, now):
+    """Compact state of one busy table: lock, per-camera kit progress, last detection age."""
+    total_kits = activity.get('total_kits_to_pack', 1)
+    cameras = {}
+    locked = False
+    for cam in activity_cameras(activity):
+        state = cam_state(activity, cam)
+        parts = cam_parts(activity.get('components'), cam)
+        locked = locked or bool(state['errors'])
+        cameras[cam] = {
+            "kit_index": state['kit_index'],
+            "done": state['kit_index'] > total_kits or not parts,
+            "errors": len(state['errors']),
+            # Items placed in the current kit (overcounts don't count twice)
+            "found": sum(min(p.get('found_quantity', 0), p.get('quantity', 1)) for p in parts),
+            "required": sum(p.get('quantity', 1) for p in parts)
+        }
+
+    last = activity.get('last_updated')
+    return {
+        "table_id": activity.get('table_id'),
+        "state": "locked" if locked else "active",
+        "activity_id": str(activity['_id']),
+        "kit_name": activity.get('kit_name'),
+        "order_number": activity.get('order_number'),
+        "total_kits": total_kits,
+        "cameras": cameras,
+        "last_detection_age_sec": round((now - last).total_seconds(), 1) if isinstance(last, datetime) else None
+    }
+
+
+def _load(db):
+    now = datetime.utcnow()
+    tables = {}
+    for activity in db.activities.find({"status": "on-going"}, FLEET_PROJECTION):
+        tables[str(activity.get('table_id'))] = table_summary(activity, now)
+    # Configured tables without a job show up as idle
+    for table_id in Config.FLEET_TABLES:
+        tables.setdefault(table_id, {"table_id": table_id, "state": "idle"})
+    return sorted(tables.values(), key=lambda t: (len(str(t['table_id'])), str(t['table_id'])))
+
+
+def fleet_state(db):
+    """Every table's state, at most FLEET_CACHE_SEC old."""
+    with _cache_lock:
+        if _cache["tables"] is not None and time.monotonic() - _cache["at"] < Config.FLEET_CACHE_SEC:
+            return _cache["tables"]
+        tables = _load(db)
+        _cache["tables"], _cache["at"] = tables, time.monotonic()
+        return tables
@@ -0,0 +1,71 @@
+import gzip
+
+from flask import request, current_app
+
+from app.config import Config
+
+try:
+    import brotli
+except ImportError:  # Optional: gzip only without it
+    brotli = None
+
+# Conditional GET and compression for the polled JSON APIs.
+# An activity's ETag is its _id and 'version' (bumped by every state change, see kitting_core),
+# so a poller that already has the current state gets a 304 before the document is even read.
+
+
+# --- ETAGS / 304 ---
+def activity_etag(activity, *parts):
+    """
+    Weak ETag value of an activity's state (None for jobs started before versioning).
+    'captures_flushed' counts the detection records written behind the version (app/detection_buffer.py).
+    """
+    if not activity or 'version' not in activity:
+        return None
+    return ".".join(str(p) for p in (activity['_id'], activity['version'], activity.get('captures_flushed', 0), *parts))
+
+
+def not_modified(etag, max_age=None):
+    """A 304 response if the client already has this ETag, else None."""
+    if not etag or not request.if_none_match.contains_weak(etag):
+        return None
+    return cacheable(current_app.response_class(status=304), etag, max_age)
+
+
+def cacheable(resp, etag, max_age=None):
+    """
+    Sets the ETag and Cache-Control. Without max_age clients must revalidate every time
+    (cheap: 304); with max_age the response is immutable and kept by the browser.
+    """
+    if etag:
+        resp.set_etag(etag, weak=True)
+    if max_age:
+        resp.cache_control.private = True
+        resp.cache_control.max_age = max_age
+        resp.cache_control.immutable = True
+    else:
+        resp.cache_control.no_cache = True
+    return resp
+
+
+# --- COMPRESSION (after_request, JSON bodies only) ---
+def compress(resp):
+    """gzip / brotli for large JSON bodies, per the client's Accept-Encoding."""
+    if (Config.HTTP_COMPRESS_MIN_BYTES <= 0 or resp.status_code != 200 or resp.direct_passthrough
+            or resp.mimetype != 'application/json' or 'Content-Encoding' in resp.headers):
+        return resp
+    if resp.content_length is None or resp.content_length < Config.HTTP_COMPRESS_MIN_BYTES:
+        return resp
+
+    encoding = request.accept_encodings.best_match(['br', 'gzip'] if brotli else ['gzip'])
+    if encoding == 'br':
+        body = brotli.compress(resp.get_data(), quality=min(Config.HTTP_COMPRESS_LEVEL, 11))
+    elif encoding == 'gzip':
+        body = gzip.compress(resp.get_data(), compresslevel=min(max(Config.HTTP_COMPRESS_LEVEL, 1), 9))
+    else:
+        return resp
+
+    resp.set_data(body)
+    resp.headers['Content-Encoding'] = encoding
+    resp.vary.add('Accept-Encoding')
+    return resp
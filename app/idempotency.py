@@ -0,0 +1,151 @@
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from pymongo.errors import DuplicateKeyError
+
+from app.config import Config
+
+
+# --- HELPER: BOUNDED LRU OF ANSWERED DETECTIONS ---
+class ReceiptCache:
+    """
+    Small thread-safe LRU holding the response we already sent for a detection key.
+    Only finished receipts live here; in-flight claims are tracked in MongoDB.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, body, status_code):
+        with self._lock:
+            self._entries[key] = (body, status_code)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+receipt_cache = ReceiptCache(Config.DETECTION_DEDUP_CACHE_SIZE)
+
+# Receipt states stored in db.detection_receipts
+STATE_PENDING = "pending"
+STATE_DONE = "done"
+
+# Answer to a retry while the original request still holds the claim: retry shortly
+# (a 409 would read as a wrong part). Routes add a Retry-After header to 503 answers.
+IN_PROGRESS = ({"message": "duplicate-in-progress", "code": "duplicate_in_progress"}, 503)
+RETRY_AFTER_SEC = 1
+
+
+def build_detection_key(activity_id, cam_id, kit_number, tracking_id, client_key=None):
+    """
+    Returns the dedup key for a detection, or None if the request can't be deduplicated.
+    A client-supplied idempotency key wins over the (activity, cam, kit, Tracking_id) tuple.
+    """
+    if client_key:
+        return f"{activity_id}:key:{client_key}"
+    if tracking_id is None or tracking_id == '':
+        return None
+    return f"{activity_id}:{cam_id}:{kit_number}:{tracking_id}"
+
+
+def _stale_claim(key):
+    """Filter matching the claim on key only if its request has not finished in DETECTION_CLAIM_STALE_SEC."""
+    cutoff = datetime.utcnow() - timedelta(seconds=Config.DETECTION_CLAIM_STALE_SEC)
+    return {"_id": key, "state": STATE_PENDING, "created_at": {"$lt": cutoff}}
+
+
+def claim_detection(db, key):
+    """
+    Tries to claim a detection key before any side effect happens.
+    Returns (True, None) when the caller owns the key and must process the detection,
+    or (False, (body, status_code)) with the response to send back for a replay.
+    A pending claim older than DETECTION_CLAIM_STALE_SEC (its request crashed) is taken over.
+    """
+    cached = receipt_cache.get(key)
+    if cached is not None:
+        return False, cached
+
+    try:
+        # _id is the unique index, so concurrent retries can't both win the claim
+        db.detection_receipts.insert_one({
+            "_id": key,
+            "state": STATE_PENDING,
+            "created_at": datetime.utcnow()
+        })
+        return True, None
+    except DuplicateKeyError:
+        receipt = db.detection_receipts.find_one({"_id": key})
+
+    if receipt and receipt.get('state') == STATE_DONE:
+        replay = (receipt.get('body', {}), receipt.get('status_code', 200))
+        receipt_cache.put(key, *replay)
+        return False, replay
+
+    # Original request is still being processed, unless it died without answering
+    if db.detection_receipts.find_one_and_update(_stale_claim(key), {"$set": {"created_at": datetime.utcnow()}}):
+        return True, None
+    return False, IN_PROGRESS
+
+
+def store_detection_response(db, key, body, status_code):
+    """Records the final response for a claimed key so retries replay it."""
+    db.detection_receipts.update_one(
+        {"_id": key},
+        {"$set": {"state": STATE_DONE, "body": body, "status_code": status_code}}
+    )
+    receipt_cache.put(key, body, status_code)
+
+
+def release_detection(db, key):
+    """
+    Drops a claim whose request did not change state, so a retry is processed normally.
+    Once the state write committed, store the response instead (a retry would count it twice).
+    """
+    db.detection_receipts.delete_one({"_id": key, "state": STATE_PENDING})
+
+
+# --- ASYNC VARIANTS (asyncio mode, Motor collections) ---
+async def claim_detection_async(db, key):
+    cached = receipt_cache.get(key)
+    if cached is not None:
+        return False, cached
+
+    try:
+        await db.detection_receipts.insert_one({
+            "_id": key,
+            "state": STATE_PENDING,
+            "created_at": datetime.utcnow()
+        })
+        return True, None
+    except DuplicateKeyError:
+        receipt = await db.detection_receipts.find_one({"_id": key})
+
+    if receipt and receipt.get('state') == STATE_DONE:
+        replay = (receipt.get('body', {}), receipt.get('status_code', 200))
+        receipt_cache.put(key, *replay)
+        return False, replay
+    if await db.detection_receipts.find_one_and_update(_stale_claim(key), {"$set": {"created_at": datetime.utcnow()}}):
+        return True, None
+    return False, IN_PROGRESS
+
+
+async def store_detection_response_async(db, key, body, status_code):
+    await db.detection_receipts.update_one(
+        {"_id": key},
+        {"$set": {"state": STATE_DONE, "body": body, "status_code": status_code}}
+    )
+    receipt_cache.put(key, body, status_code)
+
+
+async def release_detection_async(db, key):
+    await db.detection_receipts.delete_one({"_id": key, "state": STATE_PENDING})
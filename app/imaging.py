@@ -0,0 +1,178 @@
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from app.config import Config
+from app.storage import get_storage
+
+# Derivative name -> longest edge in pixels
+DERIVATIVE_SIZES = {
+    "thumb": Config.CAPTURE_THUMB_PX,
+    "preview": Config.CAPTURE_PREVIEW_PX
+}
+DERIVED_PREFIX = "_derived/"
+
+
+def derivative_key(key, size):
+    """Storage key of a cached derivative, e.g. '_derived/thumb/cam1_images/x.jpg'."""
+    # Derivatives are always JPEG, whatever the original's format
+    if not key.lower().endswith(('.jpg', '.jpeg')):
+        key = f"{key}.jpg"
+    return f"{DERIVED_PREFIX}{size}/{key}"
+
+
+# --- WORKER POOL ---
+# Pillow releases the GIL while decoding/resizing/encoding, so real OS threads run in parallel.
+# Under eventlet the stdlib pool would be green (one core, blocking the hub), so eventlet's
+# tpool is used instead: it runs the call on a native thread and only parks the calling greenlet.
+_executor = None
+_executor_lock = threading.Lock()
+
+def _eventlet_active():
+    try:
+        from eventlet import patcher
+        return patcher.is_monkey_patched('thread')
+    except ImportError:
+        return False
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=Config.IMAGE_WORKERS, thread_name_prefix="imaging")
+    return _executor
+
+def run_blocking(fn, *args):
+    """Runs image work on the worker pool and waits for the result."""
+    if _eventlet_active():
+        from eventlet import tpool
+        return tpool.execute(fn, *args)
+    return _get_executor().submit(fn, *args).result()
+
+def run_background(fn, *args):
+    """Fire-and-forget variant of run_blocking."""
+    if _eventlet_active():
+        import eventlet
+        eventlet.spawn_n(run_blocking, fn, *args)
+    else:
+        _get_executor().submit(fn, *args)
+
+
+# --- RENDERING ---
+def render_derivative(data, max_px, quality):
+    """Downscales JPEG/PNG bytes so the longest edge is max_px. Returns JPEG bytes."""
+    from PIL import Image   # Optional dependency (Pillow)
+
+    img = Image.open(io.BytesIO(data))
+    # JPEG draft mode decodes at a reduced scale directly: far cheaper than a full decode
+    img.draft('RGB', (max_px, max_px))
+    if img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+    img.thumbnail((max_px, max_px))
+    out = io.BytesIO()
+    img.save(out, format='JPEG', quality=quality, optimize=True)
+    return out.getvalue()
+
+
+def _build_and_store(key, data, size):
+    dkey = derivative_key(key, size)
+    rendered = render_derivative(data, DERIVATIVE_SIZES[size], Config.CAPTURE_DERIVATIVE_QUALITY)
+    get_storage().save(dkey, rendered, "image/jpeg")
+    return dkey
+
+
+def _build_all(key, data, logger=None):
+    for size in DERIVATIVE_SIZES:
+        try:
+            _build_and_store(key, data, size)
+        except Exception as e:
+            if logger: logger.warning(f"Derivative {size} failed for {key}: {e}")
+
+
+# --- INGEST COMPRESSION ---
+INGEST_FORMATS = {
+    # format -> (file extension, mimetype)
+    "JPEG": (".jpg", "image/jpeg"),
+    "WEBP": (".webp", "image/webp"),
+}
+
+def compress_capture(data, max_px, quality, fmt):
+    """
+    Re-encodes an uploaded capture to at most max_px on the longest edge.
+    Returns the new bytes, or the original bytes if re-encoding doesn't make them smaller.
+    """
+    from PIL import Image   # Optional dependency (Pillow)
+
+    img = Image.open(io.BytesIO(data))
+    if max(img.size) > max_px:
+        img.draft('RGB', (max_px, max_px))
+        img.thumbnail((max_px, max_px))
+    if img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+    out = io.BytesIO()
+    img.save(out, format=fmt, quality=quality, optimize=(fmt == 'JPEG'))
+    encoded = out.getvalue()
+    return encoded if len(encoded) < len(data) else data
+
+
+_process_pool = None
+
+def run_cpu(fn, *args):
+    """
+    Runs CPU-bound work in a process pool when IMAGE_POOL=process.
+    Forking a monkey-patched eventlet process is unsafe, so under eventlet this falls back
+    to the native-thread pool (Pillow drops the GIL while encoding, so it still uses every core).
+    """
+    global _process_pool
+    if Config.IMAGE_POOL == 'process' and not _eventlet_active():
+        if _process_pool is None:
+            with _executor_lock:
+                if _process_pool is None:
+                    from concurrent.futures import ProcessPoolExecutor
+                    _process_pool = ProcessPoolExecutor(max_workers=Config.IMAGE_WORKERS)
+        return _process_pool.submit(fn, *args).result()
+    return run_blocking(fn, *args)
+
+
+def ingest_capture(key, data, mimetype="image/jpeg", logger=None):
+    """
+    Applies the optional ingest stage to an uploaded capture.
+    Returns (key, data, mimetype, bytes_saved); the key's extension follows the output format.
+    """
+    if not Config.CAPTURE_INGEST_ENABLED:
+        return key, data, mimetype, 0
+
+    fmt = Config.CAPTURE_INGEST_FORMAT
+    try:
+        ext, out_mimetype = INGEST_FORMATS[fmt]
+        compressed = run_cpu(compress_capture, data, Config.CAPTURE_INGEST_MAX_PX,
+                             Config.CAPTURE_INGEST_QUALITY, fmt)
+    except Exception as e:
+        # A capture we can't decode is still evidence: keep it as sent
+        if logger: logger.warning(f"Ingest compression failed for {key}: {e}")
+        return key, data, mimetype, 0
+    if len(compressed) >= len(data):
+        return key, data, mimetype, 0
+
+    base, _ = os.path.splitext(key)
+    return f"{base}{ext}", compressed, out_mimetype, len(data) - len(compressed)
+
+
+def schedule_derivatives(key, data, logger=None):
+    """Called right after a capture is stored: builds every size in the background."""
+    if Config.CAPTURE_DERIVATIVES_ON_INGEST:
+        run_background(_build_all, key, data, logger)
+
+
+def ensure_derivative(key, size, read_original):
+    """
+    Returns the storage key of the `size` derivative, building it on first request.
+    `read_original()` returns the original bytes (loose file or bundle member).
+    """
+    dkey = derivative_key(key, size)
+    if get_storage().exists(dkey):
+        return dkey
+    data = read_original()
+    return run_blocking(_build_and_store, key, data, size)
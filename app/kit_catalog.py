@@ -0,0 +1,345 @@
+import copy
+import logging
+import re
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from itertools import groupby
+
+from app.config import Config
+from app.imaging import run_blocking
+from app.kitting_core import compile_kit
+from app.metrics import metrics
+
+# The whole kit collection is small and read on every setup and parts page, so each process
+# keeps it in memory. save_kit / delete_kit bump a counter in db.meta; a process reloads its
+# copy when the counter differs from the one it loaded (checked at most every
+# KIT_CATALOG_CHECK_SEC), so edits made through any process are picked up by all of them.
+# The list and the search index only cache what they show (PROJECTION). Full compiled kits, for
+# job setup, are cached as they are looked up and dropped with the rest on a reload.
+# kit_catalog.hits counts lookups that read nothing from MongoDB, misses those that did.
+META_ID = "kit_catalog"
+log = logging.getLogger(__name__)   # Propagates to the Flask app's logger ("app")
+PROJECTION = {"kit_name": 1, "edp_number": 1, "updated_at": 1, "created_at": 1, "parts.name": 1}
+
+
+def normalize(value):
+    """Lookup key for kit names and EDP numbers: trimmed, case-insensitive."""
+    return str(value or '').strip().casefold()
+
+
+WORD_SPLIT = re.compile(r'[\W_]+')
+
+def words(text):
+    """Normalized words of a name ('M8 Bolt-Zinc' -> ['m8', 'bolt', 'zinc'])."""
+    return [w for w in WORD_SPLIT.split(normalize(text)) if w]
+
+
+def summary(kit):
+    """What the kit list and the search API show (no parts)."""
+    return {
+        "_id": kit['_id'],
+        "kit_name": kit.get('kit_name'),
+        "edp_number": kit.get('edp_number'),
+        "part_count": len(kit.get('parts') or []),
+        "updated_at": kit.get('updated_at')
+    }
+
+
+# Bit positions set in each byte value, to list the kits of a bitmask quickly
+BYTE_BITS = [tuple(i for i in range(8) if byte >> i & 1) for byte in range(256)]
+# Prefixes up to this length whose uncommon words hold at least PREFIX_MASK_POSTINGS kit
+# numbers get a prebuilt mask: 'p4' spans thousands of part numbers, too many to walk per keystroke
+PREFIX_MASK_MAX_LEN = 4
+PREFIX_MASK_POSTINGS = 4096
+
+
+class SearchIndex:
+    """
+    Prefix index over a catalog snapshot. Kits are numbered in name order, so a name-prefix
+    match is one contiguous range, and each distinct word of a kit name, EDP or part name maps
+    to the numbers of the kits containing it. Query results are bitmasks (Python ints, bit n =
+    kit n): words shared by many kits keep a prebuilt mask, so unions and intersections of
+    common words are a few big-int ORs / ANDs rather than set operations over every kit.
+    Short prefixes covering many uncommon words keep a prebuilt mask as well (prefix_masks).
+    """
+    def __init__(self, kits):
+        self.source = kits
+        self.kits = sorted(kits, key=lambda k: normalize(k.get('kit_name')))
+        self.names = [normalize(k.get('kit_name')) for k in self.kits]
+        self.nbytes = (len(self.kits) + 7) // 8
+        postings = {}
+        memo = {}   # Part names repeat across kits: split each distinct one once
+        for n, kit in enumerate(self.kits):
+            texts = (kit.get('kit_name'), kit.get('edp_number'), *((p or {}).get('name') for p in kit.get('parts') or []))
+            tokens = set()
+            for text in texts:
+                if text not in memo:
+                    memo[text] = words(text)
+                tokens.update(memo[text])
+            for token in tokens:
+                postings.setdefault(token, array('I')).append(n)
+        self.tokens = sorted(postings)
+        self.postings = [postings[t] for t in self.tokens]
+        common = max(64, len(self.kits) // 64)
+        self.masks = [self._mask(p) if len(p) >= common else None for p in self.postings]
+
+        self.prefix_masks = {}
+        for length in range(1, PREFIX_MASK_MAX_LEN + 1):
+            for prefix, group in groupby(range(len(self.tokens)), key=lambda i: self.tokens[i][:length]):
+                group = list(group)
+                if len(prefix) == length and sum(len(self.postings[i]) for i in group
+                                                 if self.masks[i] is None) >= PREFIX_MASK_POSTINGS:
+                    self.prefix_masks[prefix] = self._union(group[0], group[-1] + 1)
+
+    def _mask(self, numbers):
+        bits = bytearray(self.nbytes)
+        for n in numbers:
+            bits[n >> 3] |= 1 << (n & 7)
+        return int.from_bytes(bits, 'little')
+
+    @staticmethod
+    def _range(keys, prefix):
+        return bisect_left(keys, prefix), bisect_left(keys, prefix + '\U0010ffff')
+
+    def matches(self, prefix, whole=False):
+        """Bitmask of the kits having a word equal to (whole) or starting with prefix."""
+        if not whole and prefix in self.prefix_masks:
+            return self.prefix_masks[prefix]
+        lo, hi = self._range(self.tokens, prefix)
+        if whole:
+            hi = lo + 1 if lo < len(self.tokens) and self.tokens[lo] == prefix else lo
+        return self._union(lo, hi)
+
+    def _union(self, lo, hi):
+        """Bitmask of the kits having any of the words lo..hi-1."""
+        mask = 0
+        rare = bytearray(self.nbytes)
+        for i in range(lo, hi):
+            if self.masks[i] is not None:
+                mask |= self.masks[i]
+            else:
+                for n in self.postings[i]:
+                    rare[n >> 3] |= 1 << (n & 7)
+        return mask | int.from_bytes(rare, 'little')
+
+    @staticmethod
+    def _numbers(mask, skip, limit):
+        """Up to limit kit numbers set in mask, in order, after skipping the first skip."""
+        found = []
+        for i, byte in enumerate(mask.to_bytes((mask.bit_length() + 7) // 8, 'little')):
+            if not byte:
+                continue
+            bits = BYTE_BITS[byte]
+            if skip >= len(bits):
+                skip -= len(bits)
+                continue
+            for bit in bits[skip:]:
+                found.append(i * 8 + bit)
+                if len(found) == limit:
+                    return found
+            skip = 0
+        return found
+
+    def search(self, query, min_chars, offset, limit):
+        """
+        (kit numbers of the requested page, total) for a query as typed: every word but the last
+        must be a whole word of the kit name, EDP or a part name, the last one a word prefix.
+        Kits whose name starts with the whole query come first, then the rest, each in name
+        order. Queries shorter than min_chars only match kit names.
+        """
+        query = normalize(query)
+        lo, hi = self._range(self.names, query)
+        head = list(range(min(lo + offset, hi), min(lo + offset + limit, hi)))
+        if len(query) < min_chars:
+            return head, hi - lo
+
+        *complete, last = words(query) or [query]
+        found = self.matches(last)
+        for word in complete:
+            if not found:
+                break
+            found &= self.matches(word, whole=True)
+
+        # Name-prefix matches are the contiguous range [lo, hi); the rest follow in name order
+        found &= ~(((1 << hi) - 1) ^ ((1 << lo) - 1))
+        rest = self._numbers(found, max(offset - (hi - lo), 0), limit - len(head)) if len(head) < limit else []
+        return head + rest, (hi - lo) + found.bit_count()
+
+
+# --- COMPILED KITS (see kitting_core.compile_kit) ---
+def compiled_kit(kit):
+    """The kit with compiled parts; kits saved before compilation existed are compiled on the fly."""
+    if not kit.get('compiled'):
+        kit['parts'], kit['compiled'] = compile_kit(kit.get('parts'))
+    return kit
+
+
+def versioned_update(fields, parts, compiled, now):
+    """
+    Pipeline update writing a compiled kit. kit_version goes up only when the content hash
+    changes (1 for a new kit), so re-saving an unchanged kit keeps the version jobs recorded.
+    """
+    return [
+        {"$set": {"kit_version": {"$cond": [
+            {"$eq": ["$compiled.hash", compiled['hash']]},
+            "$kit_version",
+            {"$add": [{"$ifNull": ["$kit_version", 0]}, 1]}
+        ]}}},
+        # $literal: part names are user data and must never be read as field paths
+        {"$set": {**{k: {"$literal": v} for k, v in fields.items()},
+                  "parts": {"$literal": parts},
+                  "compiled": {"$literal": compiled},
+                  "updated_at": now,
+                  "created_at": {"$ifNull": ["$created_at", now]}}}
+    ]
+
+
+def bump_version(db):
+    """Marks the catalog as changed for every process. Call after any write to db.kits."""
+    db.meta.update_one({"_id": META_ID}, {"$inc": {"version": 1}}, upsert=True)
+    kit_catalog.invalidate()
+
+
+class KitCatalog:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked_at = 0
+        self._kits = []          # newest first, like the parts list
+        self._by_exact = {}
+        self._by_name = {}
+        self._by_edp = {}
+        self._compiled = {}      # _id -> full compiled kit, filled by find()
+        self._index = None       # SearchIndex of self._kits, or of an older load until the rebuild is in
+        self._building = None    # kits list an index is being built for
+
+    def invalidate(self):
+        with self._lock:
+            self._version = None
+
+    def _current_version(self, db):
+        meta = db.meta.find_one({"_id": META_ID}, {"version": 1})
+        return meta.get('version', 0) if meta else 0
+
+    def _load(self, db, version):
+        kits = list(db.kits.find({}, PROJECTION).sort("created_at", -1))
+        by_exact, by_name, by_edp = {}, {}, {}
+        # Oldest first so duplicates resolve to the same kit find_one() used to return
+        for kit in sorted(kits, key=lambda k: k['_id']):
+            by_exact.setdefault(kit.get('kit_name'), kit)
+            by_name.setdefault(normalize(kit.get('kit_name')), kit)
+            by_edp.setdefault(normalize(kit.get('edp_number')), kit)
+        self._kits, self._by_exact, self._by_name, self._by_edp = kits, by_exact, by_name, by_edp
+        self._compiled = {}
+        self._version = version
+
+    def _fresh(self, db):
+        """Reloads the catalog if another process (or this one) changed it. True if MongoDB was read."""
+        with self._lock:
+            now = time.monotonic()
+            if self._version is not None and now - self._checked_at < Config.KIT_CATALOG_CHECK_SEC:
+                return False
+            version = self._current_version(db)
+            self._checked_at = now
+            if version != self._version:
+                self._load(db, version)
+            return True
+
+    @staticmethod
+    def _count(read):
+        metrics.incr("kit_catalog.misses" if read else "kit_catalog.hits")
+
+    def list(self, db):
+        """Every kit (PROJECTION fields only), newest first. Read-only: the documents are shared."""
+        self._count(self._fresh(db))
+        return self._kits
+
+    def _full(self, db, kit, read):
+        """Private copy of the full compiled kit, read from MongoDB once per catalog load."""
+        if kit is None:
+            self._count(read)
+            return None
+        with self._lock:
+            full, compiled = self._compiled.get(kit['_id']), self._compiled
+        if full is None:
+            read = True
+            full = db.kits.find_one({"_id": kit['_id']})
+            if full is not None:
+                full = compiled_kit(full)
+                with self._lock:
+                    if self._compiled is compiled:   # Not reloaded meanwhile
+                        compiled[kit['_id']] = full
+        self._count(read)
+        return copy.deepcopy(full)
+
+    def find(self, db, kit_name):
+        """Full compiled kit by exact name, else by case-insensitive name. Returns a private copy or None."""
+        read = self._fresh(db)
+        return self._full(db, self._by_exact.get(kit_name) or self._by_name.get(normalize(kit_name)), read)
+
+    def find_by_edp(self, db, edp_number):
+        read = self._fresh(db)
+        return self._full(db, self._by_edp.get(normalize(edp_number)), read)
+
+    # --- SEARCH INDEX (rebuilt off the event loop) ---
+    def _build(self, kits):
+        """
+        Builds the index of a kits list on a native thread (seconds at 50k kits) and installs it,
+        unless the catalog was reloaded meanwhile and an index is already being served.
+        """
+        started = time.perf_counter()
+        try:
+            index = run_blocking(SearchIndex, kits)
+        finally:
+            with self._lock:
+                if self._building is kits:
+                    self._building = None
+        metrics.incr("kit_catalog.index_builds")
+        metrics.observe("kit_catalog.index_build_ms", (time.perf_counter() - started) * 1000)
+        with self._lock:
+            if self._kits is kits or self._index is None:
+                self._index = index
+        return index
+
+    def _rebuild(self, kits):
+        try:
+            self._build(kits)
+        except Exception as e:
+            log.error(f"Kit search index rebuild failed: {e}")
+
+    def search(self, db, query, offset=0, limit=20):
+        """
+        (summaries, total) of the kits matching a prefix query; every kit, newest first, if empty.
+        After a catalog change the previous index answers until the new one is built.
+        """
+        self._count(self._fresh(db))
+        with self._lock:
+            index, kits = self._index, self._kits
+            rebuild = index is not None and index.source is not kits and self._building is not kits
+            if rebuild:
+                self._building = kits
+        if rebuild:
+            threading.Thread(target=self._rebuild, args=(kits,), daemon=True).start()
+
+        if not normalize(query):
+            return [summary(k) for k in kits[offset:offset + limit]], len(kits)
+        if index is None:
+            index = self._build(kits)   # First search of the process: nothing to serve yet
+        numbers, total = index.search(query, Config.KIT_SEARCH_MIN_CHARS, offset, limit)
+        return [summary(index.kits[n]) for n in numbers], total
+
+    def stats(self):
+        counters = metrics.snapshot()['counters']
+        hits, misses = counters.get("kit_catalog.hits", 0), counters.get("kit_catalog.misses", 0)
+        return {
+            "kits": len(self._kits),
+            "version": self._version,
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": round(hits / (hits + misses), 3) if hits + misses else None
+        }
+
+
+kit_catalog = KitCatalog()
@@ -0,0 +1,216 @@
+import csv
+import io
+from datetime import datetime
+
+from pymongo import UpdateOne
+
+from app.config import Config
+from app.kit_catalog import bump_version, versioned_update
+from app.kitting_core import get_safe_cam_id, compile_kit
+
+# Bulk BOM import / export for db.kits. One row per part; a kit's rows are normally contiguous:
+#   kit_name, edp_number, part_name, quantity, camera, alert_missing, alert_undercount, alert_overcount
+# Rows are validated as they stream in and kits are upserted by kit_name with batched bulk_write.
+# An imported kit replaces the parts of the existing kit with the same name, compiled like
+# parts.save_kit does, so a kit's rows must be contiguous.
+# kit_name is not unique: parts.save_kit lets two kits share a name, and the kit_name index
+# (app/db.py) only speeds up the lookup. When a name matches several kits, the upsert replaces
+# the parts of one of them (whichever MongoDB finds first) and leaves the others as they were.
+COLUMNS = ("kit_name", "edp_number", "part_name", "quantity", "camera",
+           "alert_missing", "alert_undercount", "alert_overcount")
+
+HEADER_ALIASES = {
+    "kit": "kit_name", "kit name": "kit_name",
+    "edp": "edp_number", "edp number": "edp_number", "edp_no": "edp_number",
+    "part": "part_name", "part name": "part_name", "name": "part_name",
+    "qty": "quantity",
+    "cam": "camera", "camera_id": "camera"
+}
+REQUIRED = ("kit_name", "edp_number", "part_name")
+TRUE_VALUES = ("1", "true", "yes", "y", "x")
+
+
+class ImportReport:
+    def __init__(self):
+        self.rows = 0
+        self.kits = 0
+        self.parts = 0
+        self.upserted = 0
+        self.modified = 0
+        self.errors = []
+        self.error_count = 0
+
+    def error(self, row, message):
+        self.error_count += 1
+        if len(self.errors) < Config.KIT_IMPORT_MAX_ERRORS:
+            self.errors.append({"row": row, "message": message})
+
+    def to_dict(self):
+        return {
+            "rows": self.rows,
+            "kits": self.kits,
+            "parts": self.parts,
+            "inserted": self.upserted,
+            "updated": self.modified,
+            "error_count": self.error_count,
+            "errors": self.errors,
+            "errors_truncated": self.error_count > len(self.errors)
+        }
+
+
+# --- READING (CSV or XLSX, one row at a time) ---
+def read_rows(stream, filename):
+    """Yields raw rows (lists of cells) from a CSV or XLSX upload, header included."""
+    if filename.lower().endswith(('.xlsx', '.xlsm')):
+        from openpyxl import load_workbook
+        workbook = load_workbook(stream, read_only=True, data_only=True)
+        try:
+            for row in workbook.active.iter_rows(values_only=True):
+                yield list(row)
+        finally:
+            workbook.close()
+    else:
+        text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+        yield from csv.reader(text)
+
+
+def header_map(header):
+    """Column index per known field, from a header row (case / alias tolerant)."""
+    index = {}
+    for i, cell in enumerate(header):
+        key = str(cell or '').strip().lower()
+        key = HEADER_ALIASES.get(key, key.replace(' ', '_'))
+        if key in COLUMNS and key not in index:
+            index[key] = i
+    missing = [c for c in REQUIRED if c not in index]
+    if missing:
+        raise ValueError(f"Missing column(s): {', '.join(missing)}")
+    return index
+
+
+def parse_row(cells, index):
+    """(kit_name, edp_number, part) from one row; raises ValueError with a readable reason."""
+    def cell(name):
+        i = index.get(name)
+        value = cells[i] if i is not None and i < len(cells) else None
+        return '' if value is None else str(value).strip()
+
+    for name in REQUIRED:
+        if not cell(name):
+            raise ValueError(f"{name} is empty")
+
+    quantity = cell("quantity") or "1"
+    try:
+        value = float(quantity)
+        whole = int(value)
+    except (ValueError, OverflowError):   # "abc", "inf", "nan"
+        raise ValueError(f"quantity '{quantity}' is not a number")
+    if whole != value:
+        raise ValueError(f"quantity '{quantity}' is not a whole number")
+    quantity = whole
+    if quantity < 1:
+        raise ValueError("quantity must be at least 1")
+
+    camera = get_safe_cam_id(cell("camera") or "cam1")
+    if not 1 <= int(camera[3:]) <= Config.MAX_CAMERAS:
+        raise ValueError(f"camera {camera} is outside cam1..cam{Config.MAX_CAMERAS}")
+
+    part = {
+        "name": cell("part_name"),
+        "quantity": quantity,
+        "camera": camera,
+        **{flag: cell(flag).lower() in TRUE_VALUES for flag in ("alert_missing", "alert_undercount", "alert_overcount")}
+    }
+    return cell("kit_name"), cell("edp_number"), part
+
+
+# --- IMPORT ---
+def import_rows(db, rows, dry_run=False):
+    """
+    Validates rows (header first) and upserts one kit per kit_name. Invalid rows are skipped
+    and reported; everything else is written in bulk_write batches of KIT_IMPORT_BATCH kits.
+    """
+    report = ImportReport()
+    rows = iter(rows)
+    try:
+        index = header_map(next(rows))
+    except StopIteration:
+        report.error(1, "File is empty")
+        return report
+    except ValueError as e:
+        report.error(1, str(e))
+        return report
+
+    now = datetime.utcnow()
+    seen = set()       # kits already read
+    batch = []
+    current = None     # [kit_name, edp_number, parts] of the kit being read
+
+    def flush_kit():
+        name, edp, parts = current
+        seen.add(name)
+        report.kits += 1
+        parts, compiled = compile_kit(parts)
+        fields = {"kit_name": name, "edp_number": edp}
+        batch.append(UpdateOne({"kit_name": name}, versioned_update(fields, parts, compiled, now), upsert=True))
+        if len(batch) >= Config.KIT_IMPORT_BATCH:
+            write_batch()
+
+    def write_batch():
+        if batch and not dry_run:
+            result = db.kits.bulk_write(batch, ordered=False)
+            report.upserted += result.upserted_count
+            report.modified += result.modified_count
+        batch.clear()
+
+    for row_number, cells in enumerate(rows, start=2):
+        if not any(c not in (None, '') for c in cells):
+            continue  # Blank line
+        report.rows += 1
+        try:
+            name, edp, part = parse_row(cells, index)
+        except ValueError as e:
+            report.error(row_number, str(e))
+            continue
+
+        if name in seen:
+            report.error(row_number, f"kit '{name}' was already imported above: keep a kit's rows together")
+            continue
+        if current and current[0] == name:
+            if edp != current[1]:
+                report.error(row_number, f"edp_number '{edp}' differs from '{current[1]}' earlier in kit '{name}'")
+                continue
+            current[2].append(part)
+        else:
+            if current: flush_kit()
+            current = [name, edp, [part]]
+        report.parts += 1
+
+    if current: flush_kit()
+    write_batch()
+    if report.kits and not dry_run:
+        bump_version(db)
+    return report
+
+
+# --- EXPORT ---
+def export_csv(db):
+    """Yields the catalog as CSV text chunks (same columns as the import), one kit at a time."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+
+    cursor = db.kits.find({}, {"kit_name": 1, "edp_number": 1, "parts": 1}).sort("kit_name", 1)
+    for kit in cursor.batch_size(500):
+        for part in kit.get('parts') or []:
+            writer.writerow([
+                kit.get('kit_name'), kit.get('edp_number'), part.get('name'), part.get('quantity', 1),
+                part.get('camera', 'cam1'),
+                *(int(bool(part.get(flag) or flag.replace('alert_', '') in (part.get('alerts') or [])))
+                  for flag in ("alert_missing", "alert_undercount", "alert_overcount"))
+            ])
+        if buffer.tell() >= 64 * 1024:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
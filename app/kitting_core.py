@@ -0,0 +1,604 @@
+import hashlib
+import inspect
+import json
+import re
+import traceback
+from datetime import datetime
+
+from app.config import Config
+from app.idempotency import build_detection_key, RETRY_AFTER_SEC
+from app.metrics import metrics
+
+# Kitting rules shared by both server modes: the Flask/eventlet blueprint (app/blueprints/kitting.py)
+# and the asyncio mode (app/asgi.py). Nothing in here touches Flask, the DB or sockets, so both
+# modes take the same decisions and only differ in how they read, write and emit (the detection
+# flow at the bottom does its I/O through an adapter each mode provides).
+
+
+# --- HELPER: NORMALIZE CAM ID ---
+def get_safe_cam_id(input_id):
+    """Ensures inputs like '3', 'Camera 3', 'CAM3' always return 'cam3'."""
+    digits = re.search(r'\d+', str(input_id))
+    if digits: return f"cam{int(digits.group())}"
+    return 'cam1' # Default fallback
+
+
+# --- CAMERAS ---
+# Per-camera progress lives in one keyed sub-document, so a table can run any number of cameras:
+#   "cams": {"cam1": {"kit_index": 1, "errors": [], "last_detected_index": -1}, "cam2": {...}, ...}
+# Jobs saved with the old flat fields (current_kit_index_cam1, ...) are migrated by app/db.py.
+def new_cam_state():
+    return {"kit_index": 1, "errors": [], "last_detected_index": -1}
+
+def cam_field(cam_id, name):
+    """Dotted path of a per-camera field, e.g. 'cams.cam3.kit_index'."""
+    return f"cams.{cam_id}.{name}"
+
+def sort_cameras(cams):
+    """cam1, cam2, ..., cam10 (numeric, not lexical, order)."""
+    return sorted(cams, key=lambda c: int(c[3:]) if c[3:].isdigit() else 0)
+
+def kit_cameras(parts):
+    """Sorted camera ids used by a list of compiled parts (kit definition or activity components)."""
+    cams = {p.get('camera') or 'cam1' for p in parts or []}
+    return sort_cameras(cams) or ['cam1']
+
+def activity_cameras(activity):
+    """Every camera of a job: the ones its parts use plus any that reported state."""
+    cams = set(kit_cameras(activity.get('components'))) | set((activity.get('cams') or {}).keys())
+    return sort_cameras(cams)
+
+def kit_started_at(activity, cam_id):
+    """When the camera's current kit started: its previous kit's completion, else the job start."""
+    return (activity.get('cams') or {}).get(cam_id, {}).get('kit_started_at') or activity.get('start_time')
+
+def cam_state(activity, cam_id):
+    """State of one camera, with defaults for a camera that hasn't reported yet."""
+    return {**new_cam_state(), **((activity.get('cams') or {}).get(cam_id) or {})}
+
+# --- COMPILED KIT DEFINITIONS ---
+# parts.save_kit (and the bulk import) store kits already compiled: every part has a stripped
+# name, an int quantity, a normalized camera id and the three boolean alert flags, and
+# kit['compiled'] holds the cameras, the part indexes per camera and a content hash.
+# start_activity copies the parts as they are, so activity components (and every detection
+# comparing against them) never need normalizing again.
+ALERT_FLAGS = ("alert_missing", "alert_undercount", "alert_overcount")
+
+def compile_part(part):
+    """One validated, normalized part. Raises ValueError with a readable reason."""
+    name = str(part.get('name') or '').strip()
+    if not name:
+        raise ValueError("All parts must have a name.")
+    try:
+        quantity = int(part.get('quantity', 1))
+    except (TypeError, ValueError):
+        raise ValueError(f"Part '{name}': quantity must be a number.")
+    if quantity < 1:
+        raise ValueError(f"Part '{name}': quantity must be at least 1.")
+
+    alerts = part.get('alerts') or []   # Legacy format: list of alert names
+    return {
+        "name": name,
+        "quantity": quantity,
+        "camera": get_safe_cam_id(part.get('camera')),
+        **{flag: bool(part.get(flag, flag[len("alert_"):] in alerts)) for flag in ALERT_FLAGS}
+    }
+
+def compile_kit(parts):
+    """(compiled parts, compiled summary) of a kit definition. Raises ValueError on invalid parts."""
+    parts = [compile_part(p or {}) for p in parts or []]
+    groups = {}
+    for idx, part in enumerate(parts):
+        groups.setdefault(part['camera'], []).append(idx)
+    cameras = sort_cameras(groups)
+    content = json.dumps(parts, sort_keys=True, separators=(',', ':'))
+    return parts, {
+        "cameras": cameras or ['cam1'],
+        "groups": {cam: groups[cam] for cam in cameras},
+        "part_count": len(parts),
+        "hash": hashlib.sha256(content.encode('utf-8')).hexdigest()
+    }
+
+def new_components(kit):
+    """Activity components for a compiled kit: a copy of its parts with live counters."""
+    return [{**part, "found_quantity": 0, "status": "pending"} for part in kit.get('parts') or []]
+
+
+# Projection for reads that only need the live state: drops the kit history copies and every
+# detection record, which grow with the job (galleries load them page by page)
+COMPACT_PROJECTION = {"history": 0, "components.captured_images": 0}
+
+def cam_parts(components, cam_id):
+    return [p for p in components or [] if p.get('camera') == cam_id]
+
+def active_errors(activity):
+    """{cam_id: errors} for every camera with an unresolved error."""
+    errors = {}
+    for cam in activity_cameras(activity):
+        cam_errors = cam_state(activity, cam)['errors']
+        if cam_errors: errors[cam] = cam_errors
+    return errors
+
+def is_locked(activity):
+    """True while any camera has an unresolved error (Red Screen)."""
+    return bool(active_errors(activity))
+
+
+# --- OPTIMISTIC CONCURRENCY ---
+# Every write that acts on a decision taken from a read matches on the activity's 'version' and
+# increments it. If another request wrote in between, the write matches nothing and the caller
+# re-reads and decides again (see ACTIVITY_WRITE_RETRIES), so no table-wide lock is needed.
+# Unconditional writes (capture_stats) increment it too: the version is also the ETag of the
+# activity's JSON (app/http_cache.py), so every change of the document has to move it.
+def version_filter(activity):
+    """Filter matching the activity only if nobody wrote it since it was read."""
+    if 'version' in activity:
+        return {"_id": activity['_id'], "version": activity['version']}
+    return {"_id": activity['_id'], "version": {"$exists": False}} # Jobs started before versioning
+
+def bump_version(update):
+    update.setdefault("$inc", {})["version"] = 1
+    return update
+
+
+# --- DETECTION ---
+def parse_confidence(value):
+    """avgThreshold as a float; missing or malformed values (None, '', 'n/a', NaN) count as 0.0."""
+    try:
+        confidence = float(value or 0.0)
+    except (TypeError, ValueError):
+        return 0.0
+    return confidence if confidence == confidence else 0.0
+
+
+def parse_detection(data):
+    """Extracts the detection metadata the AI sends in the 'payload' form field."""
+    return {
+        "cam_id": get_safe_cam_id(data.get('camId', '')),
+        "detected_part": data.get('detectedPart', ''),           # Logical name (mapped)
+        "ai_raw_name": data.get('AiDetectedPartName', ''),       # Raw class name from model
+        "confidence": parse_confidence(data.get('avgThreshold')), # Confidence score (0.0 - 1.0)
+        "tracking_id": data.get('Tracking_id', None)             # Unique ID from object tracker
+    }
+
+
+def match_component(components, cam_id, detected_part):
+    """
+    Returns (index, part) of the slot a detection counts towards, or (-1, None) for a wrong part.
+    Logic A "Hungry Slot": first matching part that still needs items (found < quantity).
+    Logic B "Overcount Slot": all slots full, so the first matching part (registers an overcount).
+    """
+    fallback = (-1, None)
+    for idx, part in enumerate(components):
+        if part.get('camera') == cam_id and str(part.get('name')) == str(detected_part):
+            if part.get('found_quantity', 0) < part.get('quantity', 1):
+                return idx, part
+            if fallback[1] is None:
+                fallback = (idx, part)
+    return fallback
+
+
+def detection_record(image_url, det):
+    """Rich record stored with the component (for history/debugging)."""
+    return {
+        "image_url": image_url,
+        "timestamp": datetime.utcnow(),
+        "ai_class_name": det['ai_raw_name'],
+        "confidence": det['confidence'],
+        "tracking_id": det['tracking_id'],
+        "cam_id": det['cam_id']
+    }
+
+
+def wrong_part_error(image_url, det):
+    """Error pushed to cams.<cam>.errors; locks the table until resolved."""
+    return {
+        "error_type": "detection",
+        "reason_selected": None, # Will be filled by operator resolution
+        "timestamp": datetime.utcnow(),
+        "error_details": {
+            "message": "wrong_part_detected",
+            "imageUrl": image_url,
+            "detectedPart": det['detected_part'],
+            "AiDetectedPartName": det['ai_raw_name'], # Stored for debug
+            "avgThreshold": det['confidence'],        # Stored for debug
+            "Tracking_id": det['tracking_id'],        # Stored for debug
+            "error_code": "wrong-part",
+            "camId": det['cam_id']
+        }
+    }
+
+
+def wrong_part_event(image_url, det):
+    """ui_update payload that triggers the Red Screen."""
+    return {
+        "type": "error_alert",
+        "message": "wrong_part_detected",
+        "imageUrl": image_url,
+        "detectedPart": det['detected_part'],
+        "camId": det['cam_id']
+    }
+
+
+def wrong_part_response(image_url, det):
+    return {
+        "code": "wrong-part",
+        "message": "wrong_part",
+        "part_name": det['detected_part'],
+        "cam_id": det['cam_id'],
+        "tracking_id": det['tracking_id'],
+        "avg_threshold": det['confidence'],
+        "image_url": image_url
+    }
+
+
+def detection_update(target_index, det, record, extra_inc=None, push_record=True):
+    """
+    Atomic update: increment the slot count and append the detection record in one go.
+    push_record=False leaves the append to the write-behind buffer (app/detection_buffer.py).
+    """
+    update_field = f"components.{target_index}"
+    update = {
+        "$inc": {f"{update_field}.found_quantity": 1, **(extra_inc or {})}, # Atomic Math
+        "$set": {
+            f"{update_field}.last_image_url": record['image_url'],
+            "last_updated": datetime.utcnow(),
+            cam_field(det['cam_id'], 'last_detected_index'): target_index
+        }
+    }
+    if push_record:
+        update["$push"] = {f"{update_field}.captured_images": record}
+    return update
+
+
+def _slot_completed_fields(activity, target_index, cam_id):
+    """Fields marking a slot completed, with its order among the camera's completed slots."""
+    c_done = sum(1 for idx, p in enumerate(activity['components'])
+                 if idx != target_index
+                 and p.get('camera') == cam_id
+                 and p.get('status') == 'completed')
+    update_field = f"components.{target_index}"
+    return {
+        f"{update_field}.status": "completed",
+        f"{update_field}.sequence_order": c_done + 1
+    }
+
+
+def detection_write(activity, target_index, det, record, extra_inc=None, push_record=True):
+    """
+    (filter, update) for a matched detection as a single conditional write: the slot increment
+    and, if this detection fills the slot, its completion. Matches only the version we read.
+    """
+    component = activity['components'][target_index]
+    update = detection_update(target_index, det, record, extra_inc, push_record)
+    if component.get('found_quantity', 0) + 1 >= component.get('quantity', 1) and component.get('status') != 'completed':
+        update["$set"].update(_slot_completed_fields(activity, target_index, det['cam_id']))
+    return version_filter(activity), bump_version(update)
+
+
+def wrong_part_write(activity, cam_id, error, extra_inc=None):
+    """(filter, update) pushing a wrong-part error (locks the table), conditional on the version read."""
+    update = {"$push": {cam_field(cam_id, 'errors'): error}}
+    if extra_inc:
+        update["$inc"] = dict(extra_inc)
+    return version_filter(activity), bump_version(update)
+
+
+# --- KIT COMPLETION ---
+def kit_history_id(activity_id, cam_id, kit_number):
+    """_id of a finished kit's db.kit_history record: one record per kit, however often it is written."""
+    return f"{activity_id}:{cam_id}:{kit_number}"
+
+
+def camera_completion_update(activity, cam_id, history_entry):
+    """
+    Single update finishing the current kit of one camera: appends the history entry, resets the
+    camera's parts if more kits follow, advances its kit index and, when every camera is past the
+    last kit, completes the job. Returns (update, job_done); write it with version_filter().
+    """
+    total_kits = activity.get('total_kits_to_pack', 1)
+    new_index = cam_state(activity, cam_id)['kit_index'] + 1
+
+    sets = {
+        cam_field(cam_id, 'kit_index'): new_index,
+        cam_field(cam_id, 'kit_started_at'): history_entry.get('completed_at') or datetime.utcnow(),
+        cam_field(cam_id, 'errors'): [],
+        cam_field(cam_id, 'last_detected_index'): -1
+    }
+    unsets = {}
+    # Reset component counts ONLY if there are more kits to pack
+    if new_index <= total_kits:
+        for idx, part in enumerate(activity['components']):
+            if part.get('camera') == cam_id:
+                field_base = f"components.{idx}"
+                sets[f"{field_base}.found_quantity"] = 0
+                sets[f"{field_base}.status"] = "pending"
+                for name in ("sequence_order", "last_image_url", "captured_images",
+                             "resolution_reason", "resolution_type"):
+                    unsets[f"{field_base}.{name}"] = ""
+
+    # A camera is "done" if its index exceeds the total OR it has no parts assigned
+    def cam_done(cam):
+        index = new_index if cam == cam_id else cam_state(activity, cam)['kit_index']
+        return index > total_kits or not cam_parts(activity['components'], cam)
+    job_done = all(cam_done(cam) for cam in activity_cameras(activity))
+    if job_done:
+        sets["status"] = "completed_job"
+        sets["end_time"] = datetime.utcnow()
+
+    update = {"$set": sets, "$push": {"history": history_entry}}
+    if unsets:
+        update["$unset"] = unsets
+    return bump_version(update), job_done
+
+
+def apply_resolution(activity, cam_id, problems, reason):
+    """
+    Validation override: returns the $set fields flagging the overridden parts, and applies them
+    to the in-memory activity so the kit snapshot taken at completion includes them.
+    """
+    fields = {}
+    for idx, part in enumerate(activity.get('components', [])):
+        if part.get('camera') == cam_id and part.get('name') in problems:
+            part['resolution_reason'] = reason
+            part['resolution_type'] = "validation_override"
+            fields[f"components.{idx}.resolution_reason"] = reason
+            fields[f"components.{idx}.resolution_type"] = "validation_override"
+    return fields
+
+
+def detection_event(part_name, component, image_url, cam_id):
+    """ui_update payload for the green 'Detected' popup."""
+    return {
+        "type": "refresh_needed",
+        "popup_data": {
+            "part_name": part_name,
+            "found_qty": component.get('found_quantity', 0),
+            "required_qty": component.get('quantity', 1),
+            "imageUrl": image_url,
+            "camId": cam_id
+        }
+    }
+
+
+def detection_response(component, det):
+    return {
+        "message": "correct-part-detected",
+        "found": component.get('found_quantity', 0),
+        "part_name": det['detected_part'],
+        "cam_id": det['cam_id'],
+        "tracking_id": det['tracking_id'],
+        "avg_threshold": det['confidence']
+    }
+
+
+def capture_stats_inc(stored_bytes, saved_bytes):
+    """$inc fragment tracking an activity's capture disk usage (used by the quota)."""
+    return {
+        "capture_stats.files": 1,
+        "capture_stats.bytes_stored": stored_bytes,
+        "capture_stats.bytes_saved": saved_bytes
+    }
+
+
+# --- TABLE STATUS (GET /kitting/api/<table_id>/status, polled by the AI Station) ---
+STATUS_PROJECTION = {"cams": 1, "components.camera": 1}
+
+def table_status(activity):
+    """Status body for the table's on-going activity (None when the table is idle)."""
+    if not activity:
+        return {"status": "idle", "message": "No active job"}
+    if is_locked(activity):
+        return {
+            "status": "locked",
+            "message": "Red Screen Active - Waiting for operator resolution",
+            "errors": {cam: len(cam_state(activity, cam)['errors']) for cam in activity_cameras(activity)}
+        }
+    return {"status": "active", "message": "System ready"}
+
+
+# --- DETECTION FLOW (POST /kitting/api/<table_id>/detection, both server modes) ---
+# One generator takes every decision of a detection. It yields each call that does I/O and is
+# sent its result back:
+#     activity = yield io.db.activities.find_one(...)
+# run_sync() sends a pymongo result straight back; run_async() awaits Motor's coroutine first
+# (and throws its exception into the flow). `io` is the mode's adapter:
+#     db                                   pymongo or Motor database
+#     log                                  logger
+#     buffered                             True when records are written behind (app/detection_buffer.py)
+#     claim(key) / store(key, body, status) / release(key)     receipts (app/idempotency.py)
+#     capture(activity, cam_id, upload)    stores the image -> (image_url, stored_bytes, saved_bytes)
+#     feed(activity_id, table_id, kind)    activity feed event (app/activity_feed.py)
+#     event(activity, det, at, matched)    detection event (app/detection_events.py)
+#     emit(event, data, room)              socket emit to a table room
+#     buffer(activity_id, cam_id, kit_index, slot, record)     write-behind append
+#     writing(activity_id)                 context held from the state write until buffer() returns
+def run_sync(flow):
+    """Runs a flow whose calls already returned their results (pymongo)."""
+    result = None
+    try:
+        while True:
+            result = flow.send(result)
+    except StopIteration as done:
+        return done.value
+
+
+async def run_async(flow):
+    """Runs a flow whose calls return awaitables (Motor, async helpers)."""
+    result, error = None, None
+    while True:
+        try:
+            step = flow.throw(error) if error else flow.send(result)
+        except StopIteration as done:
+            return done.value
+        result, error = None, None
+        try:
+            result = (await step) if inspect.isawaitable(step) else step
+        except Exception as e:
+            error = e
+
+
+def retry_headers(status_code):
+    """Headers of a detection answer: 503s tell the AI Station when to retry."""
+    return {"Retry-After": str(RETRY_AFTER_SEC)} if status_code == 503 else {}
+
+
+def detection_flow(io, table_id, raw_payload, client_key, upload):
+    """
+    Decides one detection from the AI Station. Returns (body, status_code): 200 (OK),
+    409 (Wrong Part), 423 (Locked), 503 (Write Conflicts or original still in progress, retry)
+    or 500 (Server Error).
+    Retries of the same detection replay the first response without side effects.
+    `upload` is the image (None if the request has none).
+    """
+    db = io.db
+    receipt_key = None
+    written = None   # (body, status_code) once the detection's own state write has committed
+    try:
+        # [BLOCK 1] VALIDATION & STATE CHECKS: the job on-going on this table
+        activity = yield db.activities.find_one({"table_id": str(table_id), "status": "on-going"})
+        if not activity:
+            io.log.warning(f"Detection received for inactive Table {table_id}")
+            return {"message": "No active job"}, 404
+
+        # [BLOCK 2] DATA PARSING: the metadata comes as a JSON string in the 'payload' form field.
+        # Parsed before the lock check so a retried detection is recognised first.
+        data = json.loads(raw_payload) if raw_payload else {}
+        det = parse_detection(data)
+        cam_id = det['cam_id']
+        current_kit_num = cam_state(activity, cam_id)['kit_index']
+        total_kits = activity.get('total_kits_to_pack', 1)
+
+        # Idempotency: a timed-out AI request is retried with the same Tracking_id (or Idempotency-Key).
+        # The first request claims the key; replays get the stored response back.
+        receipt_key = build_detection_key(activity['_id'], cam_id, current_kit_num, det['tracking_id'],
+                                          client_key or data.get('idempotencyKey'))
+        if receipt_key:
+            claimed, replay = yield io.claim(receipt_key)
+            if not claimed:
+                io.log.info(f"Duplicate detection ignored on Table {table_id}: {receipt_key}")
+                metrics.incr("detection.duplicates")
+                return replay
+
+        def respond(body, status_code, state_changed=False):
+            """The response, recorded for retries only if state was written."""
+            if receipt_key:
+                yield io.store(receipt_key, body, status_code) if state_changed else io.release(receipt_key)
+            return body, status_code
+
+        # Global lock: while any camera has an unresolved error (Red Screen), reject new detections
+        if is_locked(activity):
+            return (yield from respond({"message": "System Locked", "code": "system_locked"}, 423))
+        if upload is None:
+            return (yield from respond({"message": "No image provided"}, 422))
+        # The job is already finished for this camera: ignore extra detections
+        if current_kit_num > total_kits:
+            return (yield from respond({"message": "camera-job-completed", "code": "done"}, 200))
+
+        # [BLOCK 3] FILE HANDLING (re-encoded if ingest compression is on)
+        image_url, stored_bytes, saved_bytes = yield io.capture(activity, cam_id, upload)
+        record = detection_record(image_url, det)
+        stats_inc = capture_stats_inc(stored_bytes, saved_bytes)
+        room = f"table_{table_id}"
+
+        # Blocks 4-6 decide from the activity we read and write conditionally on its version.
+        # If another request (other camera, punch, resolution) wrote first, re-read and decide again.
+        for attempt in range(Config.ACTIVITY_WRITE_RETRIES + 1):
+            if attempt:
+                metrics.incr("occ.detection.conflicts")
+                activity = yield db.activities.find_one({"_id": activity['_id'], "status": "on-going"})
+                if not activity:
+                    return (yield from respond({"message": "No active job"}, 404))
+                if is_locked(activity) or cam_state(activity, cam_id)['kit_index'] > total_kits:
+                    # State moved under us: keep the disk usage accounted, reject like a fresh request
+                    yield db.activities.update_one({"_id": activity['_id']}, bump_version({"$inc": stats_inc}))
+                    if is_locked(activity):
+                        return (yield from respond({"message": "System Locked", "code": "system_locked"}, 423))
+                    return (yield from respond({"message": "camera-job-completed", "code": "done"}, 200))
+
+            # [BLOCK 4] PART MATCHING ("Hungry Slot", then "Overcount Slot")
+            target_index, target_part = match_component(activity.get('components', []), cam_id, det['detected_part'])
+
+            # [BLOCK 5] WRONG PART: push the error to the camera, which locks the table (Red Screen)
+            if not target_part:
+                query, update = wrong_part_write(activity, cam_id, wrong_part_error(image_url, det), stats_inc)
+                if (yield db.activities.update_one(query, update)).matched_count == 0:
+                    continue
+                written = wrong_part_response(image_url, det), 409
+
+                metrics.observe("occ.detection.retries", attempt)
+                yield io.feed(activity['_id'], table_id, "wrong_part")
+                yield io.event(activity, det, record['timestamp'], False)
+                yield io.emit('ui_update', wrong_part_event(image_url, det), room)
+                io.log.info(f"Wrong Part Detected on Table {table_id}: {det['detected_part']}")
+                return (yield from respond(*written, state_changed=True))
+
+            # [BLOCK 6] CORRECT PART: increment, append the record and complete the slot if now full,
+            # in one write that returns the updated document. With write-behind on, the record itself
+            # is appended later by app/detection_buffer.py.
+            query, update = detection_write(activity, target_index, det, record, stats_inc, push_record=not io.buffered)
+            with io.writing(activity['_id']):   # A kit closing waits until the record is buffered
+                updated_activity = yield db.activities.find_one_and_update(query, update, return_document=True)
+                if updated_activity is None:
+                    continue
+                updated_component = updated_activity['components'][target_index]
+                written = detection_response(updated_component, det), 200
+                if io.buffered:
+                    yield io.buffer(activity['_id'], cam_id, cam_state(activity, cam_id)['kit_index'], target_index, record)
+
+            metrics.observe("occ.detection.retries", attempt)
+            yield io.feed(activity['_id'], table_id, "detection")
+            yield io.event(activity, det, record['timestamp'], True)
+            # Green "Detected" popup
+            yield io.emit('ui_update', detection_event(target_part.get('name'), updated_component, image_url, cam_id), room)
+            return (yield from respond(*written, state_changed=True))
+
+        # Every attempt lost a race: ask the AI to retry (same Tracking_id, so no double count)
+        metrics.incr("occ.detection.exhausted")
+        yield db.activities.update_one({"_id": activity['_id']}, bump_version({"$inc": stats_inc}))
+        io.log.warning(f"Detection on Table {table_id} gave up after {attempt + 1} conflicting writes")
+        return (yield from respond({"message": "Table busy, retry", "code": "write_conflict"}, 503))
+
+    # [BLOCK 7] EXCEPTION HANDLING
+    except Exception as e:
+        io.log.error(f"CRITICAL ERROR in detection API for Table {table_id}: {e}\n{traceback.format_exc()}")
+        # Before the state write: free the claim so the AI's retry is processed, not stuck "in progress".
+        # After it: the detection counted, so keep its answer for retries and send it now.
+        if receipt_key:
+            try:
+                yield io.store(receipt_key, *written) if written else io.release(receipt_key)
+            except Exception:
+                pass
+        if written:
+            return written
+        return {
+            "status": "error",
+            "message": "Internal Server Error processing detection",
+            "debug_error": str(e)
+        }, 500
+
+
+# --- IN-MEMORY STATE (table workers, app/table_workers.py) ---
+def _resolve_path(doc, path):
+    """(container, key) a dotted path ends in, creating missing sub-documents on the way."""
+    parts = path.split('.')
+    node = doc
+    for part in parts[:-1]:
+        node = node[int(part)] if isinstance(node, list) else node.setdefault(part, {})
+    return node, parts[-1]
+
+def apply_update(doc, update):
+    """Applies a $set / $unset / $inc / $push update to a document held in memory, like MongoDB would."""
+    for path, value in update.get("$set", {}).items():
+        node, key = _resolve_path(doc, path)
+        node[key] = value
+    for path in update.get("$unset", {}):
+        node, key = _resolve_path(doc, path)
+        node.pop(key, None)
+    for path, amount in update.get("$inc", {}).items():
+        node, key = _resolve_path(doc, path)
+        node[key] = node.get(key, 0) + amount
+    for path, value in update.get("$push", {}).items():
+        node, key = _resolve_path(doc, path)
+        node.setdefault(key, []).append(value)
+    return doc
@@ -0,0 +1,59 @@
+import threading
+import time
+
+
+# --- LIGHTWEIGHT IN-PROCESS METRICS ---
+class Metrics:
+    """
+    Thread-safe counters and value summaries (count / total / min / max).
+    Values are per worker process and reset on restart.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._summaries = {}
+        self.started_at = time.time()
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def observe(self, name, value):
+        with self._lock:
+            s = self._summaries.get(name)
+            if s is None:
+                self._summaries[name] = {"count": 1, "total": value, "min": value, "max": value}
+            else:
+                s["count"] += 1
+                s["total"] += value
+                if value < s["min"]: s["min"] = value
+                if value > s["max"]: s["max"] = value
+
+    def snapshot(self):
+        """Returns a JSON-friendly copy of all counters and summaries (with averages)."""
+        with self._lock:
+            summaries = {}
+            for name, s in self._summaries.items():
+                summaries[name] = dict(s, avg=round(s["total"] / s["count"], 3))
+            return {
+                "uptime_sec": round(time.time() - self.started_at, 1),
+                "counters": dict(self._counters),
+                "summaries": summaries
+            }
+
+
+metrics = Metrics()
+
+
+def payload_size(data):
+    """Approximate wire size of a socket payload in bytes (binary attachments counted raw)."""
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return len(data)
+    if isinstance(data, str):
+        return len(data.encode('utf-8'))
+    if isinstance(data, dict):
+        return sum(payload_size(k) + payload_size(v) for k, v in data.items())
+    if isinstance(data, (list, tuple)):
+        return sum(payload_size(v) for v in data)
+    return len(str(data))
@@ -0,0 +1,345 @@
+import io
+
+import pandas as pd
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, PageBreak
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.units import inch
+
+from app.config import Config
+from app.storage import get_storage, absolute_image_url
+from app.kitting_core import activity_cameras, sort_cameras
+from app import cold_store
+
+# Excel / PDF job reports. pandas (+ openpyxl) and ReportLab are slow to import and heavy in
+# memory, so this module is only imported by the download routes (app/blueprints/kitting.py),
+# on the first report a worker builds, never at worker start.
+
+# Image links point at the public server URL (falls back to localhost if the config is missing)
+VM_BASE_URL = Config.SOCKET_SERVER_URL or "http://localhost:5000"
+
+
+    
+# --- HELPER: CAMERAS COVERED BY A REPORT ---
+def report_cameras(activity_id, db):
+    """The job's cameras plus any camera that has history (e.g. parts moved between cameras)."""
+    activity = cold_store.find_activity(db, activity_id, {"cams": 1, "components.camera": 1})
+    cams = set(activity_cameras(activity)) if activity else set()
+    cams |= cold_store.history_cameras(db, activity_id)
+    return sort_cameras(cams) or ['cam1']
+
+# --- HELPER: Build the "Kit Header + Detection Table + Errors" structure ---
+def build_camera_data(activity_id, camera_key, db):
+    # 1. Fetch History (hot or cold storage)
+    history_cursor = cold_store.kit_history(db, activity_id, camera_key)
+    
+    # 2. Fetch Errors (Look for errors matching this camera)
+    error_cursor = cold_store.error_logs(db, activity_id, camera_key)
+
+    # 3. Organize Data
+    history_map = {h.get('kit_number'): h for h in history_cursor}
+    error_map = {}
+    for err in error_cursor:
+        k_num = err.get('kit_number')
+        if k_num:
+            if k_num not in error_map: error_map[k_num] = []
+            error_map[k_num].append(err)
+
+    all_kits = sorted(set(history_map.keys()) | set(error_map.keys()))
+    excel_rows = []
+
+    for k_num in all_kits:
+        hist = history_map.get(k_num, {})
+        errs = error_map.get(k_num, [])
+
+        # ==========================================
+        # SECTION 1: KIT HEADER
+        # ==========================================
+        start_time = hist.get('completed_at') or hist.get('timestamp') or "N/A"
+        if errs:
+            status = "⚠ Issues Found"
+            perf = f"Operator fixed {len(errs)} error(s)"
+        else:
+            status = "✅ Perfect"
+            perf = "First Pass Yield"
+
+        excel_rows.append({
+            "Col_A": f"KIT {k_num}",
+            "Col_B": f"Time: {start_time}",
+            "Col_C": f"Status: {status}",
+            "Col_D": f"Perf: {perf}"
+        })
+
+        # ==========================================
+        # SECTION 2: DETECTED OBJECTS TABLE
+        # ==========================================
+        excel_rows.append({
+            "Col_A": "TRACKING ID",
+            "Col_B": "OBJECT NAME",
+            "Col_C": "CONFIDENCE",
+            "Col_D": "IMAGE URL"
+        })
+
+        components = hist.get('components_snapshot', [])
+        found_any_detection = False
+
+        if components:
+            for part in components:
+                captures = part.get('captured_images', [])
+                if isinstance(captures, dict): captures = list(captures.values())
+
+                for cap in captures:
+                    found_any_detection = True
+                    t_id = cap.get('tracking_id', 'N/A')
+                    name = cap.get('ai_class_name') or part.get('name')
+                    conf = cap.get('confidence', 0)
+                    img = cap.get('image_url', '')
+
+                    excel_rows.append({
+                        "Col_A": str(t_id),
+                        "Col_B": name,
+                        "Col_C": f"{float(conf):.4f}",
+                        "Col_D": absolute_image_url(img, Config.REPORT_IMAGE_SIZE)
+                    })
+
+        if not found_any_detection:
+            excel_rows.append({"Col_A": "No Object Data Recorded", "Col_B": "", "Col_C": "", "Col_D": ""})
+
+        # Spacer before errors
+        excel_rows.append({}) 
+
+        # ==========================================
+        # SECTION 3: ERRORS & ANOMALIES (New)
+        # ==========================================
+        if errs:
+            # Header for Errors
+            excel_rows.append({
+                "Col_A": "ERROR TYPE",
+                "Col_B": "DETAILS / MISSING",
+                "Col_C": "RESOLUTION REASON",
+                "Col_D": "EVIDENCE IMAGE"
+            })
+
+            for err in errs:
+                # Extract details
+                e_type = err.get('error_type', 'Unknown')
+                reason = err.get('reason_selected', 'Pending')
+                timestamp = err.get('timestamp', '')
+                
+                # specific details based on error type
+                details_obj = err.get('error_details', {})
+                desc = ""
+                
+                if e_type == 'validation':
+                    missing = details_obj.get('missing', [])
+                    undercount = details_obj.get('undercount', [])
+                    desc_parts = []
+                    if missing: desc_parts.append(f"Missing: {','.join(missing)}")
+                    if undercount: desc_parts.append(f"Undercount: {','.join(undercount)}")
+                    desc = " | ".join(desc_parts) if desc_parts else "Validation Failed"
+                else:
+                    # Anomaly / Wrong Part
+                    detected = details_obj.get('detectedPart') or details_obj.get('AiDetectedPartName')
+                    msg = details_obj.get('message', 'Wrong Part')
+                    desc = f"{msg} (Detected: {detected})"
+
+                # Image (check nested or root)
+                e_img = details_obj.get('imageUrl') or err.get('imageUrl') or ""
+
+                excel_rows.append({
+                    "Col_A": e_type.upper(),
+                    "Col_B": desc,
+                    "Col_C": reason,
+                    "Col_D": absolute_image_url(e_img, Config.REPORT_IMAGE_SIZE)
+                })
+
+        # ==========================================
+        # SPACER BETWEEN KITS
+        # ==========================================
+        excel_rows.append({}) 
+        excel_rows.append({}) 
+
+    return excel_rows
+
+# --- EXCEL: ONE SHEET PER CAMERA ---
+def excel_report(activity_id, db):
+    """The job's Excel report as a BytesIO (one sheet per camera)."""
+    camera_data = [(cam, build_camera_data(activity_id, cam, db)) for cam in report_cameras(activity_id, db)]
+
+    output = io.BytesIO()
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+
+        # Helper to write sheet and format
+        def write_sheet(data, sheet_name):
+            df = pd.DataFrame(data)
+            if not df.empty:
+                df.to_excel(writer, index=False, header=False, sheet_name=sheet_name)
+                ws = writer.sheets[sheet_name]
+                ws.column_dimensions['A'].width = 20
+                ws.column_dimensions['B'].width = 40 # Wider for Object Name / Error Details
+                ws.column_dimensions['C'].width = 25 # Resolution
+                ws.column_dimensions['D'].width = 60 # Image URL
+            else:
+                pd.DataFrame(["No Data"]).to_excel(writer, sheet_name=sheet_name)
+
+        for cam, data in camera_data:
+            write_sheet(data, f"Camera {cam[3:]}")
+
+    output.seek(0)
+    return output
+
+
+# --- HELPER: Build PDF Content for One Camera ---
+def build_camera_pdf_section(activity_id, camera_key, db, styles):
+    elements = []
+    
+    # Header for Camera Section
+    elements.append(Paragraph(f"Report for {camera_key.upper()}", styles['Heading2']))
+    elements.append(Spacer(1, 12))
+
+    # Fetch Data
+    history_cursor = cold_store.kit_history(db, activity_id, camera_key)
+    history_map = {h.get('kit_number'): h for h in history_cursor}
+    
+    error_cursor = cold_store.error_logs(db, activity_id, camera_key)
+    error_map = {}
+    for err in error_cursor:
+        k_num = err.get('kit_number')
+        if k_num:
+            if k_num not in error_map: error_map[k_num] = []
+            error_map[k_num].append(err)
+
+    all_kits = sorted(set(history_map.keys()) | set(error_map.keys()))
+
+    if not all_kits:
+        elements.append(Paragraph("No data recorded for this camera.", styles['Normal']))
+        return elements
+
+    # --- LOOP KITS ---
+    for k_num in all_kits:
+        hist = history_map.get(k_num, {})
+        errs = error_map.get(k_num, [])
+
+        # 1. Kit Status Header
+        status = "Completed"
+        color = "green"
+        if errs: 
+            status = f"Issues Found (Fixed {len(errs)})"
+            color = "red"
+        
+        elements.append(Paragraph(f"<b>KIT {k_num}</b> - <font color='{color}'>{status}</font>", styles['Heading3']))
+        
+        timestamp = hist.get('completed_at') or hist.get('timestamp') or "N/A"
+        elements.append(Paragraph(f"Time: {timestamp}", styles['Normal']))
+        elements.append(Spacer(1, 6))
+
+        # 2. Detections Table (NOW WITH IMAGES)
+        # Columns: ID, Name, Conf, Image Link
+        data = [['Tracking ID', 'Object Name', 'Confidence', 'Image']]
+        
+        components = hist.get('components_snapshot', [])
+        found_detections = False
+
+        if components:
+            for part in components:
+                captures = part.get('captured_images', [])
+                if isinstance(captures, dict): captures = list(captures.values())
+                
+                for cap in captures:
+                    found_detections = True
+                    
+                    # Generate Link for Detection
+                    img_path = cap.get('image_url', '')
+                    link_text = "-"
+                    if img_path:
+                        full_url = absolute_image_url(img_path, Config.REPORT_IMAGE_SIZE)
+                        link_text = Paragraph(f'<a href="{full_url}" color="blue"><u>Open</u></a>', styles['Normal'])
+
+                    data.append([
+                        str(cap.get('tracking_id', '-')),
+                        cap.get('ai_class_name') or part.get('name', 'Unknown'),
+                        f"{float(cap.get('confidence', 0)):.2f}",
+                        link_text
+                    ])
+        
+        if found_detections:
+            t = Table(data, colWidths=[1.2*inch, 2.0*inch, 1.2*inch, 1.2*inch])
+            t.setStyle(TableStyle([
+                ('BACKGROUND', (0,0), (-1,0), colors.lightgrey),
+                ('GRID', (0,0), (-1,-1), 1, colors.black),
+                ('ALIGN', (0,0), (-1,-1), 'CENTER'),
+                ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
+                ('FONTSIZE', (0,0), (-1,-1), 10),
+            ]))
+            elements.append(t)
+        else:
+            elements.append(Paragraph("No detections recorded.", styles['Italic']))
+        
+        elements.append(Spacer(1, 6))
+
+        # 3. VALIDATION IMAGE (The Final Proof)
+        val_img = hist.get('validation_image_url')
+        if val_img:
+            val_url = absolute_image_url(val_img, Config.REPORT_IMAGE_SIZE)
+            elements.append(Paragraph(f'<b>Validation Proof:</b> <a href="{val_url}" color="blue"><u>Open Final Image</u></a>', styles['Normal']))
+            elements.append(Spacer(1, 6))
+
+        # 4. ERRORS & LINKS
+        if errs:
+            elements.append(Spacer(1, 4))
+            elements.append(Paragraph("<b>Errors & Anomalies:</b>", styles['Normal']))
+            
+            error_table_data = [['Type', 'Reason', 'Image Link']]
+            
+            for err in errs:
+                details = err.get('error_details', {})
+                img_path = details.get('imageUrl') or err.get('imageUrl') or ""
+                
+                link_text = "No Image"
+                if img_path:
+                    full_url = absolute_image_url(img_path, Config.REPORT_IMAGE_SIZE)
+                    link_text = Paragraph(f'<a href="{full_url}" color="blue"><u>Open Image</u></a>', styles['Normal'])
+                
+                error_table_data.append([
+                    err.get('error_type', 'Error'),
+                    err.get('reason_selected', 'Pending'),
+                    link_text
+                ])
+
+            et = Table(error_table_data, colWidths=[1.5*inch, 2*inch, 2*inch])
+            et.setStyle(TableStyle([
+                ('BACKGROUND', (0,0), (-1,0), colors.mistyrose),
+                ('GRID', (0,0), (-1,-1), 1, colors.red),
+                ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
+            ]))
+            elements.append(et)
+        
+        # Divider Line
+        elements.append(Spacer(1, 10))
+        elements.append(Paragraph("_" * 65, styles['Normal']))
+        elements.append(Spacer(1, 15))
+
+    return elements
+
+# --- PDF: ONE SECTION PER CAMERA ---
+def pdf_report(activity_id, db):
+    """The job's PDF report as a BytesIO (one section per camera)."""
+    output = io.BytesIO()
+    doc = SimpleDocTemplate(output, pagesize=A4)
+    styles = getSampleStyleSheet()
+    story = []
+
+    # Title
+    story.append(Paragraph(f"Kitting Report: {activity_id}", styles['Title']))
+    story.append(Paragraph(f"Image Source: {VM_BASE_URL} ({get_storage().name} storage)", styles['Normal']))
+    story.append(Spacer(1, 12))
+
+    # One section per camera
+    for i, cam in enumerate(report_cameras(activity_id, db)):
+        if i: story.append(PageBreak())
+        story.extend(build_camera_pdf_section(activity_id, cam, db, styles))
+
+    doc.build(story)
+    output.seek(0)
+    return output
@@ -0,0 +1,80 @@
+from datetime import datetime
+
+from app.config import Config
+
+# Production analytics rollups, updated with one $inc upsert per collection as events happen,
+# so the analytics API (app/blueprints/analytics.py) never scans kit_history or error_logs.
+#   rollup_table_hourly: {table_id, hour}  -> kits, first_pass, warnings, cycle_sec_*, errors_*
+#   rollup_kit_daily:    {kit_name, day}   -> the same counters plus part_errors.<part>
+# Hours and days are UTC; shifts are derived from the hourly rows at read time.
+
+COUNTERS = ("kits", "first_pass", "warnings", "cycle_sec_total", "cycle_count",
+            "errors_detection", "errors_validation")
+
+
+def hour_bucket(at):
+    return at.replace(minute=0, second=0, microsecond=0)
+
+def day_bucket(at):
+    return at.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def part_key(name):
+    """Part names as field names ('.' and a leading '$' are not allowed in MongoDB keys)."""
+    return str(name).replace('.', '．').lstrip('$') or '_'
+
+
+def _bump(db, activity, at, inc):
+    db.rollup_table_hourly.update_one(
+        {"table_id": str(activity.get('table_id')), "hour": hour_bucket(at)},
+        {"$inc": {k: v for k, v in inc.items() if not k.startswith("part_errors.")}},
+        upsert=True
+    )
+    db.rollup_kit_daily.update_one(
+        {"kit_name": activity.get('kit_name'), "day": day_bucket(at)},
+        {"$inc": inc},
+        upsert=True
+    )
+
+
+def record_kit(db, activity, completed_at, started_at, first_pass, warning):
+    """One finished kit (one camera). Cycle time runs from the camera's previous kit (or job start)."""
+    inc = {"kits": 1, "first_pass": int(first_pass), "warnings": int(bool(warning))}
+    if isinstance(started_at, datetime) and started_at <= completed_at:
+        inc["cycle_sec_total"] = round((completed_at - started_at).total_seconds(), 3)
+        inc["cycle_count"] = 1
+    _bump(db, activity, completed_at, inc)
+
+
+def record_error(db, activity, error_type, part_names, at):
+    """One resolved error: a wrong part ('detection') or missing/undercount parts ('validation')."""
+    inc = {f"errors_{'validation' if error_type == 'validation' else 'detection'}": 1}
+    for name in set(part_names):
+        if name:
+            inc[f"part_errors.{part_key(name)}"] = 1
+    _bump(db, activity, at, inc)
+
+
+# --- READ HELPERS (analytics API) ---
+def shift_of(utc_hour):
+    """Name of the shift an hour of the day (UTC) belongs to, from ANALYTICS_SHIFTS in plant local time."""
+    local = (utc_hour + Config.ANALYTICS_UTC_OFFSET_HOURS) % 24
+    for name, start, end in Config.ANALYTICS_SHIFTS:
+        if (start <= local < end) if start < end else (local >= start or local < end):
+            return name
+    return "unassigned"
+
+
+def sum_stage(group_id):
+    """$group stage summing every counter under the given _id expression."""
+    return {"$group": {"_id": group_id, **{k: {"$sum": f"${k}"} for k in COUNTERS}}}
+
+
+def with_rates(row):
+    """Adds first-pass yield, error rate and mean cycle time to a summed row."""
+    kits = row.get("kits", 0)
+    errors = row.get("errors_detection", 0) + row.get("errors_validation", 0)
+    row["first_pass_yield"] = round(row.get("first_pass", 0) / kits, 4) if kits else None
+    row["error_rate"] = round(errors / kits, 4) if kits else None
+    row["mean_cycle_sec"] = round(row["cycle_sec_total"] / row["cycle_count"], 1) if row.get("cycle_count") else None
+    return row
@@ -0,0 +1,57 @@
+import json
+from datetime import date, datetime
+
+from bson import ObjectId
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # Optional: the standard library encoder is used without it
+    orjson = None
+
+# One JSON encoder for HTTP responses (Flask's jsonify / tojson, the asyncio server) and socket
+# emits. MongoDB documents are encoded as they are, without being copied or modified first:
+#   ObjectId -> "65a1...", datetime -> "2024-01-31T08:00:00.123456" (isoformat)
+# orjson is used when installed (several times faster on large activities), else the json module.
+
+
+def default(value):
+    """Encoder hook for the BSON types that plain JSON lacks."""
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    # Datetimes go through default() too, so both encoders produce the same text
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+    def dumps_bytes(value):
+        return orjson.dumps(value, default=default, option=_ORJSON_OPTIONS)
+
+    def loads(data, **kwargs):
+        return orjson.loads(data)
+else:
+    _encoder = json.JSONEncoder(default=default, ensure_ascii=False, separators=(',', ':'))
+
+    def dumps_bytes(value):
+        return _encoder.encode(value).encode('utf-8')
+
+    def loads(data, **kwargs):
+        return json.loads(data)
+
+
+def dumps(value, **kwargs):
+    """JSON text of value. Formatting kwargs (indent, separators...) are accepted and ignored."""
+    return dumps_bytes(value).decode('utf-8')
+
+
+# --- FLASK INTEGRATION (app.json: used by jsonify, request.get_json and the tojson filter) ---
+class JSONProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        return dumps(obj)
+
+    def loads(self, s, **kwargs):
+        return loads(s)
@@ -1,9 +1,45 @@
 from flask_socketio import SocketIO, emit, join_room, leave_room
 from app.db import get_db
+from app.metrics import metrics, payload_size
+from app.config import Config
+from app import fleet
 from datetime import datetime
+import time
 
 socketio = SocketIO(cors_allowed_origins="*")
 
+# --- SERVER-SIDE BROADCASTS ---
+# HTTP handlers and background jobs emit through broadcast() so they work in both server modes:
+# Flask-SocketIO under eventlet (default) or the asyncio Socket.IO server (app/asgi.py),
+# which installs its own emitter with set_broadcaster().
+_broadcaster = None
+
+def set_broadcaster(fn):
+    global _broadcaster
+    _broadcaster = fn
+
+def _emit(event, data, to):
+    if _broadcaster is not None:
+        _broadcaster(event, data, to)
+    else:
+        socketio.emit(event, data, to=to)
+
+# Table events that change what the fleet overview shows
+FLEET_EVENTS = ('ui_update', 'new_kitting_started')
+
+def fleet_ping(event, data, to):
+    """Payload announcing a table change to the fleet room, or None if the event doesn't matter."""
+    if not (to and to.startswith("table_") and event in FLEET_EVENTS):
+        return None
+    return {"table_id": to[len("table_"):], "type": data.get('type', event) if isinstance(data, dict) else event}
+
+def broadcast(event, data, to=None):
+    """Emits an event to a room (or everyone) from outside a socket handler."""
+    _emit(event, data, to)
+    ping = fleet_ping(event, data, to)
+    if ping:
+        _emit('fleet_update', ping, fleet.FLEET_ROOM)
+
 @socketio.on('connect')
 def handle_connect():
     print("⚡ Client Connected")
@@ -23,6 +59,11 @@ def on_join(data):
     print(f"👥 Client joined room: {room}")
     emit('status_update', {'message': f'Joined {room}'}, to=room)
 
+@socketio.on('join_fleet')
+def on_join_fleet(data=None):
+    """Fleet overview page: one room announcing changes on every table."""
+    join_room(fleet.FLEET_ROOM)
+
 @socketio.on('ai_update')
 def handle_ai_update(data):
     """
@@ -97,36 +138,32 @@ def handle_ai_handshake(data):
     emit('ai_handshake_response', data, to=room)
     
     
-# Add these to app/socket_events.py
-
-# --- CAMERA 1 ---
-@socketio.on('capture_cam1_signal')
-def relay_cam1_capture(data):
+# --- CAMERA CAPTURE RELAYS ---
+# The AI may send the captured frame as raw bytes (e.g. {'tableId': '1', 'status': 'success',
+# 'image': <bytes>, 'mimeType': 'image/jpeg', 'sentAt': <epoch ms>}). Socket.IO ships bytes as
+# binary attachments, so the payload is relayed untouched: no base64/JSON re-encoding here.
+def relay_cam_event(event, data, include_self=True):
+    """Forwards a camera event to the table room and records payload size and relay latency."""
+    started = time.perf_counter()
     room = f"table_{data.get('tableId')}"
-    emit('capture_cam1_signal', data, to=room, include_self=False)
+    emit(event, data, to=room, include_self=include_self)
 
-@socketio.on('sending_cam1_ack')
-def relay_cam1_ack(data):
-    room = f"table_{data.get('tableId')}"
-    emit('sending_cam1_ack', data, to=room)
+    metrics.incr(f"relay.{event}.count")
+    metrics.observe(f"relay.{event}.bytes", payload_size(data))
+    metrics.observe(f"relay.{event}.emit_ms", (time.perf_counter() - started) * 1000)
 
-@socketio.on('cam1_result')
-def relay_cam1_result(data):
-    room = f"table_{data.get('tableId')}"
-    emit('cam1_result', data, to=room)
+    # AI -> server transit time, when the AI stamps its send time
+    sent_at = data.get('sentAt')
+    if isinstance(sent_at, (int, float)):
+        metrics.observe(f"relay.{event}.transit_ms", max(time.time() * 1000 - sent_at, 0))
 
-# --- CAMERA 2 ---
-@socketio.on('capture_cam2_signal')
-def relay_cam2_capture(data):
-    room = f"table_{data.get('tableId')}"
-    emit('capture_cam2_signal', data, to=room, include_self=False)
+# --- CAMERAS 1..MAX_CAMERAS ---
+def register_cam_relays(cam):
+    """capture_<cam>_signal (UI -> AI), sending_<cam>_ack and <cam>_result (AI -> UI)."""
+    socketio.on_event(f'capture_{cam}_signal',
+                      lambda data: relay_cam_event(f'capture_{cam}_signal', data, include_self=False))
+    socketio.on_event(f'sending_{cam}_ack', lambda data: relay_cam_event(f'sending_{cam}_ack', data))
+    socketio.on_event(f'{cam}_result', lambda data: relay_cam_event(f'{cam}_result', data))
 
-@socketio.on('sending_cam2_ack')
-def relay_cam2_ack(data):
-    room = f"table_{data.get('tableId')}"
-    emit('sending_cam2_ack', data, to=room)
-
-@socketio.on('cam2_result')
-def relay_cam2_result(data):
-    room = f"table_{data.get('tableId')}"
-    emit('cam2_result', data, to=room)
\ No newline at end of file
+for _n in range(1, Config.MAX_CAMERAS + 1):
+    register_cam_relays(f"cam{_n}")
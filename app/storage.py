@@ -0,0 +1,260 @@
+import mimetypes
+import os
+import shutil
+import threading
+import uuid
+from urllib.parse import quote
+
+from flask import Response, send_from_directory, redirect
+from werkzeug.utils import secure_filename
+
+from app.config import Config
+
+# Every capture is addressed by a storage "key" (e.g. '<activity_id>/cam1/3f9c...e1_frame_0042.jpg', see new_capture_key)
+# and served to browsers at CAPTURE_URL_PREFIX + key (see kitting.get_image).
+CAPTURE_URL_PREFIX = "/kitting/captures/"
+
+
+def new_capture_key(folder, filename):
+    """
+    Key for a new upload: '<folder>/<random hex>_<filename>'. A key is never written twice, so the
+    bytes behind it (and its _derived/ copies) never change and are served immutable.
+    """
+    return f"{folder}/{uuid.uuid4().hex}_{secure_filename(filename or '') or 'capture.jpg'}"
+
+
+def key_from_url(image_url):
+    """Returns the storage key for a '/kitting/captures/...' URL, or None for other URLs."""
+    if image_url and image_url.startswith(CAPTURE_URL_PREFIX):
+        return image_url[len(CAPTURE_URL_PREFIX):].split('?', 1)[0]
+    return None
+
+
+def app_base_url():
+    """Base URL used to build absolute links (reports, external consumers)."""
+    return (Config.SOCKET_SERVER_URL or "http://localhost:5000").rstrip('/')
+
+
+# --- LOCAL DISK BACKEND ---
+class LocalStorage:
+    """Stores captures under UPLOAD_FOLDER on this node's disk."""
+    name = "local"
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.root, key)
+
+    def save(self, key, stream, content_type="image/jpeg"):
+        """Writes a file-like object (or bytes) to `key`. Returns the stored size in bytes."""
+        dest = self.path(key)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+
+        # Write to a temp file first so readers never see a half-written image
+        tmp = f"{dest}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, 'wb') as f:
+            if isinstance(stream, (bytes, bytearray)):
+                f.write(stream)
+            else:
+                shutil.copyfileobj(stream, f, 1024 * 1024)
+        os.replace(tmp, dest)
+        return os.path.getsize(dest)
+
+    def read(self, key):
+        with open(self.path(key), 'rb') as f:
+            return f.read()
+
+    def read_range(self, key, offset, length):
+        with open(self.path(key), 'rb') as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def exists(self, key):
+        return os.path.isfile(self.path(key))
+
+    def size(self, key):
+        return os.path.getsize(self.path(key))
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def send(self, key):
+        """
+        Flask response for GET /kitting/captures/<key> (caller has checked the key exists).
+        Conditional (ETag / If-None-Match -> 304) and Range requests are answered by Werkzeug.
+        With CAPTURE_ACCEL_REDIRECT_PREFIX set, nginx streams the file instead of Python.
+        """
+        accel_prefix = Config.CAPTURE_ACCEL_REDIRECT_PREFIX
+        if accel_prefix:
+            resp = Response(mimetype=mimetypes.guess_type(key)[0] or 'application/octet-stream')
+            resp.headers['X-Accel-Redirect'] = f"{accel_prefix.rstrip('/')}/{quote(key)}"
+            return resp
+        # USE_X_SENDFILE (Flask config) makes this emit X-Sendfile for Apache/lighttpd
+        return send_from_directory(self.root, key, conditional=True, etag=True)
+
+    def public_url(self, key):
+        return f"{app_base_url()}{CAPTURE_URL_PREFIX}{key}"
+
+
+# --- S3-COMPATIBLE BACKEND ---
+class S3Storage:
+    """
+    Stores captures in an S3-compatible bucket (AWS S3, MinIO, ...).
+    One boto3 client per process keeps HTTP connections pooled; large objects are
+    uploaded as parallel multipart uploads via boto3's TransferManager.
+    For local testing point S3_ENDPOINT_URL at a MinIO container (http://localhost:9000).
+    """
+    name = "s3"
+
+    def __init__(self, bucket, region, endpoint_url=None, prefix=""):
+        # Optional dependency: only needed when USE_S3 is on
+        import boto3
+        from boto3.s3.transfer import TransferConfig
+        from botocore.config import Config as BotoConfig
+
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client(
+            "s3",
+            region_name=region,
+            endpoint_url=endpoint_url or None,
+            aws_access_key_id=Config.S3_ACCESS_KEY or None,
+            aws_secret_access_key=Config.S3_SECRET_KEY or None,
+            config=BotoConfig(
+                max_pool_connections=Config.S3_MAX_POOL_CONNECTIONS,
+                retries={"max_attempts": 3, "mode": "standard"},
+                # Path-style addressing is what local stand-ins (MinIO) expect
+                s3={"addressing_style": "path" if endpoint_url else "auto"}
+            )
+        )
+        self.transfer_config = TransferConfig(
+            multipart_threshold=Config.S3_MULTIPART_THRESHOLD_MB * 1024 * 1024,
+            multipart_chunksize=Config.S3_MULTIPART_CHUNK_MB * 1024 * 1024,
+            max_concurrency=Config.S3_MAX_CONCURRENCY,
+            use_threads=True
+        )
+
+    def _obj(self, key):
+        return f"{self.prefix}{key}"
+
+    def save(self, key, stream, content_type="image/jpeg"):
+        import io
+        if isinstance(stream, (bytes, bytearray)):
+            stream = io.BytesIO(stream)
+        counter = _ByteCounter(stream)
+        self.client.upload_fileobj(
+            counter, self.bucket, self._obj(key),
+            ExtraArgs={"ContentType": content_type},
+            Config=self.transfer_config
+        )
+        return counter.count
+
+    def _get(self, key, **kwargs):
+        """get_object body; a missing key raises FileNotFoundError like the local backend."""
+        from botocore.exceptions import ClientError
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self._obj(key), **kwargs)["Body"].read()
+        except ClientError as e:
+            if _is_missing(e):
+                raise FileNotFoundError(key) from e
+            raise
+
+    def read(self, key):
+        return self._get(key)
+
+    def read_range(self, key, offset, length):
+        return self._get(key, Range=f"bytes={offset}-{offset + length - 1}")
+
+    def exists(self, key):
+        """False only when the object is missing; denied access or a server error still raises."""
+        from botocore.exceptions import ClientError
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._obj(key))
+            return True
+        except ClientError as e:
+            if _is_missing(e):
+                return False
+            raise
+
+    def size(self, key):
+        return self.client.head_object(Bucket=self.bucket, Key=self._obj(key))["ContentLength"]
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self._obj(key))
+
+    def send(self, key):
+        """Redirects the browser to a short-lived signed URL so bytes skip the web node."""
+        return redirect(self.signed_url(key), code=302)
+
+    def signed_url(self, key, expires=None):
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": self._obj(key)},
+            ExpiresIn=expires or Config.S3_SIGNED_URL_TTL_SEC
+        )
+
+    def public_url(self, key):
+        # A public bucket / CDN in front of it gives permanent links; otherwise go through
+        # the app, which redirects to a fresh signed URL on every click.
+        if Config.S3_PUBLIC_BASE_URL:
+            return f"{Config.S3_PUBLIC_BASE_URL.rstrip('/')}/{self._obj(key)}"
+        return f"{app_base_url()}{CAPTURE_URL_PREFIX}{key}"
+
+
+def _is_missing(error):
+    """True for a botocore ClientError meaning 'no such object' (HEAD only gets a bare 404)."""
+    return error.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound")
+
+
+class _ByteCounter:
+    """File wrapper counting bytes read, so S3 uploads can report their size."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.count = 0
+
+    def read(self, size=-1):
+        chunk = self.stream.read(size)
+        self.count += len(chunk)
+        return chunk
+
+
+# --- BACKEND SELECTION ---
+_storage = None
+_storage_lock = threading.Lock()
+
+def get_storage():
+    """Returns the process-wide storage backend selected by Config.USE_S3."""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                if Config.USE_S3:
+                    _storage = S3Storage(
+                        Config.S3_BUCKET, Config.S3_REGION,
+                        endpoint_url=Config.S3_ENDPOINT_URL,
+                        prefix=Config.S3_KEY_PREFIX
+                    )
+                else:
+                    _storage = LocalStorage(Config.UPLOAD_FOLDER)
+    return _storage
+
+
+def absolute_image_url(image_url, size=None):
+    """
+    Absolute link for an image_url stored in the DB, valid for the active backend.
+    Sized links (thumb/preview) always go through the app, which builds them on first use.
+    """
+    if not image_url:
+        return ""
+    key = key_from_url(image_url)
+    if key is None:
+        return f"{app_base_url()}{image_url}"
+    if size:
+        return f"{app_base_url()}{CAPTURE_URL_PREFIX}{key}?size={size}"
+    return get_storage().public_url(key)
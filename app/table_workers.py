@@ -0,0 +1,597 @@
+"""
+Table-affinity workers (optional mode, TABLE_WORKERS > 0).
+
+- Every table is owned by one worker process: crc32(table_id) % TABLE_WORKERS.
+- The owner holds the on-going activity of its tables (counters, lock state, detection
+  receipts) in memory and applies their detections one at a time, so the detection path
+  does no MongoDB read and never loses an optimistic-concurrency race.
+- Every change is appended to the worker's write-ahead log before the reply, then persisted
+  by a background thread as the same version-conditional update the web process would make.
+  Replaying the log after a crash is therefore idempotent.
+- Web processes stay stateless: they ask the owner to screen the detection (retry, locked, job
+  done), store the capture only if it passed, forward the detection, broadcast the socket
+  events the worker hands back and reply. Routes that change a table outside the hot
+  path (punch, resolution, start/finish) run inside released(table_id): the owner flushes
+  the table, forgets it, and holds its next detections until the route is done. The route
+  renews its lease meanwhile; a lease only runs out if its web process is gone.
+- A logged write that MongoDB rejects (the activity was changed behind the owner's back) is
+  not acknowledged: the owner reloads the table and writes the same outcome again on the fresh
+  state, since the AI Station already has the answer.
+
+Workers are started by the web process (python -m app.table_workers --index N), which respawns
+them if they exit, and listen on 127.0.0.1:TABLE_WORKER_BASE_PORT + N. Messages are
+newline-delimited extended JSON.
+"""
+import argparse
+import contextlib
+import os
+import queue
+import socket
+import subprocess
+import sys
+import threading
+import time
+import traceback
+import zlib
+from datetime import datetime
+
+from bson import json_util
+from pymongo import MongoClient
+
+from app.config import Config
+from app.idempotency import STATE_DONE, build_detection_key
+from app.kitting_core import (
+    is_locked, cam_state, match_component, wrong_part_error, wrong_part_event,
+    wrong_part_response, wrong_part_write, detection_write, detection_event, detection_response,
+    version_filter, bump_version, apply_update, table_status
+)
+from app.metrics import Metrics
+from app import activity_feed, detection_events
+
+
+# Canonical extended JSON keeps ints as ints; naive UTC datetimes like the rest of the app
+JSON_OPTIONS = json_util.CANONICAL_JSON_OPTIONS.with_options(tz_aware=False)
+
+def _dumps(obj):
+    return json_util.dumps(obj, json_options=JSON_OPTIONS).encode() + b"\n"
+
+def _loads(line):
+    return json_util.loads(line, json_options=JSON_OPTIONS)
+
+
+def enabled():
+    return Config.TABLE_WORKERS > 0
+
+def owner(table_id):
+    """Index of the worker owning a table (stable across processes and restarts)."""
+    return zlib.crc32(str(table_id).encode()) % Config.TABLE_WORKERS
+
+def worker_address(index):
+    return ("127.0.0.1", Config.TABLE_WORKER_BASE_PORT + index)
+
+
+# --- HELPER: ONE CONNECTION TO A WORKER ---
+class Channel:
+    """Newline-delimited extended JSON over a socket (datetimes and ObjectIds survive the trip)."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.reader = sock.makefile('rb')
+
+    def send(self, message):
+        self.sock.sendall(_dumps(message))
+
+    def recv(self):
+        line = self.reader.readline()
+        if not line:
+            raise EOFError("connection closed")
+        return _loads(line)
+
+    def close(self):
+        with contextlib.suppress(OSError):
+            self.reader.close()
+            self.sock.close()
+
+
+# =========================================================================
+# WEB PROCESS SIDE
+# =========================================================================
+_idle = {}                 # worker index -> idle Channels
+_idle_lock = threading.Lock()
+_procs = []
+
+def call_worker(index, message):
+    """Sends one request to a worker and waits for its reply (connections are pooled)."""
+    with _idle_lock:
+        channels = _idle.setdefault(index, [])
+        channel = channels.pop() if channels else None
+    if channel is None:
+        channel = Channel(socket.create_connection(worker_address(index), timeout=Config.TABLE_WORKER_TIMEOUT_SEC))
+        channel.send({"op": "hello", "token": Config.SECRET_KEY})
+    try:
+        channel.send(message)
+        reply = channel.recv()
+    except Exception:
+        channel.close()
+        raise
+    with _idle_lock:
+        _idle[index].append(channel)
+    return reply
+
+def call(table_id, op, **payload):
+    """Request to the worker owning table_id. Returns {"body", "status", "events"}."""
+    return call_worker(owner(table_id), {"op": op, "table_id": str(table_id), **payload})
+
+class WorkerUnavailable(OSError):
+    """The owner could not hand a table back (its logged writes are not in MongoDB yet)."""
+
+
+@contextlib.contextmanager
+def released(table_id):
+    """
+    Hands a table back to MongoDB for the duration of the block: its owner persists what it
+    holds, drops it and queues the table's detections until the block exits. The lease is
+    renewed while the block runs, so it only ends early if this process stops renewing it.
+    """
+    if not enabled() or not table_id:
+        yield
+        return
+    reply = call(table_id, "release")
+    if reply['status'] != 200:
+        raise WorkerUnavailable(reply['body'].get('message'))
+    done = threading.Event()
+
+    def renew():
+        while not done.wait(Config.TABLE_WORKER_LEASE_SEC / 3):
+            with contextlib.suppress(OSError, EOFError):
+                call(table_id, "renew")
+
+    threading.Thread(target=renew, daemon=True).start()
+    try:
+        yield
+    finally:
+        done.set()
+        call(table_id, "resume")
+
+def worker_stats():
+    stats = []
+    for index in range(Config.TABLE_WORKERS):
+        try:
+            stats.append(call_worker(index, {"op": "stats"})['body'])
+        except (OSError, EOFError) as e:
+            stats.append({"worker": index, "error": str(e)})
+    return stats
+
+def _spawn(index):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return subprocess.Popen([sys.executable, "-m", "app.table_workers", "--index", str(index)], cwd=root)
+
+def _listening(index):
+    try:
+        socket.create_connection(worker_address(index), timeout=1).close()
+        return True
+    except OSError:
+        return False
+
+def start(app):
+    """
+    Starts the table workers once and respawns any that exits. A worker exits at once (code 0)
+    when another web process already runs it (port taken): it is only respawned once that port is free.
+    """
+    if _procs:
+        return
+    for index in range(Config.TABLE_WORKERS):
+        _procs.append(_spawn(index))
+    app.logger.info(f"Started {len(_procs)} table workers on ports {Config.TABLE_WORKER_BASE_PORT}+")
+
+    import atexit
+    atexit.register(lambda: [p.terminate() for p in _procs])
+
+    from app.socket_events import socketio
+
+    def supervise():
+        while True:
+            socketio.sleep(Config.TABLE_WORKER_SUPERVISE_SEC)
+            for index, proc in enumerate(_procs):
+                if proc.poll() is None or (proc.returncode == 0 and _listening(index)):
+                    continue
+                if proc.returncode != 0:
+                    app.logger.error(f"Table worker {index} exited with code {proc.returncode}, restarting")
+                try:
+                    _procs[index] = _spawn(index)
+                except OSError as e:
+                    app.logger.error(f"Table worker {index} restart failed: {e}")
+
+    socketio.start_background_task(supervise)
+
+
+# =========================================================================
+# WORKER PROCESS SIDE
+# =========================================================================
+def _reply(body, status=200, events=None, discard=False):
+    """discard: the capture sent with the detection is not kept, the web process deletes it."""
+    return {"body": body, "status": status, "events": events or [], "discard": discard}
+
+
+# --- HELPER: WRITE-AHEAD LOG ---
+class WriteAheadLog:
+    """
+    Append-only file of pending writes, one extended-JSON line each. An entry is on disk before
+    the detection is answered; the file is emptied whenever every entry has reached MongoDB.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._file = open(path, 'ab')
+        self._lock = threading.Lock()
+        # Sequence numbers carry on after the entries a previous run left
+        self.seq = max((entry.get('seq', 0) for entry in self.pending()), default=0)
+
+    def pending(self):
+        """Entries left over by a previous run, in write order."""
+        with open(self.path, 'rb') as f:
+            return [_loads(line) for line in f if line.strip()]
+
+    def append(self, entry, then=None):
+        with self._lock:
+            self.seq += 1
+            entry['seq'] = self.seq
+            self._file.write(_dumps(entry))
+            self._file.flush()
+            if Config.TABLE_WORKER_WAL_FSYNC:
+                os.fsync(self._file.fileno())
+            if then:
+                then(entry)
+
+    def truncate_if(self, condition):
+        with self._lock:
+            if condition():
+                self._file.truncate(0)
+
+    def drop_through(self, seq):
+        """Removes the entries up to seq (already in MongoDB); later ones are kept, in order."""
+        with self._lock:
+            keep = [entry for entry in self.pending() if entry.get('seq', 0) > seq]
+            if not keep:
+                self._file.truncate(0)
+                return
+            # Rewritten aside and swapped in, so a crash leaves either the old or the new file
+            tmp = f"{self.path}.tmp"
+            with open(tmp, 'wb') as f:
+                f.writelines(_dumps(entry) for entry in keep)
+                f.flush()
+                if Config.TABLE_WORKER_WAL_FSYNC:
+                    os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+            self._file.close()
+            self._file = open(self.path, 'ab')
+
+
+class TableWorker:
+    def __init__(self, index):
+        self.index = index
+        self.db = MongoClient(Config.MONGO_URI, serverSelectionTimeoutMS=5000)[Config.DB_NAME]
+        self.metrics = Metrics()
+        self.tables = {}       # table_id -> {"activity": doc, "receipts": {key: (body, status)}, "since": log seq}
+        self.paused = {}       # table_id -> [release count, lease deadline]
+        self.deferred = {}     # table_id -> [(channel, message)] waiting for resume
+        self.inbox = queue.Queue()
+        self.outbox = queue.Queue()
+        self.wal = WriteAheadLog(os.path.join(Config.TABLE_WORKER_WAL_DIR, f"table-worker-{index}.wal"))
+
+    # --- PERSISTENCE ---
+    def persist(self, entry):
+        """
+        Writes one log entry to MongoDB. Entries already applied (replay) match nothing and are skipped.
+        A write lost to a concurrent change stores no receipt: its detection is decided again (redo).
+        """
+        if entry.get('filter'):
+            if self.db.activities.update_one(entry['filter'], entry['update']).matched_count == 0:
+                if not self._already_applied(entry['filter']):
+                    # Someone wrote the activity behind the owner's back: reload it and decide again
+                    self.metrics.incr("table_worker.persist_conflicts")
+                    print(f"⚠️ Table worker {self.index}: write for table {entry['table_id']} lost, writing it again")
+                    self.inbox.put((None, {"op": "redo", "seq": entry.get('seq', 0), "activity_id": entry['filter']['_id'],
+                                           **{k: entry.get(k) for k in ("table_id", "detection", "kind", "receipt", "event")}}))
+                    return
+            else:
+                if entry.get('kind'):
+                    activity_feed.record(self.db, entry['filter']['_id'], entry['table_id'], entry['kind'])
+                if entry.get('event') and Config.DETECTION_EVENTS_ENABLED:
+                    try:
+                        self.db[detection_events.COLLECTION].insert_one(entry['event'])
+                    except Exception as e:   # Best-effort, like detection_events.record
+                        print(f"⚠️ Table worker {self.index}: detection event not recorded: {e}")
+        receipt = entry.get('receipt')
+        if receipt:
+            self.db.detection_receipts.update_one(
+                {"_id": receipt['key']},
+                {"$set": {"state": STATE_DONE, "body": receipt['body'], "status_code": receipt['status']},
+                 "$setOnInsert": {"created_at": datetime.utcnow()}},
+                upsert=True
+            )
+
+    def _already_applied(self, query):
+        doc = self.db.activities.find_one({"_id": query['_id']}, {"version": 1})
+        if doc is None or 'version' not in doc:
+            return False
+        expected = query['version']
+        return isinstance(expected, dict) or doc['version'] > expected   # {"$exists": False} = pre-versioning
+
+    def persist_retrying(self, entry):
+        while True:
+            try:
+                return self.persist(entry)
+            except Exception as e:
+                # MongoDB unreachable: keep the order, the entry is safe in the log
+                print(f"❌ Table worker {self.index} persist error: {e}")
+                time.sleep(1)
+
+    def run_persister(self):
+        while True:
+            entry = self.outbox.get()
+            started = time.perf_counter()
+            self.persist_retrying(entry)
+            self.metrics.observe("table_worker.persist_ms", (time.perf_counter() - started) * 1000)
+            self.outbox.task_done()
+            self.wal.truncate_if(lambda: self.outbox.unfinished_tasks == 0)
+
+    def write(self, table_id, query, update, receipt=None, event=None, kind=None, detection=None):
+        """
+        Applies an update to the held activity, logs it, and queues it for MongoDB.
+        kind: activity feed event recorded once it is persisted (None for bookkeeping writes).
+        detection: the message the write decides (with the slot matched), redone if MongoDB rejects the write.
+        """
+        apply_update(self.tables[table_id]['activity'], update)
+        entry = {"table_id": table_id, "filter": query, "update": update}
+        if detection:
+            entry['detection'] = detection
+        if event:
+            entry['event'] = event
+        if kind:
+            entry['kind'] = kind
+        if receipt and receipt['key']:
+            self.tables[table_id]['receipts'][receipt['key']] = (receipt['body'], receipt['status'])
+            entry['receipt'] = receipt
+        self.wal.append(entry, then=self.outbox.put)
+
+    # --- TABLE STATE ---
+    def hold(self, table_id):
+        """The table's on-going activity, loaded on first use. None when the table is idle."""
+        held = self.tables.get(table_id)
+        if held is None:
+            activity = self.db.activities.find_one({"table_id": table_id, "status": "on-going"})
+            if activity is None:
+                return None
+            # Receipts of this job, so retries are answered from memory
+            receipts = {r['_id']: (r.get('body', {}), r.get('status_code', 200))
+                        for r in self.db.detection_receipts.find(
+                            {"_id": {"$regex": f"^{activity['_id']}:"}, "state": STATE_DONE})}
+            held = self.tables[table_id] = {"activity": activity, "receipts": receipts, "since": self.wal.seq}
+            self.metrics.incr("table_worker.loads")
+        return held
+
+    # --- OPERATIONS ---
+    def _screen(self, held, msg):
+        """
+        Decisions that need no capture: (receipt_key, reply) with the reply of a retry, a locked
+        table or a camera past the job, else (receipt_key, None).
+        """
+        activity, det = held['activity'], msg['det']
+        current_kit_num = cam_state(activity, det['cam_id'])['kit_index']
+        receipt_key = build_detection_key(activity['_id'], det['cam_id'], current_kit_num, det['tracking_id'], msg.get('client_key'))
+        if receipt_key in held['receipts']:
+            self.metrics.incr("detection.duplicates")
+            return receipt_key, _reply(*held['receipts'][receipt_key])
+        if is_locked(activity):
+            return receipt_key, _reply({"message": "System Locked", "code": "system_locked"}, 423)
+        if current_kit_num > activity.get('total_kits_to_pack', 1):
+            return receipt_key, _reply({"message": "camera-job-completed", "code": "done"}, 200)
+        return receipt_key, None
+
+    def screen(self, msg):
+        """Asked before the web process stores the capture: the final answer, or {"proceed": True}."""
+        held = self.hold(msg['table_id'])
+        if held is None:
+            return _reply({"message": "No active job"}, 404)
+        return self._screen(held, msg)[1] or _reply({"proceed": True})
+
+    def detection(self, msg):
+        """Same decisions as kitting_core.detection_flow, taken on the held activity."""
+        table_id = msg['table_id']
+        held = self.hold(table_id)
+        if held is None:
+            return _reply({"message": "No active job"}, 404, discard=True)
+        activity = held['activity']
+        det, record, image_url, stats_inc = msg['det'], msg['record'], msg['image_url'], msg['stats_inc']
+        cam_id = det['cam_id']
+
+        # Screened already, but a concurrent retry or a lock may have come in since: the capture is dropped
+        receipt_key, reply = self._screen(held, msg)
+        if reply:
+            return {**reply, "discard": True}
+
+        room = f"table_{table_id}"
+        target_index, target_part = match_component(activity.get('components', []), cam_id, det['detected_part'])
+        if not target_part:
+            query, update = wrong_part_write(activity, cam_id, wrong_part_error(image_url, det), stats_inc)
+            body, status = wrong_part_response(image_url, det), 409
+            self.write(table_id, query, update, {"key": receipt_key, "body": body, "status": status},
+                       detection_events.event_doc(activity, det, record['timestamp'], matched=False), "wrong_part", msg)
+            return _reply(body, status, [('ui_update', wrong_part_event(image_url, det), room)])
+
+        query, update = detection_write(activity, target_index, det, record, stats_inc)
+        component = activity['components'][target_index]
+        body = detection_response({**component, "found_quantity": component.get('found_quantity', 0) + 1}, det)
+        self.write(table_id, query, update, {"key": receipt_key, "body": body, "status": 200},
+                   detection_events.event_doc(activity, det, record['timestamp'], matched=True), "detection",
+                   {**msg, "target_index": target_index})
+        return _reply(body, 200, [('ui_update', detection_event(target_part.get('name'), component, image_url, cam_id), room)])
+
+    def redo(self, msg):
+        """
+        A logged write MongoDB rejected. If it was decided on the held state, that state is stale
+        (so are the writes after it, redone in turn): reload it. The AI Station already has its
+        answer, so the same outcome (slot or wrong part) is written again on the fresh state, with
+        the receipt of that answer. Its socket events are lost.
+        """
+        table_id = msg['table_id']
+        held = self.tables.get(table_id)
+        if held and msg['seq'] > held['since']:
+            self.tables.pop(table_id)
+        detection = msg.get('detection')
+        held = self.hold(table_id)
+        if not detection or held is None or held['activity']['_id'] != msg['activity_id']:
+            print(f"⚠️ Table worker {self.index}: lost write for table {table_id} dropped, its job is over")
+            return None
+        activity = held['activity']
+        det, record, image_url, stats_inc = detection['det'], detection['record'], detection['image_url'], detection['stats_inc']
+        if msg['kind'] == "wrong_part":
+            query, update = wrong_part_write(activity, det['cam_id'], wrong_part_error(image_url, det), stats_inc)
+        elif msg['kind'] == "detection":
+            query, update = detection_write(activity, detection['target_index'], det, record, stats_inc)
+        else:   # Logged by earlier versions for locked tables: only the capture's disk usage
+            query, update = version_filter(activity), bump_version({"$inc": dict(stats_inc)})
+        self.write(table_id, query, update, msg['receipt'], msg.get('event'), msg['kind'], detection)
+        self.metrics.incr("table_worker.redone")
+        return None
+
+    def status(self, msg):
+        """Same answer as kitting.check_table_status."""
+        held = self.hold(msg['table_id'])
+        return _reply(table_status(held['activity'] if held else None))
+
+    def release(self, msg):
+        table_id = msg['table_id']
+        lease = self.paused.setdefault(table_id, [0, 0])
+        lease[0] += 1
+        lease[1] = time.monotonic() + Config.TABLE_WORKER_LEASE_SEC
+        # Everything this worker logged is in MongoDB before the route reads it. If MongoDB is
+        # down, give up after a while instead of stalling every other table of this worker.
+        with self.outbox.all_tasks_done:
+            persisted = self.outbox.all_tasks_done.wait_for(lambda: not self.outbox.unfinished_tasks,
+                                                            Config.TABLE_WORKER_RELEASE_TIMEOUT_SEC)
+        if not persisted:
+            self.metrics.incr("table_worker.release_timeouts")
+            self.resume(msg)
+            return _reply({"message": "Table worker cannot reach the database", "code": "worker_unavailable"}, 503)
+        self.tables.pop(table_id, None)
+        return _reply({"message": "released"})
+
+    def renew(self, msg):
+        lease = self.paused.get(msg['table_id'])
+        if lease:
+            lease[1] = time.monotonic() + Config.TABLE_WORKER_LEASE_SEC
+        return _reply({"message": "renewed"})
+
+    def resume(self, msg):
+        table_id = msg['table_id']
+        lease = self.paused.get(table_id)
+        if lease:
+            lease[0] -= 1
+            if lease[0] <= 0:
+                self._unpause(table_id)
+        return _reply({"message": "resumed"})
+
+    def _unpause(self, table_id):
+        self.paused.pop(table_id, None)
+        for channel, msg in self.deferred.pop(table_id, []):
+            self.answer(channel, msg)
+
+    def stats(self, msg):
+        return _reply({
+            "worker": self.index,
+            "tables": sorted(self.tables),
+            "paused": sorted(self.paused),
+            "wal_pending": self.outbox.unfinished_tasks,
+            **self.metrics.snapshot()
+        })
+
+    OPERATIONS = {"screen": screen, "detection": detection, "redo": redo, "status": status, "release": release, "renew": renew,
+                  "resume": resume, "stats": stats}
+
+    def answer(self, channel, msg):
+        started = time.perf_counter()
+        op = msg.get('op')
+        try:
+            reply = self.OPERATIONS[op](self, msg)
+        except Exception as e:
+            print(f"❌ Table worker {self.index} error in {op}: {e}\n{traceback.format_exc()}")
+            self.tables.pop(msg.get('table_id'), None)   # Reload from MongoDB next time
+            reply = _reply({"message": "Internal Server Error in table worker", "debug_error": str(e)}, 500)
+        self.metrics.observe(f"table_worker.{op}_ms", (time.perf_counter() - started) * 1000)
+        if channel is None:   # Internal message (redo): nobody waits for the answer
+            return
+        with contextlib.suppress(OSError):
+            channel.send(reply)
+
+    # --- SERVING ---
+    def read_channel(self, sock):
+        channel = Channel(sock)
+        try:
+            hello = channel.recv()
+            if hello.get('op') != "hello" or hello.get('token') != Config.SECRET_KEY:
+                return
+            while True:
+                self.inbox.put((channel, channel.recv()))
+        except (EOFError, OSError, ValueError):
+            pass
+        finally:
+            channel.close()
+
+    def accept(self, server):
+        while True:
+            sock, _ = server.accept()
+            threading.Thread(target=self.read_channel, args=(sock,), daemon=True).start()
+
+    def serve(self):
+        try:
+            server = socket.create_server(worker_address(self.index))
+        except OSError:
+            # Another web process already runs this worker
+            print(f"ℹ️ Table worker {self.index} already running, exiting")
+            return
+
+        # Finish what the previous run logged but did not persist (waits for MongoDB if it is down)
+        leftover = self.wal.pending()
+        for entry in leftover:
+            self.persist_retrying(entry)
+        self.wal.truncate_if(lambda: True)
+        if leftover:
+            print(f"🔁 Table worker {self.index} replayed {len(leftover)} logged writes")
+
+        threading.Thread(target=self.run_persister, daemon=True).start()
+        threading.Thread(target=self.accept, args=(server,), daemon=True).start()
+        print(f"🧵 Table worker {self.index} listening on {worker_address(self.index)}")
+
+        # One thread applies everything, so each table's detections run strictly in order
+        while True:
+            try:
+                channel, msg = self.inbox.get(timeout=0.5)
+            except queue.Empty:
+                channel = msg = None
+
+            now = time.monotonic()
+            for table_id, (_, deadline) in list(self.paused.items()):
+                if deadline < now:
+                    print(f"⚠️ Table worker {self.index}: release lease on table {table_id} expired (route gone)")
+                    self._unpause(table_id)
+
+            if msg is None:
+                continue
+            if msg.get('op') in ("screen", "detection", "status", "redo") and msg['table_id'] in self.paused:
+                self.deferred.setdefault(msg['table_id'], []).append((channel, msg))
+                continue
+            self.answer(channel, msg)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Table-affinity worker process")
+    parser.add_argument("--index", type=int, required=True)
+    args = parser.parse_args()
+    TableWorker(args.index).serve()
+
+
+if __name__ == "__main__":
+    main()
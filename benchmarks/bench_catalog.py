@@ -0,0 +1,105 @@
+"""
+Throughput benchmark for the bulk kit catalog import / export (app/kit_import.py).
+
+Generates a BOM file with --parts rows (default 100k, --parts-per-kit per kit), then times:
+  * validate only  (dry run: streaming parse + validation, no writes)
+  * import         (validation + batched bulk_write upserts into db.kits)
+  * re-import      (same file again: every kit is an update)
+  * export         (streaming CSV of the whole catalog)
+
+    python benchmarks/bench_catalog.py --parts 100000 --parts-per-kit 25
+    python benchmarks/bench_catalog.py --format xlsx
+
+Runs against MongoDB directly, no web server needed (--mongo-uri / --db default to the config).
+Requires pymongo (and openpyxl for --format xlsx); the generated kits are removed at the end.
+"""
+import argparse
+import csv
+import io
+import os
+import sys
+import time
+
+from pymongo import MongoClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.config import Config  # noqa: E402
+from app import kit_import  # noqa: E402
+from app.kit_catalog import bump_version  # noqa: E402
+
+KIT_PREFIX = "BENCH-KIT-"
+
+
+def build_file(parts, parts_per_kit, fmt):
+    rows = [list(kit_import.COLUMNS)]
+    for n in range(parts):
+        kit = n // parts_per_kit
+        rows.append([f"{KIT_PREFIX}{kit:06d}", f"EDP-{kit:06d}", f"PART-{n % parts_per_kit:03d}",
+                     1 + n % 3, f"cam{1 + n % 2}", "x", "", "x" if n % 5 == 0 else ""])
+
+    if fmt == "xlsx":
+        from openpyxl import Workbook
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet()
+        for row in rows:
+            sheet.append(row)
+        out = io.BytesIO()
+        workbook.save(out)
+        return out.getvalue(), "bench.xlsx"
+
+    text = io.StringIO()
+    csv.writer(text).writerows(rows)
+    return text.getvalue().encode('utf-8'), "bench.csv"
+
+
+def timed(label, rows, fn):
+    started = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - started
+    print(f"{label:<14} {rows:>9} rows  {elapsed:8.2f}s  {rows / elapsed:>10.0f} rows/s")
+    return result
+
+
+def cleanup(db):
+    db.kits.delete_many({"kit_name": {"$regex": f"^{KIT_PREFIX}"}})
+    bump_version(db)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--parts", type=int, default=100000)
+    parser.add_argument("--parts-per-kit", type=int, default=25)
+    parser.add_argument("--format", choices=("csv", "xlsx"), default="csv")
+    parser.add_argument("--mongo-uri", default=Config.MONGO_URI)
+    parser.add_argument("--db", default=Config.DB_NAME)
+    args = parser.parse_args()
+
+    db = MongoClient(args.mongo_uri)[args.db]
+    db.kits.create_index("kit_name")
+    cleanup(db)
+
+    data, filename = build_file(args.parts, args.parts_per_kit, args.format)
+    print(f"{filename}: {args.parts} parts in {-(-args.parts // args.parts_per_kit)} kits, "
+          f"{len(data) / 1e6:.1f} MB, batch {Config.KIT_IMPORT_BATCH} kits\n")
+
+    def run_import(dry_run):
+        return kit_import.import_rows(db, kit_import.read_rows(io.BytesIO(data), filename), dry_run)
+
+    try:
+        report = timed("validate only", args.parts, lambda: run_import(True))
+        if report.error_count:
+            print(f"  unexpected row errors: {report.errors[:5]}")
+        report = timed("import", args.parts, lambda: run_import(False))
+        print(f"  {report.upserted} kits inserted")
+        report = timed("re-import", args.parts, lambda: run_import(False))
+        print(f"  {report.modified} kits updated")
+
+        total = sum(len(k.get('parts') or []) for k in db.kits.find({}, {"parts.name": 1}))
+        size = timed("export", total, lambda: sum(len(chunk) for chunk in kit_import.export_csv(db)))
+        print(f"  {size / 1e6:.1f} MB of CSV (whole catalog)")
+    finally:
+        cleanup(db)
+
+
+if __name__ == "__main__":
+    main()
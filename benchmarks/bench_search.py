@@ -0,0 +1,66 @@
+"""
+Typeahead benchmark for the kit search index (app/kit_catalog.SearchIndex).
+
+Builds --kits synthetic kits (default 50k) of --parts-per-kit parts each, with varied part
+numbers like real BOMs ('P4711-22 Bolt M8'), then times:
+  * build            SearchIndex over the whole catalog (what a process does after a catalog change)
+  * each query       median / max over --runs of index.search(query), first page of 20
+
+    python benchmarks/bench_search.py --kits 50000 --parts-per-kit 25
+    python benchmarks/bench_search.py --query p4 --query "bolt m"
+
+Needs only the app's Python dependencies; no database or server. The target is a few ms per
+query at 50k kits, including one- and two-character prefixes.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.config import Config  # noqa: E402
+from app.kit_catalog import SearchIndex  # noqa: E402
+
+QUERIES = ["b", "p", "p1", "p4", "p47", "bolt", "bolt m", "kit-00", "edp-01", "washer zinc", "p4711-2", "zz"]
+WORDS = ["bolt", "nut", "washer", "screw", "bracket", "spacer", "clip", "zinc", "steel", "m6", "m8", "m10"]
+
+
+def build_kits(count, parts_per_kit, seed=1):
+    rnd = random.Random(seed)
+    return [{
+        "_id": n,
+        "kit_name": f"KIT-{n:06d} {rnd.choice(WORDS).title()} set",
+        "edp_number": f"EDP-{rnd.randrange(10 ** 6):06d}",
+        "parts": [{"name": f"P{rnd.randrange(10 ** 5)}-{rnd.randrange(100):02d} {rnd.choice(WORDS)} {rnd.choice(WORDS)}"}
+                  for _ in range(parts_per_kit)]
+    } for n in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--kits", type=int, default=50000)
+    parser.add_argument("--parts-per-kit", type=int, default=25)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--query", action="append", help="query to time (repeatable, default: a mixed set)")
+    args = parser.parse_args()
+
+    kits = build_kits(args.kits, args.parts_per_kit)
+    started = time.perf_counter()
+    index = SearchIndex(kits)
+    print(f"{args.kits} kits x {args.parts_per_kit} parts: {len(index.tokens)} words, "
+          f"{len(index.prefix_masks)} prefix masks, built in {time.perf_counter() - started:.2f}s\n")
+
+    for query in args.query or QUERIES:
+        samples, total = [], 0
+        for _ in range(args.runs):
+            started = time.perf_counter()
+            _, total = index.search(query, Config.KIT_SEARCH_MIN_CHARS, 0, 20)
+            samples.append(time.perf_counter() - started)
+        print(f"{query!r:<16} median {statistics.median(samples) * 1000:7.2f} ms  "
+              f"max {max(samples) * 1000:7.2f} ms  {total:>6} kits")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Encoding benchmark for app/serializer.py against the serialization paths it replaced.
+
+Builds a synthetic activity of about --size-mb MB (components with captured_images records,
+per-camera errors, ObjectIds and datetimes everywhere), then times encoding it to JSON with:
+  * json_util round trip  json.loads(json_util.dumps(doc)) + json.dumps   (old table_status)
+  * json_safe copy        recursive copy converting BSON types + json.dumps (old paginated APIs)
+  * serializer / json     app.serializer with the standard library encoder
+  * serializer / orjson   app.serializer with orjson (only if orjson is installed)
+
+    python benchmarks/bench_serializer.py --size-mb 5 --runs 10
+
+Needs only the app's Python dependencies (bson from pymongo); no database or server.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId, json_util
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app import serializer  # noqa: E402
+
+
+def build_activity(size_mb):
+    """An activity document of roughly size_mb MB once encoded."""
+    now = datetime.utcnow()
+    components, n = [], 0
+    activity = {"_id": ObjectId(), "table_id": "1", "kit_name": "BENCH-KIT", "status": "on-going",
+                "start_time": now, "version": 42, "components": components,
+                "cams": {f"cam{c}": {"kit_index": 3, "errors": [{
+                    "_id": ObjectId(), "activity_id": ObjectId(), "error_type": "detection", "timestamp": now,
+                    "error_details": {"message": "wrong_part_detected", "imageUrl": f"cam{c}_images/e{i}.jpg"}
+                } for i in range(20)]} for c in (1, 2)}}
+    while len(json_util.dumps(components[-1:])) * len(components) < size_mb * 1e6:
+        components.append({
+            "_id": ObjectId(), "name": f"PART-{n:04d}", "camera": f"cam{1 + n % 2}", "quantity": 4,
+            "found_quantity": 2, "status": "pending",
+            "captured_images": [{
+                "image_url": f"cam{1 + n % 2}_images/{ObjectId()}.jpg", "timestamp": now + timedelta(seconds=i),
+                "ai_class_name": f"part_{n % 50}", "confidence": 0.9123, "tracking_id": i, "cam_id": f"cam{1 + n % 2}"
+            } for i in range(40)]
+        })
+        n += 1
+    return activity
+
+
+def json_safe(value):
+    """The recursive converter the paginated kitting APIs used before app/serializer.py."""
+    if isinstance(value, dict): return {k: json_safe(v) for k, v in value.items()}
+    if isinstance(value, list): return [json_safe(v) for v in value]
+    if isinstance(value, ObjectId): return str(value)
+    if isinstance(value, datetime): return value.isoformat()
+    return value
+
+
+def timed(label, runs, fn):
+    size = len(fn())
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    median = statistics.median(samples)
+    print(f"{label:<22} median {median * 1000:8.1f} ms  min {min(samples) * 1000:8.1f} ms  "
+          f"{size / 1e6 / median:7.1f} MB/s  ({size / 1e6:.2f} MB out)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=float, default=5)
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    activity = build_activity(args.size_mb)
+    print(f"activity: {len(activity['components'])} components, "
+          f"{len(json_util.dumps(activity)) / 1e6:.1f} MB as extended JSON, {args.runs} runs\n")
+
+    timed("json_util round trip", args.runs, lambda: json.dumps(json.loads(json_util.dumps(activity))))
+    timed("json_safe copy", args.runs, lambda: json.dumps(json_safe(activity)))
+    timed("serializer / json", args.runs,
+          lambda: json.dumps(activity, default=serializer.default, ensure_ascii=False, separators=(',', ':')))
+    if serializer.orjson is not None:
+        timed("serializer / orjson", args.runs, lambda: serializer.dumps_bytes(activity))
+    else:
+        print("serializer / orjson    skipped (pip install orjson)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Cold-start benchmark for a web worker: import time and resident memory of create_app().
+
+Every run is a fresh interpreter (like a worker being spawned) that imports the app, builds it
+and reports wall time plus peak RSS. Scenarios:
+  * worker   create_app() only (what every worker and check_db.py pay)
+  * reports  create_app() + app.reports, i.e. a worker after its first Excel/PDF download
+
+    python benchmarks/bench_startup.py --runs 10
+    python benchmarks/bench_startup.py --importtime 15     # slowest modules of one worker start
+
+Background jobs (archiver, cold storage, table workers) are disabled in the child processes,
+and no MongoDB connection is made: get_db() is lazy.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ("pandas", "openpyxl", "reportlab", "numpy")
+
+CHILD = """
+import json, resource, sys, time
+started = time.perf_counter()
+from app import create_app
+create_app()
+if {reports}:
+    import app.reports
+elapsed = time.perf_counter() - started
+print(json.dumps({{
+    "seconds": elapsed,
+    "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "modules": len(sys.modules),
+    "heavy": [m for m in {heavy!r} if m in sys.modules]
+}}))
+"""
+
+
+def child_env():
+    env = dict(os.environ, CAPTURE_ARCHIVE_ENABLED="false", CAPTURE_QUOTA_MB_PER_TABLE="0",
+               COLD_ARCHIVE_ENABLED="false", TABLE_WORKERS="0")
+    env["PYTHONPATH"] = os.pathsep.join(p for p in (ROOT, env.get("PYTHONPATH")) if p)
+    return env
+
+
+def run_once(reports):
+    code = CHILD.format(reports=reports, heavy=HEAVY_MODULES)
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=child_env(),
+                         capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def scenario(label, reports, runs):
+    results = [run_once(reports) for _ in range(runs)]
+    seconds = sorted(r["seconds"] for r in results)
+    rss = [r["rss_mb"] for r in results]
+    print(f"{label:<8} median {statistics.median(seconds) * 1000:7.0f} ms  "
+          f"min {seconds[0] * 1000:7.0f} ms  max {seconds[-1] * 1000:7.0f} ms  "
+          f"rss {statistics.median(rss):6.1f} MB  modules {results[-1]['modules']:>5}  "
+          f"heavy: {', '.join(results[-1]['heavy']) or '-'}")
+
+
+def import_profile(top):
+    """Slowest imports (cumulative) of one worker start, from python -X importtime."""
+    code = "from app import create_app; create_app()"
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=ROOT, env=child_env(),
+                         capture_output=True, text=True, check=True)
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        rows.append((int(cumulative), name))
+    print(f"\nslowest imports (cumulative, top {top}):")
+    for micros, name in sorted(rows, reverse=True)[:top]:
+        print(f"  {micros / 1000:8.1f} ms  {name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--importtime", type=int, default=0, metavar="TOP",
+                        help="also list the TOP slowest imports of one worker start")
+    args = parser.parse_args()
+
+    print(f"{args.runs} fresh interpreter(s) per scenario ({sys.executable})\n")
+    scenario("worker", False, args.runs)
+    scenario("reports", True, args.runs)
+    if args.importtime:
+        import_profile(args.importtime)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Load test for the detection API with many active tables.
+
+Seeds N on-going activities (tables 'bench-1'..'bench-N'), then every table posts detections
+in sequence while all tables run concurrently, like a floor full of AI boxes.
+Reports throughput and p50/p95/p99 latency per target, so both serving modes can be compared:
+
+    python run_web.py     # eventlet mode, then:
+    python benchmarks/bench_tables.py --target eventlet=http://localhost:5000
+    python run_asgi.py    # asyncio mode, then:
+    python benchmarks/bench_tables.py --target asyncio=http://localhost:5000
+
+Two servers on different ports can be compared in one run by passing --target twice.
+Table worker mode scales with cores across tables; compare e.g. TABLE_WORKERS=1 against
+TABLE_WORKERS=<cores> on the same server mode, and DETECTION_WRITE_BEHIND=true against the
+default (flush timings are in /kitting/api/metrics under detection_buffer.*).
+Requires aiohttp and pymongo; the seeded data is removed at the end.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+import uuid
+
+import aiohttp
+from pymongo import MongoClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.config import Config  # noqa: E402
+
+TABLE_PREFIX = "bench-"
+PART_NAME = "BENCH-PART"
+# Smallest payload the API will accept as an image; ingest/derivatives are best left off
+FAKE_IMAGE = b"\xff\xd8\xff\xe0" + b"\x00" * 2048 + b"\xff\xd9"
+
+
+def seed(db, tables, detections):
+    cleanup(db)
+    docs = []
+    for n in range(1, tables + 1):
+        docs.append({
+            "table_id": f"{TABLE_PREFIX}{n}",
+            "kit_name": "BENCH-KIT",
+            "status": "on-going",
+            "total_kits_to_pack": 1,
+            "cams": {"cam1": {"kit_index": 1, "errors": [], "last_detected_index": -1}},
+            # Quantity above the detection count, so no request trips kit completion
+            "components": [{"name": PART_NAME, "camera": "cam1", "quantity": detections + 1,
+                            "found_quantity": 0, "status": "pending", "captured_images": []}],
+            "history": [],
+            "bench": True
+        })
+    db.activities.insert_many(docs)
+
+
+def cleanup(db):
+    db.activities.delete_many({"bench": True})
+    db.detection_receipts.delete_many({"_id": {"$regex": "bench"}})
+
+
+async def run_table(session, base_url, table_id, detections, latencies, errors):
+    url = f"{base_url}/kitting/api/{table_id}/detection"
+    for _ in range(detections):
+        form = aiohttp.FormData()
+        form.add_field("payload", json.dumps({
+            "camId": "cam1",
+            "detectedPart": PART_NAME,
+            "AiDetectedPartName": PART_NAME,
+            "avgThreshold": 0.9,
+            "Tracking_id": f"bench-{uuid.uuid4().hex}"
+        }))
+        form.add_field("image", FAKE_IMAGE, filename=f"{table_id}_{uuid.uuid4().hex}.jpg",
+                       content_type="image/jpeg")
+        started = time.perf_counter()
+        try:
+            async with session.post(url, data=form) as resp:
+                await resp.read()
+                if resp.status != 200:
+                    errors.append(resp.status)
+        except aiohttp.ClientError as e:
+            errors.append(str(e))
+        latencies.append((time.perf_counter() - started) * 1000)
+
+
+async def run_target(base_url, tables, detections):
+    latencies, errors = [], []
+    connector = aiohttp.TCPConnector(limit=tables)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            run_table(session, base_url.rstrip('/'), f"{TABLE_PREFIX}{n}", detections, latencies, errors)
+            for n in range(1, tables + 1)
+        ))
+        elapsed = time.perf_counter() - started
+    return latencies, errors, elapsed
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", action="append", required=True,
+                        help="label=base_url of a running server (repeatable)")
+    parser.add_argument("--tables", type=int, default=50)
+    parser.add_argument("--detections", type=int, default=40, help="detections per table")
+    parser.add_argument("--mongo-uri", default=Config.MONGO_URI)
+    parser.add_argument("--db", default=Config.DB_NAME)
+    args = parser.parse_args()
+
+    db = MongoClient(args.mongo_uri)[args.db]
+    results = []
+    try:
+        for target in args.target:
+            label, _, base_url = target.partition("=")
+            seed(db, args.tables, args.detections)
+            latencies, errors, elapsed = asyncio.run(run_target(base_url, args.tables, args.detections))
+            results.append((label, len(latencies), len(errors), len(latencies) / elapsed,
+                            statistics.median(latencies), percentile(latencies, 95), percentile(latencies, 99)))
+    finally:
+        cleanup(db)
+
+    print(f"\n{'target':<12}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for label, count, errs, rps, p50, p95, p99 in results:
+        print(f"{label:<12}{count:>10}{errs:>8}{rps:>10.1f}{p50:>10.1f}{p95:>10.1f}{p99:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,14 @@
+import os
+# asyncio mode: Socket.IO is served by app/asgi.py, so the Flask-SocketIO instance used by the
+# mounted Flask app must not try to run eventlet
+os.environ.setdefault("SOCKETIO_ASYNC_MODE", "threading")
+
+import uvicorn
+
+from app.asgi import create_asgi_app
+
+app = create_asgi_app()
+
+if __name__ == "__main__":
+    print("🚀 Starting Kitting Station Hub (asyncio mode)...")
+    uvicorn.run(app, host='0.0.0.0', port=5000, log_level="warning")
@@ -0,0 +1,137 @@
+"""Detection receipts: claim, replay, stale takeover and release (app/idempotency.py)."""
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip("flask_socketio")   # importing anything from app runs app/__init__.py
+pytest.importorskip("pymongo")
+
+from pymongo.errors import DuplicateKeyError  # noqa: E402
+
+from app import idempotency  # noqa: E402
+from app.config import Config  # noqa: E402
+from app.idempotency import (  # noqa: E402
+    IN_PROGRESS, STATE_DONE, STATE_PENDING, ReceiptCache, build_detection_key,
+    claim_detection, release_detection, store_detection_response
+)
+
+
+class FakeReceipts:
+    """The few detection_receipts calls idempotency.py makes, on a dict keyed by _id."""
+
+    def __init__(self):
+        self.docs = {}
+
+    def _matches(self, doc, query):
+        for field, expected in query.items():
+            if isinstance(expected, dict) and "$lt" in expected:
+                if not doc.get(field) < expected["$lt"]:
+                    return False
+            elif doc.get(field) != expected:
+                return False
+        return True
+
+    def insert_one(self, doc):
+        if doc["_id"] in self.docs:
+            raise DuplicateKeyError("E11000 duplicate key")
+        self.docs[doc["_id"]] = dict(doc)
+
+    def find_one(self, query):
+        doc = self.docs.get(query["_id"])
+        return dict(doc) if doc and self._matches(doc, query) else None
+
+    def find_one_and_update(self, query, update):
+        doc = self.find_one(query)
+        if doc:
+            self.docs[query["_id"]].update(update["$set"])
+        return doc
+
+    def update_one(self, query, update):
+        if self.find_one(query):
+            self.docs[query["_id"]].update(update["$set"])
+
+    def delete_one(self, query):
+        if self.find_one(query):
+            del self.docs[query["_id"]]
+
+
+class FakeDB:
+    def __init__(self):
+        self.detection_receipts = FakeReceipts()
+
+
+@pytest.fixture
+def db(monkeypatch):
+    # Every test starts with an empty in-memory LRU, so MongoDB answers are exercised
+    monkeypatch.setattr(idempotency, "receipt_cache", ReceiptCache(16))
+    return FakeDB()
+
+
+def test_build_detection_key():
+    assert build_detection_key("a1", "cam1", 3, 7) == "a1:cam1:3:7"
+    assert build_detection_key("a1", "cam1", 3, 7, client_key="k") == "a1:key:k"
+    assert build_detection_key("a1", "cam1", 3, None) is None
+    assert build_detection_key("a1", "cam1", 3, "") is None
+    assert build_detection_key("a1", "cam1", 3, 0) == "a1:cam1:3:0"
+
+
+def test_first_claim_wins_retry_waits(db):
+    assert claim_detection(db, "k") == (True, None)
+    assert claim_detection(db, "k") == (False, IN_PROGRESS)
+    assert db.detection_receipts.docs["k"]["state"] == STATE_PENDING
+
+
+def test_replay_returns_the_stored_response(db):
+    claim_detection(db, "k")
+    store_detection_response(db, "k", {"status": "ok", "found": 1}, 200)
+    assert claim_detection(db, "k") == (False, ({"status": "ok", "found": 1}, 200))
+    assert db.detection_receipts.docs["k"]["state"] == STATE_DONE
+
+
+def test_replay_from_mongodb_after_the_cache_lost_it(db, monkeypatch):
+    claim_detection(db, "k")
+    store_detection_response(db, "k", {"message": "wrong part"}, 409)
+    monkeypatch.setattr(idempotency, "receipt_cache", ReceiptCache(16))   # Another process
+    assert claim_detection(db, "k") == (False, ({"message": "wrong part"}, 409))
+    assert idempotency.receipt_cache.get("k") == ({"message": "wrong part"}, 409)
+
+
+def test_stale_claim_is_taken_over(db):
+    claim_detection(db, "k")
+    db.detection_receipts.docs["k"]["created_at"] = (
+        datetime.utcnow() - timedelta(seconds=Config.DETECTION_CLAIM_STALE_SEC + 1))
+    assert claim_detection(db, "k") == (True, None)
+    # The takeover refreshed the claim: the next retry waits again
+    assert claim_detection(db, "k") == (False, IN_PROGRESS)
+
+
+def test_finished_receipt_is_never_taken_over(db, monkeypatch):
+    claim_detection(db, "k")
+    store_detection_response(db, "k", {"status": "ok"}, 200)
+    db.detection_receipts.docs["k"]["created_at"] = datetime.utcnow() - timedelta(days=1)
+    monkeypatch.setattr(idempotency, "receipt_cache", ReceiptCache(16))
+    assert claim_detection(db, "k") == (False, ({"status": "ok"}, 200))
+
+
+def test_release_lets_a_retry_in(db):
+    claim_detection(db, "k")
+    release_detection(db, "k")
+    assert "k" not in db.detection_receipts.docs
+    assert claim_detection(db, "k") == (True, None)
+
+
+def test_release_keeps_a_finished_receipt(db):
+    claim_detection(db, "k")
+    store_detection_response(db, "k", {"status": "ok"}, 200)
+    release_detection(db, "k")
+    assert db.detection_receipts.docs["k"]["state"] == STATE_DONE
+
+
+def test_receipt_cache_is_bounded_lru():
+    cache = ReceiptCache(2)
+    cache.put("a", {}, 200)
+    cache.put("b", {}, 200)
+    cache.get("a")             # b is now the least recently used
+    cache.put("c", {}, 200)
+    assert cache.get("b") is None
+    assert cache.get("a") == ({}, 200) and cache.get("c") == ({}, 200)
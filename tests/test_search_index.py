@@ -0,0 +1,77 @@
+"""Kit search paging and prefix masks (app/kit_catalog.SearchIndex)."""
+import pytest
+
+pytest.importorskip("flask_socketio")   # importing anything from app runs app/__init__.py
+
+from app import kit_catalog  # noqa: E402
+from app.kit_catalog import SearchIndex  # noqa: E402
+
+MIN_CHARS = 2
+
+
+def kits():
+    catalog = [{"_id": n, "kit_name": f"Kit {n:03d}", "edp_number": f"EDP-{n:03d}",
+                "parts": [{"name": f"Bolt M{n % 5 + 6}"}, {"name": f"Washer {n % 3}"}]} for n in range(120)]
+    catalog += [{"_id": 1000 + n, "kit_name": f"Bolt set {n}", "edp_number": f"B{n}",
+                 "parts": [{"name": "Nut"}]} for n in range(15)]
+    return catalog
+
+
+def names(index, numbers):
+    return [index.kits[n]["kit_name"] for n in numbers]
+
+
+def all_pages(index, query, size):
+    found, offset = [], 0
+    while True:
+        page, total = index.search(query, MIN_CHARS, offset, size)
+        found += page
+        offset += size
+        if offset >= total:
+            return found, total
+
+
+def test_name_prefix_matches_come_first():
+    index = SearchIndex(kits())
+    numbers, total = index.search("bolt", MIN_CHARS, 0, 200)
+    assert total == 135 and len(numbers) == 135
+    assert all(name.startswith("Bolt set") for name in names(index, numbers[:15]))
+    assert all(name.startswith("Kit") for name in names(index, numbers[15:]))
+    assert names(index, numbers[15:]) == sorted(names(index, numbers[15:]))
+
+
+@pytest.mark.parametrize("size", [1, 7, 15, 20, 200])
+def test_pages_add_up_to_the_full_result(size):
+    index = SearchIndex(kits())
+    full, total = index.search("bolt", MIN_CHARS, 0, 1000)
+    paged, paged_total = all_pages(index, "bolt", size)
+    assert paged == full and paged_total == total
+
+
+def test_page_past_the_end_is_empty():
+    index = SearchIndex(kits())
+    assert index.search("bolt", MIN_CHARS, 500, 20) == ([], 135)
+
+
+def test_every_word_but_the_last_is_whole():
+    index = SearchIndex(kits())
+    numbers, total = index.search("bolt m6", MIN_CHARS, 0, 200)
+    assert total == 24                                      # n % 5 == 0
+    numbers, total = index.search("bol m6", MIN_CHARS, 0, 200)
+    assert total == 0
+
+
+def test_short_queries_only_match_names():
+    index = SearchIndex(kits())
+    numbers, total = index.search("b", MIN_CHARS, 0, 5)
+    assert total == 15 and names(index, numbers) == names(index, range(5))
+
+
+def test_prefix_masks_give_the_same_pages(monkeypatch):
+    plain = SearchIndex(kits())
+    monkeypatch.setattr(kit_catalog, "PREFIX_MASK_POSTINGS", 1)
+    masked = SearchIndex(kits())
+    assert masked.prefix_masks and not plain.prefix_masks
+    for query in ("bo", "bolt m", "wa", "washer 1", "ki", "ed", "nu"):
+        for offset in (0, 10, 40):
+            assert masked.search(query, MIN_CHARS, offset, 10) == plain.search(query, MIN_CHARS, offset, 10)
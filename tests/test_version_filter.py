@@ -0,0 +1,78 @@
+"""Optimistic concurrency on activities: version_filter / bump_version (app/kitting_core.py)."""
+import copy
+
+import pytest
+
+pytest.importorskip("flask_socketio")   # importing anything from app runs app/__init__.py
+
+from app.kitting_core import apply_update, bump_version, detection_write, version_filter  # noqa: E402
+
+
+class FakeActivities:
+    """update_one on one in-memory activity, with the filters version_filter builds."""
+
+    def __init__(self, doc):
+        self.doc = doc
+
+    def _matches(self, query):
+        for field, expected in query.items():
+            if expected == {"$exists": False}:
+                if field in self.doc:
+                    return False
+            elif self.doc.get(field) != expected:
+                return False
+        return True
+
+    def update_one(self, query, update):
+        if not self._matches(query):
+            return 0
+        apply_update(self.doc, update)
+        return 1
+
+    def read(self):
+        return copy.deepcopy(self.doc)
+
+
+def activity(**fields):
+    return {"_id": "a1", "cams": {"cam1": {"kit_index": 1}},
+            "components": [{"name": "A", "camera": "cam1", "quantity": 2, "found_quantity": 0}], **fields}
+
+
+def detect(activity_doc):
+    det = {"cam_id": "cam1", "detected_part": "A"}
+    return detection_write(activity_doc, 0, det, {"image_url": "/x.jpg"})
+
+
+def test_version_filter():
+    assert version_filter({"_id": "a1", "version": 4}) == {"_id": "a1", "version": 4}
+    assert version_filter({"_id": "a1"}) == {"_id": "a1", "version": {"$exists": False}}
+
+
+def test_bump_version_keeps_other_increments():
+    update = bump_version({"$inc": {"components.0.found_quantity": 1}})
+    assert update["$inc"] == {"components.0.found_quantity": 1, "version": 1}
+    assert bump_version({"$set": {"x": 1}})["$inc"] == {"version": 1}
+
+
+def test_concurrent_writers_conflict():
+    activities = FakeActivities(activity(version=3))
+    first, second = activities.read(), activities.read()
+
+    assert activities.update_one(*detect(first)) == 1
+    assert activities.update_one(*detect(second)) == 0          # Read version 3, it is now 4
+    assert activities.doc["version"] == 4
+    assert activities.doc["components"][0]["found_quantity"] == 1
+
+    # The loser reads again and retries against the new version
+    assert activities.update_one(*detect(activities.read())) == 1
+    assert activities.doc["version"] == 5
+    assert activities.doc["components"][0]["found_quantity"] == 2
+    assert activities.doc["components"][0]["status"] == "completed"
+
+
+def test_unversioned_job_gets_a_version_on_first_write():
+    activities = FakeActivities(activity())
+    stale = activities.read()
+    assert activities.update_one(*detect(stale)) == 1
+    assert activities.doc["version"] == 1
+    assert activities.update_one(*detect(stale)) == 0           # Its filter wants no version at all
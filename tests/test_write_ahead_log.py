@@ -0,0 +1,124 @@
+"""WriteAheadLog (app/table_workers.py) and the detection buffer's journal replay (app/detection_buffer.py)."""
+import pytest
+
+pytest.importorskip("flask_socketio")   # importing anything from app runs app/__init__.py
+pytest.importorskip("bson")
+pytest.importorskip("pymongo")
+
+from bson import ObjectId  # noqa: E402
+
+from app import detection_buffer  # noqa: E402
+from app.config import Config  # noqa: E402
+from app.table_workers import WriteAheadLog  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def no_fsync(monkeypatch):
+    monkeypatch.setattr(Config, "TABLE_WORKER_WAL_FSYNC", False)
+
+
+def test_entries_survive_a_restart(tmp_path):
+    path = str(tmp_path / "wal" / "worker.wal")
+    wal = WriteAheadLog(path)
+    wal.append({"filter": {"_id": ObjectId()}, "update": {"$inc": {"version": 1}}})
+    wal.append({"receipt": "a1:cam1:1:7"})
+
+    reopened = WriteAheadLog(path)
+    pending = reopened.pending()
+    assert [e["seq"] for e in pending] == [1, 2]
+    assert isinstance(pending[0]["filter"]["_id"], ObjectId)
+    assert pending[1]["receipt"] == "a1:cam1:1:7"
+
+    # Sequence numbers carry on after the leftover entries
+    reopened.append({"receipt": "x"})
+    assert reopened.pending()[-1]["seq"] == 3
+
+
+def test_drop_through_keeps_later_entries(tmp_path):
+    wal = WriteAheadLog(str(tmp_path / "worker.wal"))
+    for n in range(5):
+        wal.append({"n": n})
+    wal.drop_through(3)
+    assert [e["seq"] for e in wal.pending()] == [4, 5]
+
+    # Appends after the swap land in the new file
+    wal.append({"n": 5})
+    assert [e["seq"] for e in wal.pending()] == [4, 5, 6]
+
+    wal.drop_through(6)
+    assert wal.pending() == []
+    wal.append({"n": 6})
+    assert [e["seq"] for e in WriteAheadLog(wal.path).pending()] == [7]
+
+
+def test_then_runs_with_the_numbered_entry(tmp_path):
+    wal = WriteAheadLog(str(tmp_path / "worker.wal"))
+    seen = []
+    wal.append({"n": 0}, then=seen.append)
+    assert seen == [{"n": 0, "seq": 1}]
+
+
+@pytest.fixture
+def written(tmp_path, monkeypatch):
+    """Gives detection_buffer a fresh journal and no MongoDB: flushed batches land in the list."""
+    monkeypatch.setattr(Config, "DETECTION_JOURNAL_PATH", str(tmp_path / "detection-detection_buffer.wal"))
+    monkeypatch.setattr(Config, "DETECTION_FLUSH_RECORDS", 1000)
+    written = []
+    monkeypatch.setattr(detection_buffer, "_write", lambda batch, records: written.append(batch))
+    for name, value in (("_journal", None), ("_pending", {}), ("_count", 0), ("_oldest", None), ("_last_seq", 0)):
+        monkeypatch.setattr(detection_buffer, name, value)
+    return written
+
+
+def restart():
+    """What a new process starts with (the fixture restores the module afterwards)."""
+    detection_buffer._journal = None
+    detection_buffer._pending, detection_buffer._count = {}, 0
+    detection_buffer._oldest, detection_buffer._last_seq = None, 0
+
+
+def test_journal_replay_after_a_crash(written):
+    activity_id = ObjectId()
+    detection_buffer.add(activity_id, "cam1", 1, 0, {"image_url": "/a.jpg"})
+    detection_buffer.add(activity_id, "cam1", 1, 0, {"image_url": "/b.jpg"})
+    detection_buffer.add(activity_id, "cam2", 1, 3, {"image_url": "/c.jpg"})
+
+    restart()                       # The process died before its flush
+    detection_buffer.replay()
+    assert detection_buffer._count == 3 and detection_buffer._last_seq == 3
+    assert detection_buffer.flush() == 3
+    assert written == [{
+        (activity_id, "cam1", 1, 0): [{"image_url": "/a.jpg"}, {"image_url": "/b.jpg"}],
+        (activity_id, "cam2", 1, 3): [{"image_url": "/c.jpg"}]
+    }]
+    assert detection_buffer._open_journal().pending() == []
+
+
+def test_flush_keeps_records_journaled_after_it_started(written, monkeypatch):
+    activity_id = ObjectId()
+    detection_buffer.add(activity_id, "cam1", 1, 0, {"image_url": "/a.jpg"})
+
+    def write_while_a_detection_arrives(batch, records):
+        written.append(batch)
+        detection_buffer.add(activity_id, "cam1", 1, 0, {"image_url": "/b.jpg"})
+
+    monkeypatch.setattr(detection_buffer, "_write", write_while_a_detection_arrives)
+    assert detection_buffer.flush() == 1
+    assert [e["record"]["image_url"] for e in detection_buffer._open_journal().pending()] == ["/b.jpg"]
+
+    restart()
+    detection_buffer.replay()
+    assert detection_buffer._pending == {(activity_id, "cam1", 1, 0): [{"image_url": "/b.jpg"}]}
+
+
+def test_failed_flush_keeps_the_journal(written, monkeypatch):
+    detection_buffer.add(ObjectId(), "cam1", 1, 0, {"image_url": "/a.jpg"})
+
+    def unreachable(batch, records):
+        raise ConnectionError("MongoDB down")
+
+    monkeypatch.setattr(detection_buffer, "_write", unreachable)
+    with pytest.raises(ConnectionError):
+        detection_buffer.flush()
+    assert detection_buffer._count == 1
+    assert len(detection_buffer._open_journal().pending()) == 1